@@ -3,6 +3,9 @@ ASGI config for artparty project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server, e.g. `uvicorn artparty.asgi:application`
+(uvicorn is in the Pipfile); the async views and /events need one.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -12,5 +15,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'artparty.settings')
+# Serve the hot read endpoints from the async views
+os.environ.setdefault('ARTPARTY_ROOT_URLCONF', 'artparty.urls_asgi')
+
+django_application = get_asgi_application()
+
+# Imported once Django is set up, since it loads the models
+from artparty.sse import with_events  # noqa: E402
 
-application = get_asgi_application()
+# /events (live artwork events) is served next to Django rather than through it
+application = with_events(django_application)
@@ -0,0 +1,86 @@
+"""Database settings read from the environment, and per-connection tuning.
+
+ARTPARTY_DB_ENGINE picks the backend: `sqlite` (the default) or `postgres`,
+which needs psycopg2 (psycopg2-binary in the Pipfile). The other
+ARTPARTY_DB_* variables fill in the connection details, and
+ARTPARTY_DB_REPLICAS adds read replicas (see routers.py)."""
+import os
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def flag(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_config(environ=os.environ, base_dir=None):
+    """The DATABASES['default'] entry described by `environ`"""
+    engine = environ.get('ARTPARTY_DB_ENGINE', 'sqlite').strip().lower()
+    if engine in ('postgres', 'postgresql'):
+        config = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': environ.get('ARTPARTY_DB_NAME', 'artparty'),
+            'USER': environ.get('ARTPARTY_DB_USER', 'artparty'),
+            'PASSWORD': environ.get('ARTPARTY_DB_PASSWORD', ''),
+            'HOST': environ.get('ARTPARTY_DB_HOST', 'localhost'),
+            'PORT': environ.get('ARTPARTY_DB_PORT', '5432'),
+            # Reuse each worker's connection across requests, and check it is
+            # still alive before handing it to a new request
+            'CONN_MAX_AGE': int(environ.get('ARTPARTY_DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': flag(environ.get('ARTPARTY_DB_CONN_HEALTH_CHECKS', 'true')),
+            # QuerySet.iterator() streams through server-side cursors, which a
+            # transaction-pooling PgBouncer can't hold; set this behind one
+            'DISABLE_SERVER_SIDE_CURSORS': flag(environ.get('ARTPARTY_DB_DISABLE_SERVER_SIDE_CURSORS', 'false')),
+            'OPTIONS': {
+                'connect_timeout': int(environ.get('ARTPARTY_DB_CONNECT_TIMEOUT', 5)),
+            },
+        }
+    elif engine in ('sqlite', 'sqlite3'):
+        config = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': environ.get('ARTPARTY_DB_NAME') or (base_dir / 'db.sqlite3' if base_dir else 'db.sqlite3'),
+            'CONN_MAX_AGE': int(environ.get('ARTPARTY_DB_CONN_MAX_AGE', 0)),
+        }
+    else:
+        raise ImproperlyConfigured(f'Unknown ARTPARTY_DB_ENGINE {engine!r}; use "sqlite" or "postgres"')
+
+    if environ.get('ARTPARTY_DB_TEST_NAME'):
+        config['TEST'] = {'NAME': environ['ARTPARTY_DB_TEST_NAME']}
+    return config
+
+
+def replica_configs(primary, environ=os.environ):
+    """DATABASES entries for the read replicas in ARTPARTY_DB_REPLICAS, a comma
+    separated list of hosts (host or host:port) for PostgreSQL, or of database
+    files for SQLite. Each replica is the primary's config pointed elsewhere.
+    Returns: {alias: config}, with aliases replica_1, replica_2 ..."""
+    configs = {}
+    locations = [location.strip() for location in environ.get('ARTPARTY_DB_REPLICAS', '').split(',') if location.strip()]
+    for number, location in enumerate(locations, start=1):
+        config = {**primary, 'OPTIONS': dict(primary.get('OPTIONS', {}))}
+        if config['ENGINE'] == 'django.db.backends.sqlite3':
+            config['NAME'] = location
+        else:
+            config['HOST'], _, port = location.partition(':')
+            config['PORT'] = port or primary.get('PORT', '')
+        # Tests run against the primary alone
+        config['TEST'] = {'MIRROR': 'default'}
+        configs[f'replica_{number}'] = config
+    return configs
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Lets SQLite readers and a writer work side by side: WAL journaling,
+    fsync only at checkpoints, and waiting on a locked database instead of
+    failing straight away"""
+    if connection.vendor != 'sqlite':
+        return
+    # Straight on the sqlite3 connection, so these stay out of query logs and metrics
+    db = connection.connection
+    # In-memory databases (the test database) keep their own journal mode
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute(f'PRAGMA busy_timeout={int(settings.ARTPARTY_SQLITE_BUSY_TIMEOUT_MS)}')
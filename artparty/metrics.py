@@ -0,0 +1,204 @@
+"""Per-route request metrics.
+
+MetricsMiddleware times every request and the SQL it runs, and keeps the
+latest samples for each route in an in-process ring buffer. `metrics_view`
+reports p50/p95/p99 of those samples in the Prometheus text format.
+
+Samples live in the worker's memory, so each worker reports only the
+requests it served."""
+import asyncio
+import hmac
+import logging
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Prometheus metric name, help text and the sample field it reports
+METRICS = (
+    ('artparty_request_seconds', 'Wall time of the request', 'wall'),
+    ('artparty_db_seconds', 'Time spent running SQL', 'db'),
+    ('artparty_serialize_seconds', 'Time spent in the view and renderer outside SQL', 'serialize'),
+    ('artparty_db_queries', 'SQL statements run', 'queries'),
+)
+
+
+class RouteStats:
+    """Recent samples and running totals for one route"""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.totals = defaultdict(float)
+
+    def add(self, sample):
+        self.samples.append(sample)
+        self.count += 1
+        for field, value in sample.items():
+            self.totals[field] += value
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, sample):
+        with self.lock:
+            if route not in self.routes:
+                self.routes[route] = RouteStats(getattr(settings, 'ARTPARTY_METRICS_BUFFER_SIZE', 1000))
+            self.routes[route].add(sample)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                route: (list(stats.samples), stats.count, dict(stats.totals))
+                for route, stats in self.routes.items()
+            }
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+
+
+registry = MetricsRegistry()
+
+
+def quantile(sorted_values, q):
+    """Nearest-rank quantile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+class QueryTimer:
+    """execute_wrapper that counts and times SQL and remembers the slowest statement"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.heaviest = (0.0, None)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if elapsed >= self.heaviest[0]:
+                self.heaviest = (elapsed, sql)
+
+
+def time_queries(stack, timer):
+    """Routes the current thread's SQL through `timer` until `stack` closes"""
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(timer))
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Lets the handler await this middleware instead of running it in a thread
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if request.path == '/_metrics':
+            return self.get_response(request)
+
+        timer = QueryTimer()
+        request._metrics_view_started = None
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            time_queries(stack, timer)
+            response = self.get_response(request)
+        self.record(request, timer, start, time.perf_counter())
+        return response
+
+    async def __acall__(self, request):
+        if request.path == '/_metrics':
+            return await self.get_response(request)
+
+        timer = QueryTimer()
+        request._metrics_view_started = None
+        start = time.perf_counter()
+        # Connections are per thread, and async views query from the
+        # request's sync thread, so the wrappers go on that thread's
+        stack = ExitStack()
+        await sync_to_async(time_queries)(stack, timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, timer, start, time.perf_counter())
+        return response
+
+    def record(self, request, timer, start, end):
+        view_started = request._metrics_view_started or end
+        sample = {
+            'wall': end - start,
+            'db': timer.seconds,
+            'serialize': max(0.0, (end - view_started) - timer.seconds),
+            'queries': timer.count,
+        }
+        match = getattr(request, 'resolver_match', None)
+        route = (match.url_name or match.view_name) if match else 'unmatched'
+        registry.record(route, sample)
+
+        if sample['wall'] >= getattr(settings, 'ARTPARTY_SLOW_REQUEST_SECONDS', 1.0):
+            heaviest_seconds, heaviest_sql = timer.heaviest
+            logger.warning(
+                'Slow request %s %s (%s): %.3fs wall, %d queries in %.3fs; heaviest %.3fs: %s',
+                request.method, request.get_full_path(), route, sample['wall'],
+                timer.count, timer.seconds, heaviest_seconds, heaviest_sql,
+            )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view_started = time.perf_counter()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view_started = time.perf_counter()
+
+
+def render_prometheus(snapshot):
+    lines = []
+    for name, help_text, field in METRICS:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} summary')
+        for route, (samples, count, totals) in sorted(snapshot.items()):
+            values = sorted(sample[field] for sample in samples)
+            for q in QUANTILES:
+                lines.append(f'{name}{{route="{route}",quantile="{q}"}} {quantile(values, q):.6f}')
+            lines.append(f'{name}_sum{{route="{route}"}} {totals.get(field, 0.0):.6f}')
+            lines.append(f'{name}_count{{route="{route}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, for staff sessions or a bearer token matching ARTPARTY_METRICS_TOKEN"""
+    token = getattr(settings, 'ARTPARTY_METRICS_TOKEN', None)
+    authorized = request.user.is_authenticated and request.user.is_staff
+    if token and hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        authorized = True
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(registry.snapshot()), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,139 @@
+"""Read replica routing.
+
+ReplicaMiddleware picks one replica from ARTPARTY_DATABASE_REPLICAS for
+each GET, HEAD or OPTIONS request, and ReplicaRouter sends that request's
+reads there. Writes, reads inside write requests, and everything outside a
+request go to the primary ('default').
+
+Replicas lag the primary, so after a successful write a client reads from
+the primary for ARTPARTY_REPLICA_STICKY_SECONDS. The response carries the
+end of that window in a cookie and in the X-Primary-Until header; browsers
+send the cookie back on their own, and other clients echo the header."""
+import asyncio
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+STICKY_COOKIE = 'primary_until'
+
+STICKY_HEADER = 'X-Primary-Until'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Database alias the current request reads from, or None for the primary
+_read_alias = ContextVar('artparty_read_alias', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'ARTPARTY_DATABASE_REPLICAS', ()))
+
+
+def sticky_seconds():
+    return getattr(settings, 'ARTPARTY_REPLICA_STICKY_SECONDS', 5)
+
+
+def reading_from_replica():
+    """True while the current request's reads go to a replica"""
+    return _read_alias.get() is not None
+
+
+@contextmanager
+def read_from_primary():
+    """Sends the reads inside the block to the primary, whatever replica the request chose"""
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def is_sticky(request):
+    """True when the client wrote recently enough that a replica may not have its write yet"""
+    for value in (request.COOKIES.get(STICKY_COOKIE), request.headers.get(STICKY_HEADER)):
+        try:
+            if value and float(value) > time.time():
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+class ReplicaRouter:
+    """Sends reads to the replica ReplicaMiddleware chose for the request"""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Lets the handler await this middleware instead of running it in a thread
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        alias = self.choose(request)
+        token = _read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.finish(request, response, alias)
+
+    async def __acall__(self, request):
+        # Context variables follow the request into sync_to_async threads
+        alias = self.choose(request)
+        token = _read_alias.set(alias)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.finish(request, response, alias)
+
+    def choose(self, request):
+        """The replica the request reads from, or None for the primary"""
+        pool = replicas()
+        if pool and request.method in SAFE_METHODS and not is_sticky(request):
+            # One replica for the whole request, so its reads see one point in time
+            return random.choice(pool)
+        return None
+
+    def finish(self, request, response, alias):
+        pool = replicas()
+        if alias is not None and response.streaming:
+            response.streaming_content = self.stream_from(alias, response.streaming_content)
+
+        if pool and request.method not in SAFE_METHODS and response.status_code < 400:
+            until = str(int(time.time() + sticky_seconds()) + 1)
+            response.set_cookie(STICKY_COOKIE, until, max_age=sticky_seconds(), httponly=True, samesite='Lax')
+            response[STICKY_HEADER] = until
+        return response
+
+    def stream_from(self, alias, chunks):
+        """Streamed bodies are read after the view returns; keep them on the replica"""
+        chunks = iter(chunks)
+        while True:
+            token = _read_alias.set(alias)
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                _read_alias.reset(token)
+            yield chunk
@@ -10,7 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
+from artparty.database import database_config, replica_configs
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,7 +50,35 @@ CORS_ORIGIN_WHITELIST = (
     'http://127.0.0.1:3000'
 )
 
+# Clients that don't send cookies echo this back to keep reading their own writes
+CORS_ALLOW_HEADERS = (*default_headers, 'x-primary-until')
+
+CORS_EXPOSE_HEADERS = ('X-Primary-Until',)
+
+REST_FRAMEWORK = {
+    # Clients identify themselves with a Firebase ID token, see ARTPARTY_FIREBASE_PROJECT_ID
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'artpartyapi.authentication.FirebaseAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    # Per-client limits, see ARTPARTY_THROTTLES
+    'DEFAULT_THROTTLE_CLASSES': [
+        'artpartyapi.throttling.TokenBucketThrottle',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'artpartyapi.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Set to a number to paginate the list endpoints by default; when None
+    # clients opt in with ?page_size= or ?cursor=
+    'PAGE_SIZE': None,
+}
+
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'artparty.metrics.MetricsMiddleware',
+    # Before anything that reads the database
+    'artparty.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -58,7 +89,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'artparty.urls'
+# asgi.py switches this to artparty.urls_asgi, which adds the async views
+ROOT_URLCONF = os.environ.get('ARTPARTY_ROOT_URLCONF', 'artparty.urls')
 
 TEMPLATES = [
     {
@@ -81,14 +113,186 @@ WSGI_APPLICATION = 'artparty.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+# Configured from ARTPARTY_DB_* environment variables, see artparty/database.py.
+# SQLite in BASE_DIR by default; ARTPARTY_DB_ENGINE=postgres for PostgreSQL
+# (docker-compose.yml has one for local use and for running the tests).
 
 DATABASES = {
+    'default': database_config(os.environ, BASE_DIR),
+}
+
+# Read replicas from ARTPARTY_DB_REPLICAS. GET requests read from one of
+# them, except for a client's first ARTPARTY_REPLICA_STICKY_SECONDS after
+# it writes. To try it locally with SQLite, copy db.sqlite3 to replica.sqlite3
+# and set ARTPARTY_DB_REPLICAS=replica.sqlite3.
+DATABASES.update(replica_configs(DATABASES['default'], os.environ))
+
+DATABASE_ROUTERS = ['artparty.routers.ReplicaRouter']
+
+ARTPARTY_DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+ARTPARTY_REPLICA_STICKY_SECONDS = 5
+
+# How long a SQLite connection waits on a locked database before giving up
+ARTPARTY_SQLITE_BUSY_TIMEOUT_MS = 5000
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The response cache is keyed by generation counters kept in the cache, so
+# every worker has to see the same counters or a write in one leaves the
+# others serving stale responses. It is off unless ARTPARTY_CACHE_RESPONSES
+# is set, and then ARTPARTY_CACHE_ALIAS must name a shared backend (Redis,
+# Memcached, the database); a per-process LocMemCache fails the system checks.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+ARTPARTY_CACHE_ALIAS = 'default'
+
+ARTPARTY_CACHE_RESPONSES = os.environ.get('ARTPARTY_CACHE_RESPONSES', '').lower() == 'true'
+
+ARTPARTY_CACHE_TIMEOUT = 300
+
+# Viewset basename -> seconds a read waits on an identical one already
+# running in this process instead of running the view too, see
+# artpartyapi/coalesce.py. Viewsets not listed aren't coalesced.
+
+ARTPARTY_COALESCE = {
+    'artwork': 5,
+    'artist': 5,
+    'tag': 5,
+    'user': 5,
+}
+
+
+# Per-client rate limits, see artpartyapi/throttling.py. Viewset basename,
+# "basename.action" or function view name -> token buckets for authenticated
+# clients ('uid') and anonymous ones by IP address ('ip'), each (requests
+# refilled per second, most requests in a burst). Views and kinds not listed
+# aren't limited. Buckets are kept in ARTPARTY_CACHE_ALIAS, which must be a
+# cache every worker shares; the system checks refuse a per-process one. For
+# example, to limit sign-in checks and artwork writes:
+#
+#     ARTPARTY_THROTTLES = {
+#         'check_user': {'uid': (1, 10), 'ip': (1, 10)},
+#         'artwork.create': {'uid': (1, 30), 'ip': (1, 30)},
+#         'artwork.bulk': {'uid': (0.1, 5), 'ip': (0.1, 5)},
+#     }
+
+ARTPARTY_THROTTLES = {}
+
+
+# Firebase ID tokens ("Authorization: Bearer <token>") are verified against
+# this project with google-auth, see artpartyapi/authentication.py. Unset,
+# no token is accepted. ARTPARTY_ID_TOKEN_VERIFIER names the function that
+# checks a token. Writes need a registered user's token, unless
+# ARTPARTY_BODY_USER lets tokenless requests name their user in the body:
+# anyone can then act as anyone, so it is only for local development and
+# is ignored once a Firebase project is set.
+
+ARTPARTY_FIREBASE_PROJECT_ID = os.environ.get('ARTPARTY_FIREBASE_PROJECT_ID')
+
+ARTPARTY_ID_TOKEN_VERIFIER = 'artpartyapi.authentication.verify_firebase_token'
+
+ARTPARTY_BODY_USER = os.environ.get('ARTPARTY_BODY_USER', '').lower() == 'true'
+
+# uid -> user lookups and verified tokens cached per worker by FirebaseAuthentication
+
+ARTPARTY_UID_CACHE_SIZE = 10000
+
+ARTPARTY_UID_CACHE_TTL = 300
+
+
+# Request metrics, served at /_metrics
+# Samples kept per route for the percentiles, requests slower than
+# ARTPARTY_SLOW_REQUEST_SECONDS are logged with their heaviest SQL, and
+# ARTPARTY_METRICS_TOKEN lets a scraper in with "Authorization: Bearer <token>"
+
+ARTPARTY_METRICS_BUFFER_SIZE = 1000
+
+ARTPARTY_SLOW_REQUEST_SECONDS = 1.0
+
+ARTPARTY_METRICS_TOKEN = None
+
+
+# Delta sync at /sync, see artpartyapi/changelog.py
+# Changes (or snapshot rows) sent per response, how long a change must be old before tokens
+# move past it, and how many days of changes compact_changelog keeps
+# (older tokens get a full snapshot)
+
+ARTPARTY_SYNC_PAGE_SIZE = 1000
+
+ARTPARTY_SYNC_SETTLE_SECONDS = 5
+
+ARTPARTY_SYNC_RETENTION_DAYS = 30
+
+
+# Live artwork events at /events (Server-Sent Events, ASGI only), see
+# artpartyapi/events.py. Events a slow client may fall behind before it is
+# dropped, events kept for reconnecting clients, seconds between keepalive
+# comments, and the fan-out that carries events between processes
+
+ARTPARTY_EVENTS_QUEUE_SIZE = 100
+
+ARTPARTY_EVENTS_REPLAY_SIZE = 1000
+
+ARTPARTY_EVENTS_HEARTBEAT_SECONDS = 15
+
+ARTPARTY_EVENTS_FANOUT = 'artpartyapi.events.LocalFanout'
+
+
+# Background jobs, run by `manage.py runworker`, see artpartyapi/jobs.py.
+# Artwork writes queue their search index, feed and counter updates there;
+# ARTPARTY_JOBS_EAGER=true runs jobs inline instead, as the tests do.
+# Worker threads or processes, seconds between polls of an idle queue,
+# attempts before a job is left failed, the first retry delay (doubling
+# up to the max), and how long a job may run before it counts as abandoned
+
+ARTPARTY_JOBS_EAGER = os.environ.get('ARTPARTY_JOBS_EAGER', '').lower() == 'true'
+
+ARTPARTY_JOBS_CONCURRENCY = 4
+
+ARTPARTY_JOBS_POLL_SECONDS = 1
+
+ARTPARTY_JOBS_MAX_ATTEMPTS = 5
+
+ARTPARTY_JOBS_RETRY_SECONDS = 10
+
+ARTPARTY_JOBS_MAX_RETRY_SECONDS = 3600
+
+ARTPARTY_JOBS_LOCK_SECONDS = 600
+
+
+# Artwork image metadata and thumbnails, see artpartyapi/images.py.
+# New artwork images are fetched by a job with ARTPARTY_IMAGE_FETCHER (None
+# turns this off), which only reaches public hosts unless
+# ARTPARTY_IMAGE_ALLOW_PRIVATE_HOSTS. Thumbnails fit each of
+# ARTPARTY_THUMBNAIL_SIZES and live in ARTPARTY_THUMBNAIL_ROOT, where the
+# least recently used go once it holds ARTPARTY_THUMBNAIL_STORE_BYTES.
+# Point ARTPARTY_THUMBNAIL_URL at this server's absolute /thumbnails/ URL
+# (or a CDN in front of it) when the frontend is served from elsewhere.
+# Colours and thumbnails need Pillow; without it only dimensions are read
+
+ARTPARTY_IMAGE_FETCHER = 'artpartyapi.images.HTTPFetcher'
+
+ARTPARTY_IMAGE_FETCH_TIMEOUT = 10
+
+ARTPARTY_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+
+ARTPARTY_IMAGE_ALLOW_PRIVATE_HOSTS = False
+
+ARTPARTY_THUMBNAIL_SIZES = (160, 320, 640)
+
+ARTPARTY_THUMBNAIL_ROOT = BASE_DIR / 'thumbnails'
+
+ARTPARTY_THUMBNAIL_STORE_BYTES = 1024 ** 3
+
+ARTPARTY_THUMBNAIL_URL = '/thumbnails/'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -0,0 +1,123 @@
+"""Server-Sent Events stream of artwork events, at /events.
+
+A bare ASGI app that asgi.py puts in front of Django: Django 4.1 streams
+responses synchronously, which would hold a thread for every connected
+client. Here an idle connection is a coroutine waiting on its queue in
+artpartyapi.events.hub, and nothing polls the database.
+
+?featured=true keeps only events about featured artworks (including ones
+that were just unfeatured or deleted), which is what the homepage needs.
+A reconnecting EventSource sends Last-Event-ID and is replayed what it
+missed; if that is no longer buffered it gets a `reset` event and should
+reload the feed."""
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+from corsheaders.conf import conf as cors
+from django.conf import settings
+from artpartyapi.events import hub
+
+PATH = '/events'
+
+
+def heartbeat_seconds():
+    return getattr(settings, 'ARTPARTY_EVENTS_HEARTBEAT_SECONDS', 15)
+
+
+def format_event(event):
+    data = json.dumps(event.data, separators=(',', ':'), default=str)
+    return f'id: {event.id}\nevent: {event.type}\ndata: {data}\n\n'.encode()
+
+
+def allowed_origin(origin):
+    """The Access-Control-Allow-Origin for `origin` under the CORS settings, or None"""
+    if not origin:
+        return None
+    if cors.CORS_ALLOW_ALL_ORIGINS:
+        return '*'
+    if origin in cors.CORS_ALLOWED_ORIGINS or any(re.match(pattern, origin) for pattern in cors.CORS_ALLOWED_ORIGIN_REGEXES):
+        return origin
+    return None
+
+
+def with_events(application):
+    """Wraps the Django ASGI application so /events is served here"""
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == PATH:
+            return await events(scope, receive, send)
+        return await application(scope, receive, send)
+    return app
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def events(scope, receive, send):
+    headers = {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope['headers']}
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+    featured_only = query.get('featured', [''])[0].lower() == 'true'
+    last_event_id = headers.get('last-event-id') or query.get('last_event_id', [None])[0]
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    response_headers = [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        # Stop nginx from buffering the stream
+        (b'x-accel-buffering', b'no'),
+    ]
+    origin = allowed_origin(headers.get('origin'))
+    if origin:
+        response_headers += [(b'access-control-allow-origin', origin.encode('latin1')), (b'vary', b'Origin')]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+
+    subscription, replay = hub.subscribe(last_event_id)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        if replay is None:
+            await send_chunk(send, b'event: reset\ndata: {}\n\n')
+        else:
+            for event in replay:
+                if not featured_only or event.featured:
+                    await send_chunk(send, format_event(event))
+
+        while not disconnected.done():
+            waiting = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait({waiting, disconnected}, timeout=heartbeat_seconds(),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if waiting not in done:
+                waiting.cancel()
+                if not disconnected.done():
+                    # Keeps proxies and load balancers from closing an idle stream
+                    await send_chunk(send, b': keepalive\n\n')
+                continue
+            if subscription.overflowed:
+                # Too far behind: drop the client, whose reconnect catches up from the replay buffer
+                break
+            event = waiting.result()
+            if not featured_only or event.featured:
+                await send_chunk(send, format_event(event))
+    except OSError:
+        # The client went away mid-send
+        pass
+    finally:
+        hub.unsubscribe(subscription)
+        disconnected.cancel()
+    try:
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    except OSError:
+        pass
+
+
+async def send_chunk(send, body):
+    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
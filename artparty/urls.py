@@ -15,10 +15,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.conf.urls import include
 from rest_framework import routers
-from artpartyapi.views import ArtistView, ArtworkView, TagView, ArtworkTagView, UserView, register_user, check_user
+from artparty.metrics import metrics_view
+from artpartyapi.views import (
+    ArtistView, ArtworkView, TagView, ArtworkTagView, UserView, register_user, check_user, sync, thumbnail,
+)
 
 router = routers.DefaultRouter(trailing_slash=False)
 router.register(r'artists', ArtistView, 'artist')
@@ -32,4 +35,7 @@ urlpatterns = [
     path('', include(router.urls)),
     path('register', register_user),
     path('checkuser', check_user),
+    path('sync', sync),
+    re_path(r'^thumbnails/(?P<content_hash>[0-9a-f]{64})-(?P<size>[0-9]+)\.jpg$', thumbnail),
+    path('_metrics', metrics_view),
 ]
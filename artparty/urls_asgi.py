@@ -0,0 +1,16 @@
+"""URL configuration for the ASGI server.
+
+The same routes as artparty.urls, with the hot read endpoints answered by
+the async views in artpartyapi.views.async_views. asgi.py selects it
+through ARTPARTY_ROOT_URLCONF; WSGI keeps artparty.urls."""
+from django.urls import path, re_path
+from artparty import urls
+from artpartyapi.views import async_views
+
+urlpatterns = [
+    path('artworks', async_views.artwork_list, name='artwork-list'),
+    # Numeric ids only, so /artworks/export and the other actions reach the router
+    re_path(r'^artworks/(?P<pk>[0-9]+)$', async_views.artwork_detail, name='artwork-detail'),
+    path('tags', async_views.tag_list, name='tag-list'),
+    path('checkuser', async_views.check_user),
+] + urls.urlpatterns
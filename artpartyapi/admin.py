@@ -1,3 +1,20 @@
 from django.contrib import admin
+from artpartyapi.models import FeaturedArtwork, Job
 
-# Register your models here.
+
+@admin.register(FeaturedArtwork)
+class FeaturedArtworkAdmin(admin.ModelAdmin):
+    """Homepage order: lower ranks come first"""
+    list_display = ('artwork', 'rank', 'updated_at')
+    list_editable = ('rank',)
+    ordering = ('rank', 'artwork')
+    readonly_fields = ('artwork', 'data', 'updated_at')
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Queued and failed background jobs; succeeded ones are deleted"""
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'locked_by')
+    list_filter = ('status', 'name')
+    ordering = ('run_at', 'id')
+    readonly_fields = ('name', 'payload', 'key', 'attempts', 'locked_by', 'locked_at', 'last_error', 'created_at')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ArtpartyapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'artpartyapi'
+
+    def ready(self):
+        # Connects the model signal receivers and registers the system checks
+        from . import checks, signals  # noqa: F401
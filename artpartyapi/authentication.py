@@ -0,0 +1,200 @@
+"""Resolves the calling user from a Firebase ID token.
+
+Clients send the ID token Firebase issued them as "Authorization: Bearer
+<token>". FirebaseAuthentication has ARTPARTY_ID_TOKEN_VERIFIER check it
+and looks the user up by the uid it was issued to; a bare uid proves
+nothing. Without ARTPARTY_FIREBASE_PROJECT_ID no token verifies.
+
+Writes act for the authenticated user. Only with ARTPARTY_BODY_USER set,
+no Firebase project and no token may a request name its user in the body
+instead, as clients did before ID tokens; that is for local development."""
+import threading
+import time
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, PermissionDenied, ValidationError
+from artpartyapi.models import User
+
+try:
+    from google.auth.exceptions import GoogleAuthError
+    from google.auth.transport.requests import Request as GoogleRequest
+    from google.oauth2 import id_token
+except ImportError:  # pragma: no cover - only needed with a Firebase project
+    id_token = None
+
+
+class UidCache:
+    """In-process LRU map of uid -> User whose entries expire after `ttl` seconds.
+
+    User saves and deletes discard their entry (see signals.py); the TTL
+    bounds how long another worker can keep serving an old copy. Verified
+    ID tokens are kept in one as well, mapped to their uid."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, uid):
+        with self.lock:
+            entry = self.entries.get(uid)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self.entries[uid]
+                return None
+            self.entries.move_to_end(uid)
+            return user
+
+    def set(self, uid, user, ttl=None):
+        """Keeps `user` for `ttl` seconds, at most the cache's own ttl"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self.lock:
+            self.entries[uid] = (user, time.monotonic() + ttl)
+            self.entries.move_to_end(uid)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def discard(self, uid):
+        with self.lock:
+            self.entries.pop(uid, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+uid_cache = UidCache(
+    maxsize=getattr(settings, 'ARTPARTY_UID_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'ARTPARTY_UID_CACHE_TTL', 300),
+)
+
+token_cache = UidCache(
+    maxsize=getattr(settings, 'ARTPARTY_UID_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'ARTPARTY_UID_CACHE_TTL', 300),
+)
+
+
+def verify_firebase_token(token):
+    """Checks a Firebase ID token's signature, expiry and project.
+    Returns: its claims, or None if it isn't valid"""
+    project = getattr(settings, 'ARTPARTY_FIREBASE_PROJECT_ID', None)
+    if not project or id_token is None:
+        return None
+    try:
+        return id_token.verify_firebase_token(token, GoogleRequest(), audience=project)
+    except (GoogleAuthError, ValueError):
+        return None
+
+
+def token_uid(token):
+    """The uid a valid ID token was issued to, or None. Verified tokens are
+    cached until they expire, for at most ARTPARTY_UID_CACHE_TTL."""
+    uid = token_cache.get(token)
+    if uid is None:
+        verify = import_string(getattr(settings, 'ARTPARTY_ID_TOKEN_VERIFIER', 'artpartyapi.authentication.verify_firebase_token'))
+        claims = verify(token)
+        if not claims or not claims.get('sub'):
+            return None
+        uid = claims['sub']
+        token_cache.set(token, uid, ttl=claims['exp'] - time.time() if 'exp' in claims else None)
+    return uid
+
+
+def bearer_token(request):
+    """The token of a "Bearer <token>" Authorization header, or None"""
+    parts = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(parts) != 2 or parts[0].lower() != 'bearer':
+        return None
+    return parts[1]
+
+
+def resolve_uid(uid):
+    """The user with `uid`, or None. Found users are cached."""
+    user = uid_cache.get(uid)
+    if user is None:
+        user = User.objects.filter(uid=uid).first()
+        if user is not None:
+            uid_cache.set(uid, user)
+    return user
+
+
+async def aresolve_uid(uid):
+    """resolve_uid for async views"""
+    user = uid_cache.get(uid)
+    if user is None:
+        user = await User.objects.filter(uid=uid).afirst()
+        if user is not None:
+            uid_cache.set(uid, user)
+    return user
+
+
+async def arequest_user(request):
+    """The registered user a plain Django request's ID token names, or None"""
+    token = bearer_token(request)
+    # Verifying may fetch Google's signing keys
+    uid = await sync_to_async(token_uid)(token) if token else None
+    return await aresolve_uid(uid) if uid else None
+
+
+def body_user_allowed(request):
+    """Whether the request may name the user it acts for in its body"""
+    return (getattr(settings, 'ARTPARTY_BODY_USER', False)
+            and not getattr(settings, 'ARTPARTY_FIREBASE_PROJECT_ID', None)
+            and bearer_token(request) is None)
+
+
+def check_writer(request):
+    """Raises NotAuthenticated unless the request comes from a registered
+    user, or body_user_allowed()"""
+    if not isinstance(request.user, User) and not body_user_allowed(request):
+        raise NotAuthenticated('Writes need the ID token of a registered user')
+
+
+def owner_id(request, named):
+    """The id of the user a write acts for, given the user id it `named`
+    (None if none). Authenticated users can only name themselves.
+    Raises NotAuthenticated or PermissionDenied"""
+    check_writer(request)
+    if not isinstance(request.user, User):
+        return named
+    if named is not None and str(named) != str(request.user.id):
+        raise PermissionDenied('Writes can only act for the authenticated user')
+    return request.user.id
+
+
+def get_request_user(request):
+    """The user making a write: the authenticated one, or the one named by
+    the `user` field where body_user_allowed()"""
+    user_id = owner_id(request, request.data.get('user'))
+    if isinstance(request.user, User):
+        return request.user
+    if user_id is None:
+        raise ValidationError({'user': ['This field is required.']})
+    return User.objects.get(pk=user_id)
+
+
+class FirebaseAuthentication(BaseAuthentication):
+    """Authenticates requests that send a Firebase ID token as a bearer
+    token. Invalid tokens are rejected. Valid ones for a uid nobody has
+    registered are left anonymous, so a new user can still reach /register."""
+
+    def authenticate(self, request):
+        token = bearer_token(request)
+        if token is None:
+            return None
+        uid = token_uid(token)
+        if uid is None:
+            raise AuthenticationFailed('Invalid or expired ID token')
+        user = resolve_uid(uid)
+        if user is None:
+            return None
+        return (user, token)
+
+    def authenticate_header(self, request):
+        return 'Bearer'
@@ -0,0 +1,252 @@
+"""Benchmark harness for the main read endpoints.
+
+Requests go through Django's test client, so the numbers cover routing,
+middleware, the ORM, serializers and rendering but not a real server or
+network. Run it with `manage.py benchmark`, which builds a throwaway
+database and fills it with synthetic data (see synthetic.py).
+
+With --concurrency the command also compares throughput under concurrent
+load through the WSGI stack (a thread per request, like a threaded WSGI
+server) and the ASGI stack (the async views on one event loop)."""
+import asyncio
+import json
+import math
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import django
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.db.models import Max, Min
+from artpartyapi.models import Artwork, Tag, User
+
+# Name and URL template of each benchmarked request; ids are filled in from the data
+ENDPOINTS = (
+    ('artwork-list-page', '/artworks?page_size=50'),
+    ('artwork-list-featured', '/artworks?featured=true'),
+    ('artwork-list-user', '/artworks?user={user}&page_size=50'),
+    ('artwork-list-tags', '/artworks?tags={tag},{other_tag}&match=any&page_size=50'),
+    ('artwork-detail', '/artworks/{artwork}'),
+    ('artwork-search', '/artworks/search?q=dragon'),
+    ('tag-list', '/tags'),
+    ('artworktag-page', '/artworktags?page_size=50'),
+)
+
+# Endpoints with async views, for the concurrency comparison
+CONCURRENT_ENDPOINTS = ('artwork-list-page', 'artwork-list-featured', 'artwork-list-user', 'artwork-detail', 'tag-list')
+
+# URLconf each server uses (see asgi.py)
+URLCONFS = {'wsgi': 'artparty.urls', 'asgi': 'artparty.urls_asgi'}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * q / 100) - 1)] if ordered else 0.0
+
+
+def sample_ids(rng):
+    """Random ids to substitute into the endpoint URLs"""
+    def pick(model):
+        # Seek from a random point in the id range rather than ORDER BY RANDOM() over the table
+        bounds = model.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            return 0
+        row = model.objects.filter(id__gte=rng.randint(bounds['low'], bounds['high'])).order_by('id').first()
+        return row.id
+    tags = list(Tag.objects.values_list('id', flat=True)[:50])
+    return {
+        'user': pick(User),
+        'artwork': pick(Artwork),
+        'tag': rng.choice(tags) if tags else 0,
+        'other_tag': rng.choice(tags) if tags else 0,
+    }
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(client, url, requests, warm_cache=False):
+    """Runs `requests` GETs of `url` and summarises them.
+
+    Unless `warm_cache` is set the response cache is cleared before each
+    request, so the numbers reflect the ORM path. Peak memory comes from one
+    extra traced request, since tracing slows everything else down."""
+    latencies, queries, statuses = [], [], set()
+    # One unmeasured request first, so lazy imports and URL resolver setup aren't counted
+    client.get(url)
+    started = time.perf_counter()
+    for _ in range(requests):
+        if not warm_cache:
+            cache.clear()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            request_started = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - request_started)
+        queries.append(counter.count)
+        statuses.add(response.status_code)
+    elapsed = time.perf_counter() - started
+
+    if not warm_cache:
+        cache.clear()
+    tracemalloc.start()
+    client.get(url)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'url': url,
+        'requests': requests,
+        'statuses': sorted(statuses),
+        'throughput_rps': requests / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'mean': statistics.mean(latencies) * 1000,
+            'p50': percentile(latencies, 50) * 1000,
+            'p95': percentile(latencies, 95) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+        },
+        'queries': statistics.median(queries),
+        'peak_memory_bytes': peak_memory,
+        'response_bytes': len(response.content),
+    }
+
+
+def run(client, requests, warm_cache=False, seed=0, endpoints=ENDPOINTS):
+    """Measures every endpoint against the data currently in the database"""
+    ids = sample_ids(random.Random(seed))
+    # One process, so the per-process cache is safe to serve responses from
+    with override_settings(ARTPARTY_CACHE_RESPONSES=warm_cache):
+        return {name: measure(client, url.format(**ids), requests, warm_cache) for name, url in endpoints}
+
+
+def measure_wsgi(url, requests, concurrency):
+    """Sends `requests` GETs of `url` from `concurrency` threads at once.
+    Returns: [(seconds, status code)], total seconds"""
+    def worker(count):
+        client = Client()
+        results = []
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                response = client.get(url)
+                results.append((time.perf_counter() - started, response.status_code))
+        finally:
+            connections.close_all()
+        return results
+
+    counts = [requests // concurrency + (1 if worker < requests % concurrency else 0) for worker in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = [result for batch in pool.map(worker, counts) for result in batch]
+    return results, time.perf_counter() - started
+
+
+def measure_asgi(url, requests, concurrency):
+    """Sends `requests` GETs of `url` from one event loop, `concurrency` at once.
+    Returns: [(seconds, status code)], total seconds"""
+    async def send_all():
+        client = AsyncClient()
+        gate = asyncio.Semaphore(concurrency)
+
+        async def send():
+            async with gate:
+                # A thread for the request's sync work, as the ASGI handler gives it
+                async with ThreadSensitiveContext():
+                    started = time.perf_counter()
+                    response = await client.get(url)
+                    return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(send() for _ in range(requests)))
+        return results, time.perf_counter() - started
+
+    return asyncio.run(send_all())
+
+
+def run_concurrent(requests, concurrency, warm_cache=False, seed=0, endpoints=ENDPOINTS):
+    """Throughput and latency of the endpoints with async views under
+    concurrent load, through each server's stack.
+    Returns: {endpoint: {'wsgi': stats, 'asgi': stats}}"""
+    ids = sample_ids(random.Random(seed))
+    caches = dict(settings.CACHES)
+    if not warm_cache:
+        # Nothing can clear the cache between concurrent requests, so turn it off
+        caches['uncached'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    measures = {'wsgi': measure_wsgi, 'asgi': measure_asgi}
+    results = {}
+    for name, url in endpoints:
+        if name not in CONCURRENT_ENDPOINTS:
+            continue
+        url = url.format(**ids)
+        results[name] = {}
+        for server, urlconf in URLCONFS.items():
+            with override_settings(ROOT_URLCONF=urlconf, CACHES=caches,
+                                   ARTPARTY_CACHE_ALIAS='default' if warm_cache else 'uncached',
+                                   ARTPARTY_CACHE_RESPONSES=warm_cache):
+                # Unmeasured, so URL resolver setup isn't counted
+                measures[server](url, 1, 1)
+                timings, elapsed = measures[server](url, requests, concurrency)
+            latencies = [seconds for seconds, _ in timings]
+            results[name][server] = {
+                'url': url,
+                'requests': requests,
+                'concurrency': concurrency,
+                'statuses': sorted({status for _, status in timings}),
+                'throughput_rps': requests / elapsed if elapsed else 0.0,
+                'latency_ms': {
+                    'p50': percentile(latencies, 50) * 1000,
+                    'p95': percentile(latencies, 95) * 1000,
+                    'p99': percentile(latencies, 99) * 1000,
+                },
+            }
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+def compare(results, baseline, threshold):
+    """p95 regressions against a baseline run, worst first.
+    Returns: list of (size, endpoint, baseline p95 ms, current p95 ms)"""
+    regressions = []
+    for size, endpoints in results['sizes'].items():
+        for name, current in endpoints.items():
+            previous = baseline.get('sizes', {}).get(size, {}).get(name)
+            if previous is None:
+                continue
+            before, after = previous['latency_ms']['p95'], current['latency_ms']['p95']
+            if before and after / before > threshold:
+                regressions.append((size, name, before, after))
+    return sorted(regressions, key=lambda row: row[3] / row[2], reverse=True)
+
+
+def save(results, path):
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(results, output, indent=2)
+
+
+def load(path):
+    with open(path, encoding='utf-8') as source:
+        return json.load(source)
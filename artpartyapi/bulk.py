@@ -0,0 +1,50 @@
+"""Helpers shared by the bulk write endpoints"""
+from django.conf import settings
+
+# Rows per INSERT/UPDATE statement, kept under SQLite's bound variable limit
+BATCH_SIZE = 500
+
+
+def max_items():
+    return getattr(settings, 'ARTPARTY_BULK_MAX_ITEMS', 10000)
+
+
+def validate_items(serializer_class, data, partial=False):
+    """Validates a list of items independently.
+    Returns the validated items and one error dict per item (empty when valid),
+    or None and a message when `data` isn't a usable list."""
+    if not isinstance(data, list):
+        return None, 'Expected a list of items'
+    if len(data) > max_items():
+        return None, f'At most {max_items()} items can be written at once'
+
+    items, errors = [], []
+    for item in data:
+        serializer = serializer_class(data=item, partial=partial)
+        if serializer.is_valid():
+            items.append(serializer.validated_data)
+            errors.append({})
+        else:
+            items.append(None)
+            errors.append(dict(serializer.errors))
+    return items, errors
+
+
+def check_foreign_keys(items, errors, field, model, many=False):
+    """Checks every id in `field` across all items with one id__in query"""
+    def ids_of(item):
+        if item is None or field not in item:
+            return []
+        return item[field] if many else [item[field]]
+
+    wanted = {pk for item in items for pk in ids_of(item)}
+    found = set(model.objects.filter(id__in=wanted).values_list('id', flat=True))
+    for item, item_errors in zip(items, errors):
+        missing = [pk for pk in ids_of(item) if pk not in found]
+        if missing:
+            item_errors[field] = [f'Invalid pk "{pk}" - object does not exist.' for pk in missing]
+
+
+def error_payload(errors):
+    """Per-item errors keyed by position in the request, only for the items that failed"""
+    return {'errors': [{'index': index, **item_errors} for index, item_errors in enumerate(errors) if item_errors]}
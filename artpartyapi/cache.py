@@ -0,0 +1,207 @@
+"""Response cache for the read-heavy endpoints.
+
+Every cached response is keyed by the generation counters of the models it
+was built from. Saving or deleting one of those models bumps its counter
+(see signals.py), which moves every dependent response to a new key, so a
+write is never followed by a stale read and nothing has to be deleted.
+That only holds when every worker shares the counters, so responses are
+cached only with ARTPARTY_CACHE_RESPONSES, which checks.py refuses on a
+per-process cache.
+Identical misses arriving together are coalesced (see coalesce.py)."""
+import functools
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+from artparty.routers import reading_from_replica, sticky_seconds
+from artpartyapi.coalesce import coalesce_seconds, flights
+from artpartyapi.conditional import is_not_modified, not_modified_response
+
+KEY_PREFIX = 'artparty'
+
+CACHED_HEADERS = ('ETag', 'Last-Modified')
+
+LAST_WRITE_KEY = f'{KEY_PREFIX}:last_write'
+
+
+def get_cache():
+    return caches[getattr(settings, 'ARTPARTY_CACHE_ALIAS', 'default')]
+
+
+def caching_responses():
+    return getattr(settings, 'ARTPARTY_CACHE_RESPONSES', False)
+
+
+def generation_key(model):
+    return f'{KEY_PREFIX}:gen:{model._meta.label_lower}'
+
+
+def get_generations(models):
+    """Current generation of each model, starting any that are missing"""
+    cache = get_cache()
+    keys = [generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # Seed from the clock so an evicted counter can't restart at a
+            # number that old entries were stored under
+            cache.add(key, time.time_ns(), timeout=None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+async def aget_generations(models):
+    """get_generations for async views"""
+    cache = get_cache()
+    keys = [generation_key(model) for model in models]
+    generations = await cache.aget_many(keys)
+    for key in keys:
+        if key not in generations:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            generations[key] = await cache.aget(key)
+    return [generations[key] for key in keys]
+
+
+def bump_generation(*models):
+    """Invalidates every cached response built from any of `models`.
+
+    Bumps immediately and again once the surrounding transaction commits,
+    so a read that ran before the commit can't be cached as current."""
+    def bump():
+        cache = get_cache()
+        cache.set(LAST_WRITE_KEY, time.time(), timeout=None)
+        for model in models:
+            key = generation_key(model)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, time.time_ns(), timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def replica_may_lag(cache):
+    """True when this request read from a replica soon enough after a write
+    that the replica may not have it yet. Such a response would be cached
+    under the new generation, so it isn't cached at all."""
+    if not reading_from_replica():
+        return False
+    return time.time() - (cache.get(LAST_WRITE_KEY) or 0) < sticky_seconds()
+
+
+def cache_response(*models):
+    """Caches successful GET responses of a view method, keyed by the
+    request path and the generations of `models`. ETag and Last-Modified
+    headers are kept with the data, so a hit can still answer 304."""
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            timeout = coalesce_seconds(view.basename)
+            if timeout is None and not caching_responses():
+                # Without a cache or a flight to key, skip the generation lookup
+                return view_method(view, request, *args, **kwargs)
+            key = response_key(f'{view.basename}:{view_method.__name__}', request, get_generations(models))
+            cache = get_cache()
+            entry = cache.get(key) if caching_responses() else None
+            if entry is not None:
+                return cached_response(request, entry, Response)
+
+            def run():
+                response = view_method(view, request, *args, **kwargs)
+                return response, store(cache, key, response)
+
+            if timeout is None:
+                return run()[0]
+            response, entry = flights.do(flight_key(key), run, timeout)
+            return response if response is not None else cached_response(request, entry, Response)
+        return wrapper
+    return decorator
+
+
+def acache_response(name, *models):
+    """cache_response for async view functions, which return a
+    JSONDataResponse. `name` is the '<basename>:<method>' of the viewset
+    method the function stands in for, so the two share cache entries."""
+    # Imported here because the renderers aren't needed by the sync paths
+    from artpartyapi.renderers import JSONDataResponse
+
+    def decorator(view_function):
+        @functools.wraps(view_function)
+        async def wrapper(request, *args, **kwargs):
+            timeout = coalesce_seconds(name.split(':')[0])
+            if timeout is None and not caching_responses():
+                return await view_function(request, *args, **kwargs)
+            key = response_key(name, request, await aget_generations(models))
+            cache = get_cache()
+            entry = await cache.aget(key) if caching_responses() else None
+            if entry is not None:
+                return cached_response(request, entry, JSONDataResponse)
+
+            async def run():
+                response = await view_function(request, *args, **kwargs)
+                return response, await astore(cache, key, response)
+
+            if timeout is None:
+                return (await run())[0]
+            response, entry = await flights.ado(flight_key(key), run, timeout)
+            return response if response is not None else cached_response(request, entry, JSONDataResponse)
+        return wrapper
+    return decorator
+
+
+def response_key(name, request, generations):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'{KEY_PREFIX}:resp:{name}:{path}:' + '.'.join(str(generation) for generation in generations)
+
+
+def flight_key(key):
+    """Requests only share a flight when they read from the same kind of
+    database, so a client reading its own write never waits on a replica read"""
+    return f'{key}:replica' if reading_from_replica() else key
+
+
+def store(cache, key, response):
+    """Caches a successful response, when responses are cached.
+    Returns: its cache entry, or None for other responses"""
+    if response.status_code != status.HTTP_200_OK:
+        return None
+    entry = cache_entry(response)
+    if caching_responses() and not replica_may_lag(cache):
+        cache.set(key, entry, getattr(settings, 'ARTPARTY_CACHE_TIMEOUT', 300))
+    return entry
+
+
+async def astore(cache, key, response):
+    """store() for async views"""
+    if response.status_code != status.HTTP_200_OK:
+        return None
+    entry = cache_entry(response)
+    if caching_responses() and not replica_may_lag(cache):
+        await cache.aset(key, entry, getattr(settings, 'ARTPARTY_CACHE_TIMEOUT', 300))
+    return entry
+
+
+def cache_entry(response):
+    """What the cache keeps of a response: its data and validators"""
+    headers = {header: response[header] for header in CACHED_HEADERS if response.has_header(header)}
+    if response.has_header('Last-Modified'):
+        headers['last_modified'] = parse_http_date_safe(response['Last-Modified'])
+    return response.data, headers
+
+
+def cached_response(request, entry, response_class):
+    """Rebuilds a response from a cache entry, or a 304 if the client's copy is current"""
+    data, headers = entry
+    etag = headers.get('ETag')
+    if etag and is_not_modified(request, etag, headers.get('last_modified')):
+        return not_modified_response(etag, headers.get('last_modified'), response_class)
+    response = response_class(data)
+    for header in CACHED_HEADERS:
+        if header in headers:
+            response[header] = headers[header]
+    return response
@@ -0,0 +1,222 @@
+"""Change log behind GET /sync, the delta sync for offline clients.
+
+Every save or delete of an artwork, artist, tag or artwork tag appends a
+Change row, and deletes leave tombstones. The signal receivers in
+signals.py cover single saves and deletes; bulk writes call record()
+themselves.
+
+A sync token holds the last sequence number a client has and the time it
+is up to date to. Changes from the last ARTPARTY_SYNC_SETTLE_SECONDS are
+sent but not counted in the token, so a transaction that took a sequence
+number early but committed late is never skipped; clients get those rows
+again next time. compact() drops rows older than
+ARTPARTY_SYNC_RETENTION_DAYS, and tokens that old get a full snapshot.
+Snapshots are paged like the changes: their tokens also hold the kind and
+id the page stopped at, and the last page's token carries on from the
+changes logged before the first."""
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from artpartyapi.fastserializers import ARTWORK_FIELDS, artwork_data, artwork_values, tag_data
+from artpartyapi.models import Artist, Artwork, ArtworkTag, Change, Tag
+
+KINDS = {Artwork: 'artwork', Artist: 'artist', Tag: 'tag', ArtworkTag: 'artworktag'}
+
+# Payload key for each kind
+NAMES = {'artwork': 'artworks', 'artist': 'artists', 'tag': 'tags', 'artworktag': 'artworktags'}
+
+# Models whose rows belong to a user and can be synced per user
+OWNED = (Artwork, Artist)
+
+# Synced rows are flat, with relations as ids, so a rename is one change
+# rather than one for every artwork that shows the name
+ARTWORK_SYNC_FIELDS = tuple(field for field in ARTWORK_FIELDS if field != 'tags')
+
+
+def settle_seconds():
+    return getattr(settings, 'ARTPARTY_SYNC_SETTLE_SECONDS', 5)
+
+
+def retention():
+    return timedelta(days=getattr(settings, 'ARTPARTY_SYNC_RETENTION_DAYS', 30))
+
+
+def page_size():
+    return getattr(settings, 'ARTPARTY_SYNC_PAGE_SIZE', 1000)
+
+
+def owner(instance):
+    return instance.__dict__.get('user_id') if isinstance(instance, OWNED) else None
+
+
+def record(instances, deleted=False):
+    """Logs a save (or with `deleted`, a delete) of each of `instances`.
+    An artwork or artist that changed owner also leaves a tombstone for
+    the previous owner, so their client drops it."""
+    changes = []
+    for instance in instances:
+        kind = KINDS[instance._meta.concrete_model]
+        user_id = owner(instance)
+        previous = getattr(instance, '_synced_user_id', None)
+        if not deleted and previous is not None and previous != user_id:
+            # First, so the save is the latest change for clients syncing everything
+            changes.append(Change(kind=kind, object_id=instance.pk, user_id=previous, deleted=True))
+        changes.append(Change(kind=kind, object_id=instance.pk, user_id=user_id, deleted=deleted))
+        if isinstance(instance, OWNED):
+            instance._synced_user_id = user_id
+    Change.objects.bulk_create(changes)
+
+
+def encode_token(seq, at, position=None):
+    token = {'s': seq, 'a': at.timestamp()}
+    if position is not None:
+        token['k'], token['i'] = position
+    token = json.dumps(token, separators=(',', ':'))
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Returns: (sequence number, datetime, snapshot position or None);
+    raises ValueError for a malformed token"""
+    try:
+        token = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode())
+        position = None
+        if 'k' in token:
+            if token['k'] not in NAMES:
+                raise ValueError
+            position = token['k'], int(token['i'])
+        return int(token['s']), datetime.fromtimestamp(float(token['a']), tz=dt_timezone.utc), position
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError, OverflowError):
+        raise ValueError('Invalid sync token') from None
+
+
+def changes_since(token=None, user_id=None):
+    """Everything a client holding `token` is missing, or a full snapshot
+    when it has no token or one older than the retention window.
+    With `user_id`, artworks and artists are limited to that user's, and
+    artwork tags to those on that user's artworks.
+    Returns: dict with the new token, the rows that were created or
+    updated, and the ids that were deleted"""
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settle_seconds())
+    since = decode_token(token) if token else None
+    if since is None or since[1] < now - retention():
+        return snapshot(user_id, cutoff)
+    since_seq, since_at, position = since
+    if position is not None:
+        return snapshot(user_id, since_at, since_seq, position)
+
+    changes = Change.objects.filter(seq__gt=since_seq)
+    if user_id is not None:
+        changes = changes.filter(Q(user_id=user_id) | Q(user_id__isnull=True))
+    changes = list(changes.order_by('seq')[:page_size() + 1])
+    has_more = len(changes) > page_size()
+    changes = changes[:page_size()]
+
+    if has_more:
+        # The client comes straight back for the rest, so move on past this page
+        seq, at = changes[-1].seq, min(cutoff, changes[-1].changed_at)
+    else:
+        seq, at = since_seq, cutoff
+        for change in changes:
+            if change.changed_at >= cutoff:
+                break
+            seq = change.seq
+
+    # Only the latest change to each object matters
+    latest = {}
+    for change in changes:
+        latest[(change.kind, change.object_id)] = change.deleted
+    saved = {kind: [] for kind in KINDS.values()}
+    deleted = {kind: [] for kind in KINDS.values()}
+    for (kind, object_id), is_deleted in latest.items():
+        (deleted if is_deleted else saved)[kind].append(object_id)
+
+    payload = {'token': encode_token(seq, at), 'reset': False, 'has_more': has_more}
+    payload.update(synced_rows({kind: {'id__in': ids} for kind, ids in saved.items()}, user_id))
+    # Whatever went away (or out of scope) after its change was logged counts
+    # as deleted, except other users' artwork tags, which were never in scope
+    for kind, name in NAMES.items():
+        found = {row['id'] for row in payload[name]}
+        missing = [object_id for object_id in saved[kind] if object_id not in found]
+        if kind == 'artworktag' and user_id is not None:
+            elsewhere = set(ArtworkTag.objects.filter(id__in=missing).values_list('id', flat=True))
+            missing = [object_id for object_id in missing if object_id not in elsewhere]
+        deleted[kind].extend(missing)
+    payload['deleted'] = {NAMES[kind]: sorted(ids) for kind, ids in deleted.items()}
+    return payload
+
+
+def snapshot(user_id, cutoff, seq=None, position=None):
+    """A page of every row in scope, from `position` (kind, last id sent)
+    on. The first page (no `seq`) reads the sequence number the changes
+    will carry on from, and has reset set."""
+    reset = seq is None
+    if reset:
+        # Read before the rows, so nothing that changes meanwhile is missed
+        seq = Change.objects.filter(changed_at__lt=cutoff).order_by('-seq').values_list('seq', flat=True).first() or 0
+    kinds = list(NAMES)
+    start, after = position or (kinds[0], 0)
+    remaining = page_size()
+    lookups = {kind: {'id__in': []} for kind in kinds}
+    position = None
+    for kind in kinds[kinds.index(start):]:
+        last = after if kind == start else 0
+        ids = list(scoped(kind, user_id).filter(id__gt=last).order_by('id').values_list('id', flat=True)[:remaining + 1])
+        if len(ids) > remaining:
+            ids = ids[:remaining]
+            position = kind, ids[-1] if ids else last
+        lookups[kind] = {'id__in': ids}
+        if position is not None:
+            break
+        remaining -= len(ids)
+
+    payload = {'token': encode_token(seq, cutoff, position), 'reset': reset, 'has_more': position is not None}
+    payload.update(synced_rows(lookups, user_id))
+    payload['deleted'] = {name: [] for name in NAMES.values()}
+    return payload
+
+
+def scoped(kind, user_id):
+    """The rows of `kind` a sync for `user_id` (or everyone) covers"""
+    if kind == 'artwork':
+        return Artwork.objects.all() if user_id is None else Artwork.objects.filter(user_id=user_id)
+    if kind == 'artist':
+        return Artist.objects.all() if user_id is None else Artist.objects.filter(user_id=user_id)
+    if kind == 'artworktag':
+        return ArtworkTag.objects.all() if user_id is None else ArtworkTag.objects.filter(artwork__user_id=user_id)
+    return Tag.objects.all()
+
+
+def synced_rows(lookups, user_id):
+    """The synced rows matching `lookups` (kind -> filter arguments), by id"""
+    artworks = scoped('artwork', user_id).filter(**lookups['artwork']).order_by('id')
+    artists = scoped('artist', user_id).filter(**lookups['artist']).order_by('id')
+    artworktags = scoped('artworktag', user_id).filter(**lookups['artworktag']).order_by('id')
+    return {
+        'artworks': artwork_data(artwork_values(artworks, ARTWORK_SYNC_FIELDS, ()), ARTWORK_SYNC_FIELDS, ()),
+        'artists': list(artists.values('id', 'user', 'name', 'img')),
+        'tags': tag_data(scoped('tag', user_id).filter(**lookups['tag']).order_by('id')),
+        'artworktags': list(artworktags.values('id', 'artwork', 'tag')),
+    }
+
+
+def compact(older_than=None):
+    """Drops change rows no client can need: rows superseded by a later
+    change to the same object and owner, and every row older than
+    `older_than` (the retention window by default), since tokens that
+    old get a full snapshot instead.
+    Returns: number of rows removed"""
+    older_than = retention() if older_than is None else older_than
+    expired, _ = Change.objects.filter(changed_at__lt=timezone.now() - older_than).delete()
+
+    later = Change.objects.filter(kind=OuterRef('kind'), object_id=OuterRef('object_id'), seq__gt=OuterRef('seq'))
+    superseded, _ = Change.objects.filter(
+        Q(Exists(later.filter(user_id=OuterRef('user_id'))))
+        | Q(Exists(later.filter(user_id__isnull=True)), user_id__isnull=True)
+    ).delete()
+    return expired + superseded
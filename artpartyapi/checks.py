@@ -0,0 +1,51 @@
+"""System checks for the artpartyapi settings"""
+from django.conf import settings
+from django.core.checks import Error, register
+from artpartyapi.authentication import id_token
+
+# Backends whose entries each process keeps to itself
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register()
+def check_response_cache(app_configs, **kwargs):
+    """Refuses the response cache on a cache other workers can't see, where
+    a write in one worker would leave the others serving stale responses"""
+    if not getattr(settings, 'ARTPARTY_CACHE_RESPONSES', False):
+        return []
+    alias = getattr(settings, 'ARTPARTY_CACHE_ALIAS', 'default')
+    if settings.CACHES.get(alias, {}).get('BACKEND') in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f'ARTPARTY_CACHE_RESPONSES needs a cache shared by every worker, but the {alias!r} cache is per process.',
+            hint='Point ARTPARTY_CACHE_ALIAS at a Redis, Memcached or database cache.',
+            id='artpartyapi.E001',
+        )]
+    return []
+
+
+@register()
+def check_token_verifier(app_configs, **kwargs):
+    """Without google-auth a configured Firebase project would verify no tokens"""
+    if getattr(settings, 'ARTPARTY_FIREBASE_PROJECT_ID', None) and id_token is None:
+        return [Error(
+            'ARTPARTY_FIREBASE_PROJECT_ID is set but google-auth is not installed, so no ID token can be verified.',
+            hint='pip install google-auth requests',
+            id='artpartyapi.E002',
+        )]
+    return []
+
+
+@register()
+def check_throttle_cache(app_configs, **kwargs):
+    """Refuses rate limits kept in a per-process cache, where each worker
+    would keep its own buckets and let through its own share of requests"""
+    if not getattr(settings, 'ARTPARTY_THROTTLES', {}):
+        return []
+    alias = getattr(settings, 'ARTPARTY_CACHE_ALIAS', 'default')
+    if settings.CACHES.get(alias, {}).get('BACKEND') in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f'ARTPARTY_THROTTLES needs a cache shared by every worker, but the {alias!r} cache is per process.',
+            hint='Point ARTPARTY_CACHE_ALIAS at a Redis, Memcached or database cache.',
+            id='artpartyapi.E003',
+        )]
+    return []
@@ -0,0 +1,89 @@
+"""Single-flight coalescing of identical reads.
+
+When identical GETs arrive together, say a gallery many clients poll or
+the homepage right after a write moved its cache entry on, each would run
+the same queries. Coalesced, only the first runs the view; the others in
+this process wait for it and answer from its result. cache_response and
+acache_response (see cache.py) coalesce the viewsets listed in
+ARTPARTY_COALESCE under their response cache key, so requests after a
+write start a new flight rather than joining one that read older data.
+
+Flights only span one process; the response cache shares results between
+processes. A waiting request runs the view itself if the first one fails,
+doesn't produce a shareable result, or takes longer than the viewset's
+ARTPARTY_COALESCE seconds."""
+import asyncio
+import threading
+from django.conf import settings
+
+
+def coalesce_seconds(viewset):
+    """How long a request to `viewset` waits on an identical one, or None
+    if the viewset isn't coalesced"""
+    return getattr(settings, 'ARTPARTY_COALESCE', {}).get(viewset)
+
+
+class Flight:
+    """A call in progress, and what it shares once done"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.shared = None
+
+
+class SingleFlight:
+    """Calls in progress in this process, by key"""
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function, timeout):
+        """Calls `function` unless a call with `key` is in progress, in which
+        case waits up to `timeout` seconds for what that call shares.
+        `function` returns (result, shared), shared being None when there
+        is nothing other callers can use.
+        Returns: (result, shared), with result None when the call was another's"""
+        with self.lock:
+            flight = self.flights.get(key)
+            leading = flight is None
+            if leading:
+                flight = self.flights[key] = Flight()
+        if not leading:
+            if flight.done.wait(timeout) and flight.shared is not None:
+                return None, flight.shared
+            return function()
+
+        try:
+            result, flight.shared = function()
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return result, flight.shared
+
+    async def ado(self, key, function, timeout):
+        """do() for coroutine functions. Waiters share the leader's event
+        loop, so no thread ever waits."""
+        loop = asyncio.get_running_loop()
+        flight = self.flights.get((loop, key))
+        if flight is not None:
+            try:
+                shared = await asyncio.wait_for(asyncio.shield(flight), timeout)
+            except asyncio.TimeoutError:
+                shared = None
+            if shared is not None:
+                return None, shared
+            return await function()
+
+        flight = self.flights[loop, key] = loop.create_future()
+        shared = None
+        try:
+            result, shared = await function()
+        finally:
+            del self.flights[loop, key]
+            flight.set_result(shared)
+        return result, shared
+
+
+flights = SingleFlight()
@@ -0,0 +1,84 @@
+"""ETag / Last-Modified support for conditional GETs"""
+import hashlib
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+from artpartyapi.models import Tag, User
+
+
+def artwork_validators(artworks):
+    """Weak ETag and Last-Modified for a filtered artwork queryset.
+
+    One aggregate query covers the artworks, their tag links and their
+    artists. Tag labels and user names carry no timestamp, so their cache
+    generations stand in for them."""
+    # Imported here because the cache module checks validators on hits
+    from artpartyapi.cache import get_generations
+    stats = artworks.order_by().aggregate(**validator_aggregates())
+    return validators_from_stats(stats, get_generations((Tag, User)))
+
+
+async def aartwork_validators(artworks):
+    """artwork_validators for async views"""
+    from artpartyapi.cache import aget_generations
+    stats = await artworks.order_by().aaggregate(**validator_aggregates())
+    return validators_from_stats(stats, await aget_generations((Tag, User)))
+
+
+def validator_aggregates():
+    return {
+        'count': Count('id', distinct=True),
+        'max_id': Max('id'),
+        'modified': Max('updated_at'),
+        'tag_count': Count('tags'),
+        'tag_modified': Max('tags__updated_at'),
+        'artist_modified': Max('artist__updated_at'),
+    }
+
+
+def validators_from_stats(stats, generations):
+    parts = [stats[key] for key in sorted(stats)] + generations
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    timestamps = [stats[key] for key in ('modified', 'tag_modified', 'artist_modified') if stats[key]]
+    last_modified = max(timestamps).timestamp() if timestamps else None
+    return f'W/"{digest}"', last_modified
+
+
+def feed_validators(rows):
+    """Weak ETag and Last-Modified for rows of the featured feed, given as
+    (artwork id, updated_at) pairs. Every refresh or rank change touches
+    updated_at, and removals change the count."""
+    modified = max((updated_at for _, updated_at in rows), default=None)
+    parts = ['feed', len(rows), max((artwork_id for artwork_id, _ in rows), default=None), modified]
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'W/"{digest}"', modified.timestamp() if modified else None
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def is_not_modified(request, etag, last_modified):
+    """True when the client's cached copy is still current.
+
+    If-None-Match wins over If-Modified-Since, as RFC 9110 requires."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        if if_none_match.strip() == '*':
+            return True
+        # Weak comparison: W/"x" and "x" match
+        opaque = etag.removeprefix('W/')
+        return any(tag.removeprefix('W/') == opaque for tag in parse_etags(if_none_match))
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since is not None and last_modified is not None:
+        return int(last_modified) <= if_modified_since
+    return False
+
+
+def not_modified_response(etag, last_modified, response_class=Response):
+    return set_validators(response_class(None, status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
@@ -0,0 +1,248 @@
+"""Denormalized artwork and tag counts on artists, users and tags.
+
+Writes move the counters with F() expressions inside their own transaction,
+so concurrent writers add up instead of overwriting each other. The signal
+receivers in signals.py cover single saves and deletes; bulk writes call
+these functions themselves. reconcile() recounts from scratch."""
+from collections import Counter, defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from artpartyapi.fastserializers import artwork_data, artwork_values
+from artpartyapi.models import Artist, Artwork, ArtworkTag, Tag, TagUsage, User
+
+COUNTERS = ('artwork_count', 'featured_count', 'tag_count')
+
+# The artwork column pointing at each counted model
+OWNERS = ((Artist, 'artist'), (User, 'user'))
+
+
+def apply(changes):
+    """Applies (artist id, user id, {counter: delta}) changes with one
+    UPDATE per artist and user touched"""
+    totals = {Artist: defaultdict(Counter), User: defaultdict(Counter)}
+    for artist_id, user_id, deltas in changes:
+        totals[Artist][artist_id].update(deltas)
+        totals[User][user_id].update(deltas)
+    with transaction.atomic():
+        for model, rows in totals.items():
+            for pk, deltas in rows.items():
+                updates = {name: F(name) + delta for name, delta in deltas.items() if delta}
+                if updates:
+                    model.objects.filter(pk=pk).update(**updates)
+
+
+def counted_state(artwork):
+    """What an artwork contributes to its owners' counters: (artist id, user id, featured)"""
+    # Read through __dict__ so deferred fields are never loaded just for this
+    return artwork.__dict__.get('artist_id'), artwork.__dict__.get('user_id'), artwork.__dict__.get('featured')
+
+
+def apply_deltas(owners, links):
+    """Applies owner changes (see apply) and tag link changes (see
+    links_changed) together, e.g. from a background job"""
+    with transaction.atomic():
+        apply(owners)
+        links_changed(links)
+
+
+def creation_deltas(artworks, tags=None):
+    """What counting new artworks and their tag links (`tags`: artwork id
+    -> tag ids) would apply.
+    Returns: (owner changes, tag link changes)"""
+    artworks = list(artworks)
+    tags = tags or {}
+    owners = [
+        (artwork.artist_id, artwork.user_id, {'artwork_count': 1, 'featured_count': int(bool(artwork.featured))})
+        for artwork in artworks
+    ]
+    links = [
+        (artwork.artist_id, artwork.user_id, tag_id, 1)
+        for artwork in artworks for tag_id in tags.get(artwork.id, ())
+    ]
+    return owners, links
+
+
+def artworks_created(artworks, tags=None):
+    """Counts new artworks and their tag links (`tags`: artwork id -> tag ids)"""
+    apply_deltas(*creation_deltas(artworks, tags))
+
+
+def change_deltas(artworks):
+    """What moving the counts of saved artworks whose artist, user or
+    featured flag changed since they were loaded would apply. The tags of
+    artworks that changed owner move with them, read in one query.
+    Returns: (owner changes, tag link changes)"""
+    changed = []
+    for artwork in artworks:
+        before = getattr(artwork, '_counted_state', None)
+        after = counted_state(artwork)
+        if before is not None and None not in before and before != after:
+            changed.append((artwork, before, after))
+        artwork._counted_state = after
+    if not changed:
+        return [], []
+
+    updates = []
+    owners = {}
+    for artwork, (artist_id, user_id, featured), after in changed:
+        updates.append((artist_id, user_id, {'artwork_count': -1, 'featured_count': -int(bool(featured))}))
+        updates.append((after[0], after[1], {'artwork_count': 1, 'featured_count': int(bool(after[2]))}))
+        if (artist_id, user_id) != after[:2]:
+            owners[artwork.id] = ((artist_id, user_id), after[:2])
+    links = []
+    if owners:
+        for artwork_id, tag_id in ArtworkTag.objects.filter(artwork_id__in=owners).values_list('artwork_id', 'tag_id'):
+            before, after = owners[artwork_id]
+            links += [(*before, tag_id, -1), (*after, tag_id, 1)]
+    return updates, links
+
+
+def artworks_changed(artworks):
+    """Moves the counts of saved artworks whose artist, user or featured
+    flag changed since they were loaded"""
+    apply_deltas(*change_deltas(artworks))
+
+
+def deletion_deltas(artwork):
+    """What uncounting a deleted artwork would apply; its tag links are
+    uncounted as they go.
+    Returns: (owner changes, tag link changes)"""
+    artist_id, user_id, featured = counted_state(artwork)
+    return [(artist_id, user_id, {'artwork_count': -1, 'featured_count': -int(bool(featured))})], []
+
+
+def link_deltas(links, artworks=None):
+    """Tag link changes for links added or removed, given as (artwork id,
+    tag id, +1 or -1). Pass the loaded `artworks` by id to skip looking
+    their owners up.
+    Returns: [(artist id, user id, tag id, delta)]"""
+    links = list(links)
+    owners = {pk: (artwork.artist_id, artwork.user_id) for pk, artwork in (artworks or {}).items()}
+    missing = {artwork_id for artwork_id, _, _ in links} - set(owners)
+    if missing:
+        owners.update(
+            (pk, (artist_id, user_id))
+            for pk, artist_id, user_id in Artwork.objects.filter(id__in=missing).values_list('id', 'artist_id', 'user_id')
+        )
+    return [(*owners[artwork_id], tag_id, delta) for artwork_id, tag_id, delta in links if artwork_id in owners]
+
+
+def tags_changed(links, artworks=None):
+    """Counts tag links added or removed, given as (artwork id, tag id, +1 or -1).
+    Pass the loaded `artworks` by id to skip looking their owners up."""
+    links_changed(link_deltas(links, artworks))
+
+
+def links_changed(links):
+    """Applies tag links added or removed, given as (artist id, user id, tag
+    id, delta), to the owners' tag_count, each tag's usage_count and TagUsage"""
+    per_owner, per_tag, per_usage = Counter(), Counter(), Counter()
+    for artist_id, user_id, tag_id, delta in links:
+        per_owner[artist_id, user_id] += delta
+        per_tag[tag_id] += delta
+        per_usage[artist_id, user_id, tag_id] += delta
+    if not any(per_usage.values()):
+        return
+    with transaction.atomic():
+        apply((artist_id, user_id, {'tag_count': delta}) for (artist_id, user_id), delta in per_owner.items())
+        for tag_id, delta in per_tag.items():
+            if delta:
+                Tag.objects.filter(pk=tag_id).update(usage_count=F('usage_count') + delta)
+        for (artist_id, user_id, tag_id), delta in per_usage.items():
+            if delta:
+                add_usage(artist_id, user_id, tag_id, delta)
+
+
+def add_usage(artist_id, user_id, tag_id, delta):
+    usage = TagUsage.objects.filter(artist_id=artist_id, user_id=user_id, tag_id=tag_id)
+    # Rows that drop to zero stay behind; readers skip them and reconcile() removes them
+    if usage.update(count=F('count') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            TagUsage.objects.create(artist_id=artist_id, user_id=user_id, tag_id=tag_id, count=delta)
+    except IntegrityError:
+        # Another writer created the row since the update above
+        usage.update(count=F('count') + delta)
+
+
+def owner_stats(owner, field):
+    """Profile stats of an artist or user (`field` names the artwork column
+    pointing at it): the stored counters, tags by use and the latest artwork"""
+    latest = artwork_data(artwork_values(Artwork.objects.filter(**{field: owner}).order_by('-date', '-id'))[:1])
+    return {
+        **{name: getattr(owner, name) for name in COUNTERS},
+        'tags': tag_usage(**{field: owner}),
+        'latest_artwork': latest[0] if latest else None,
+    }
+
+
+def tag_usage(**scope):
+    """[{id, label, count}] of the tags used within `scope` (artist= and/or
+    user=), most used first, summed from TagUsage rather than ArtworkTag"""
+    rows = TagUsage.objects.filter(count__gt=0, **scope).values('tag_id', 'tag__label') \
+        .annotate(total=Sum('count')).order_by('-total', 'tag__label')
+    return [{'id': row['tag_id'], 'label': row['tag__label'], 'count': row['total']} for row in rows]
+
+
+def reconcile():
+    """Recounts every counter and TagUsage row and saves the ones that drifted.
+    Returns: {model name: number of rows fixed}"""
+    def count(queryset, group_by):
+        counts = queryset.filter(**{group_by: OuterRef('pk')}).order_by().values(group_by) \
+            .annotate(count=Count('id')).values('count')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    fixed = {}
+    recounts = [
+        (model, {
+            'artwork_count': count(Artwork.objects.all(), field),
+            'featured_count': count(Artwork.objects.filter(featured=True), field),
+            'tag_count': count(ArtworkTag.objects.all(), f'artwork__{field}'),
+        })
+        for model, field in OWNERS
+    ] + [(Tag, {'usage_count': count(ArtworkTag.objects.all(), 'tag')})]
+    for model, actual in recounts:
+        drifted = Q()
+        for name in actual:
+            drifted |= ~Q(**{name: F(f'actual_{name}')})
+        rows = model.objects.annotate(**{f'actual_{name}': value for name, value in actual.items()}) \
+            .filter(drifted).only('id', *actual)
+        updated = []
+        for row in rows.iterator(chunk_size=1000):
+            for name in actual:
+                setattr(row, name, getattr(row, f'actual_{name}'))
+            updated.append(row)
+        model.objects.bulk_update(updated, list(actual), batch_size=500)
+        fixed[model.__name__] = len(updated)
+
+    # TagUsage is rebuilt from one GROUP BY over every link
+    actual = {
+        (row['artwork__artist_id'], row['artwork__user_id'], row['tag_id']): row['count']
+        for row in ArtworkTag.objects.order_by().values('artwork__artist_id', 'artwork__user_id', 'tag_id')
+        .annotate(count=Count('id'))
+    }
+    stale, updated = [], []
+    drifted = 0
+    for usage in TagUsage.objects.all().iterator(chunk_size=1000):
+        key = (usage.artist_id, usage.user_id, usage.tag_id)
+        if key not in actual:
+            stale.append(usage.id)
+            # Rows left at zero are expected, just cleared out here
+            drifted += usage.count != 0
+            continue
+        if usage.count != actual[key]:
+            usage.count = actual[key]
+            updated.append(usage)
+        del actual[key]
+    created = [
+        TagUsage(artist_id=artist_id, user_id=user_id, tag_id=tag_id, count=total)
+        for (artist_id, user_id, tag_id), total in actual.items()
+    ]
+    for start in range(0, len(stale), 500):
+        TagUsage.objects.filter(id__in=stale[start:start + 500]).delete()
+    TagUsage.objects.bulk_update(updated, ['count'], batch_size=500)
+    TagUsage.objects.bulk_create(created, batch_size=500)
+    fixed['TagUsage'] = drifted + len(updated) + len(created)
+    return fixed
@@ -0,0 +1,185 @@
+"""Live artwork events for the Server-Sent Events stream (see artparty/sse.py).
+
+Saving an artwork publishes `created`, `updated`, `featured`, `unfeatured`
+or `deleted` events once the transaction commits. The signal receivers in
+signals.py cover single saves and deletes; bulk writes call
+artworks_saved themselves.
+
+Events go through the fan-out named by ARTPARTY_EVENTS_FANOUT to the Hub
+of every process holding SSE connections. LocalFanout, the default, only
+reaches this process's hub, which is enough when writes and streams are
+served by the same ASGI worker. A cross-process fan-out (Redis pub/sub,
+PostgreSQL LISTEN/NOTIFY) implements the same two methods: publish()
+sends an event to every process, whose listener hands it to hub.deliver(),
+and has_listeners() says whether events are worth building at all.
+
+Each connection gets a bounded queue. A client that falls
+ARTPARTY_EVENTS_QUEUE_SIZE events behind is disconnected rather than
+buffered without limit; its EventSource reconnects with Last-Event-ID and
+catches up from the hub's replay buffer, or is told to reload."""
+import asyncio
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+from artpartyapi.fastserializers import artwork_data, artwork_values
+from artpartyapi.models import Artwork
+
+_last_id = 0
+_id_lock = threading.Lock()
+
+
+def next_event_id():
+    """Nanosecond clock readings, kept strictly increasing within the process"""
+    global _last_id
+    with _id_lock:
+        _last_id = max(time.time_ns(), _last_id + 1)
+        return _last_id
+
+
+class Event:
+    """One artwork event. Ids follow the clock, so they grow across
+    processes too and a reconnecting client can name the last one it saw."""
+
+    def __init__(self, type, data, id=None):
+        self.type = type
+        self.data = data
+        self.id = id if id is not None else next_event_id()
+
+    @property
+    def featured(self):
+        return bool(self.data.get('featured')) or self.type == 'unfeatured'
+
+
+class Subscription:
+    """One SSE connection's queue, filled from any thread"""
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def offer(self, event):
+        """Queues `event`, or marks the subscription overflowed if it is full.
+        Runs on the subscription's loop."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Hub:
+    """The SSE connections of this process, and the latest events for replay"""
+
+    def __init__(self, queue_size, replay_size):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.recent = deque(maxlen=replay_size)
+        # Replay can't vouch for anything before the hub started
+        self.started = time.time_ns()
+
+    def subscribe(self, last_event_id=None):
+        """Adds a subscription on the running loop.
+        Returns: (subscription, events to replay, or None if the client
+        missed more than the replay buffer holds and should reload)"""
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self.lock:
+            self.subscriptions.add(subscription)
+            if last_event_id is None:
+                return subscription, []
+            oldest = self.recent[0].id if len(self.recent) == self.recent.maxlen else self.started
+            if last_event_id < oldest:
+                return subscription, None
+            return subscription, [event for event in self.recent if event.id > last_event_id]
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def has_subscribers(self):
+        return bool(self.subscriptions)
+
+    def deliver(self, events):
+        """Hands `events` to every subscription; safe to call from any thread"""
+        with self.lock:
+            self.recent.extend(events)
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            for event in events:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.offer, event)
+                except RuntimeError:
+                    # Its loop has closed
+                    self.unsubscribe(subscription)
+                    break
+
+
+class LocalFanout:
+    """Delivers events to this process's hub only"""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, events):
+        self.hub.deliver(events)
+
+    def has_listeners(self):
+        return self.hub.has_subscribers()
+
+
+hub = Hub(
+    queue_size=getattr(settings, 'ARTPARTY_EVENTS_QUEUE_SIZE', 100),
+    replay_size=getattr(settings, 'ARTPARTY_EVENTS_REPLAY_SIZE', 1000),
+)
+
+fanout = SimpleLazyObject(
+    lambda: import_string(getattr(settings, 'ARTPARTY_EVENTS_FANOUT', 'artpartyapi.events.LocalFanout'))(hub)
+)
+
+
+def event_types(created, was_featured, featured):
+    types = ['created' if created else 'updated']
+    if featured and not was_featured:
+        types.append('featured')
+    elif was_featured and not featured:
+        types.append('unfeatured')
+    return types
+
+
+def artworks_saved(artworks, created=False):
+    """Publishes events for saved artworks once the transaction commits.
+    Whether each was featured before comes from `_published_featured`,
+    remembered when it was loaded."""
+    changes = {}
+    for artwork in artworks:
+        was_featured = False if created else getattr(artwork, '_published_featured', False)
+        changes[artwork.id] = event_types(created, bool(was_featured), bool(artwork.featured))
+        artwork._published_featured = artwork.featured
+    if changes:
+        transaction.on_commit(lambda: publish_saved(changes))
+
+
+def artwork_deleted(artwork_id, featured):
+    transaction.on_commit(lambda: publish_deleted(artwork_id, featured))
+
+
+def publish_deleted(artwork_id, featured):
+    if fanout.has_listeners():
+        fanout.publish([Event('deleted', {'id': artwork_id, 'featured': featured})])
+
+
+def publish_saved(changes):
+    """Builds each artwork's list entry once and publishes its events"""
+    if not fanout.has_listeners():
+        return
+    entries = artwork_data(artwork_values(Artwork.objects.filter(id__in=changes).order_by('id')))
+    events = []
+    for entry in entries:
+        for type in changes[entry['id']]:
+            events.append(Event(type, entry))
+    if events:
+        fanout.publish(events)
@@ -0,0 +1,96 @@
+"""Streaming artwork export.
+
+Artworks are read with a server-side iterator and written out a chunk at a
+time. The tags of each chunk are fetched with one query, so memory stays
+flat and the query count grows with the number of chunks, not rows."""
+import csv
+import io
+import json
+from itertools import islice
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+from artpartyapi.models import ArtworkTag
+
+FIELDS = ('id', 'title', 'img', 'medium', 'description', 'date', 'age', 'featured', 'user', 'artist', 'artist_name')
+
+CHUNK_SIZE = 2000
+
+
+def artwork_rows(artworks, chunk_size=CHUNK_SIZE):
+    """Yields one dict per artwork, in id order, with its tags attached"""
+    rows = artworks.order_by('id').values(
+        'id', 'title', 'img', 'medium', 'description', 'date', 'age', 'featured',
+        'user_id', 'artist_id', 'artist__name',
+    ).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        tags = {}
+        links = ArtworkTag.objects.filter(artwork_id__in=[row['id'] for row in chunk]) \
+            .order_by('id').values_list('artwork_id', 'tag_id', 'tag__label')
+        for artwork_id, tag_id, label in links:
+            tags.setdefault(artwork_id, []).append({'id': tag_id, 'label': label})
+        for row in chunk:
+            yield {
+                'id': row['id'],
+                'title': row['title'],
+                'img': row['img'],
+                'medium': row['medium'],
+                'description': row['description'],
+                'date': row['date'],
+                'age': row['age'],
+                'featured': row['featured'],
+                'user': row['user_id'],
+                'artist': row['artist_id'],
+                'artist_name': row['artist__name'],
+                'tags': tags.get(row['id'], []),
+            }
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def csv_lines(rows):
+    """CSV with tag labels joined by semicolons in a final `tags` column"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(FIELDS + ('tags',))
+    yield flush()
+    for row in rows:
+        writer.writerow([row[field] for field in FIELDS] + [';'.join(tag['label'] for tag in row['tags'])])
+        yield flush()
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Lets `?format=ndjson` through content negotiation; only error
+    responses are rendered here, the export itself streams"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data, cls=DjangoJSONEncoder) + '\n').encode()
+
+
+class CSVRenderer(BaseRenderer):
+    """Lets `?format=csv` through content negotiation; see NDJSONRenderer"""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict):
+            data = {'message': data}
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(data.keys())
+        writer.writerow(data.values())
+        return buffer.getvalue().encode()
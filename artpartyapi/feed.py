@@ -0,0 +1,68 @@
+"""Materialized feed of featured artworks for the homepage.
+
+Each featured artwork has a FeaturedArtwork row holding its serialized
+list entry. Writes refresh only the rows they touch: the signal receivers
+in signals.py cover single saves and deletes, and bulk writes call
+refresh_featured themselves."""
+from django.utils import timezone
+from artpartyapi.conditional import feed_validators
+from artpartyapi.fastserializers import artwork_data, artwork_values
+from artpartyapi.models import Artwork, FeaturedArtwork
+
+
+def refresh_featured(artwork_ids):
+    """Brings the feed rows of `artwork_ids` up to date: featured artworks
+    get their entry (re)built, the rest lose theirs. Ranks are kept."""
+    artwork_ids = set(artwork_ids)
+    if not artwork_ids:
+        return
+    featured = Artwork.objects.filter(id__in=artwork_ids, featured=True)
+    now = timezone.now()
+    entries = [
+        FeaturedArtwork(artwork_id=data['id'], data=data, updated_at=now)
+        for data in artwork_data(artwork_values(featured))
+    ]
+    FeaturedArtwork.objects.bulk_create(
+        entries,
+        update_conflicts=True,
+        unique_fields=['artwork_id'],
+        update_fields=['data', 'updated_at'],
+    )
+    stale = artwork_ids - {entry.artwork_id for entry in entries}
+    if stale:
+        FeaturedArtwork.objects.filter(artwork_id__in=stale).delete()
+
+
+def refresh_featured_where(**lookups):
+    """Refreshes the feed rows of featured artworks matching `lookups`,
+    e.g. the ones by an artist who was just renamed"""
+    refresh_featured(Artwork.objects.filter(featured=True, **lookups).values_list('id', flat=True))
+
+
+def rebuild_feed():
+    """Rebuilds every feed row. Returns the number of featured artworks."""
+    FeaturedArtwork.objects.exclude(artwork__featured=True).delete()
+    ids = list(Artwork.objects.filter(featured=True).values_list('id', flat=True))
+    for start in range(0, len(ids), 500):
+        refresh_featured(ids[start:start + 500])
+    return len(ids)
+
+
+def feed():
+    """The homepage: every featured artwork's list entry, by rank.
+    Returns: (entries, ETag, Last-Modified) from one read of the feed table"""
+    return feed_from_rows(list(feed_rows()))
+
+
+async def afeed():
+    """feed for async views"""
+    return feed_from_rows([row async for row in feed_rows()])
+
+
+def feed_rows():
+    return FeaturedArtwork.objects.order_by('rank', 'artwork_id').values_list('artwork_id', 'updated_at', 'data')
+
+
+def feed_from_rows(rows):
+    etag, last_modified = feed_validators([row[:2] for row in rows])
+    return [row[2] for row in rows], etag, last_modified
@@ -0,0 +1,306 @@
+"""Image metadata and thumbnails for artworks.
+
+An artwork's img is a URL to a full-size image. Saving an artwork points
+it at the Image row for that URL (see signals.py; bulk writes call
+attach() themselves), and an `images.ingest` job fetches images that
+haven't been read yet. The job records the size, dimensions, SHA-256 and
+dominant colour, and writes a JPEG thumbnail for each of
+ARTPARTY_THUMBNAIL_SIZES to the thumbnail store (see thumbnails.py). The
+artwork's `image` field then tells a grid how to lay it out before any
+image loads.
+
+Fetching goes through the class named by ARTPARTY_IMAGE_FETCHER, which
+only needs a fetch(url) method; None turns ingestion off. HTTPFetcher
+refuses hosts on private networks unless
+ARTPARTY_IMAGE_ALLOW_PRIVATE_HOSTS is set, since the URLs come from users.
+
+Reading pixels needs Pillow, which the Pipfile installs. Without it,
+dimensions come from the PNG, GIF, JPEG or WebP header, and there is no
+colour and no thumbnails."""
+import hashlib
+import http.client
+import io
+import ipaddress
+import socket
+import struct
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from artpartyapi import changelog, jobs
+from artpartyapi.cache import bump_generation
+from artpartyapi.feed import refresh_featured
+from artpartyapi.models import Artwork, FeaturedArtwork, Image
+from artpartyapi.thumbnails import get_store, thumbnail_dimensions, thumbnail_sizes
+
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:  # pragma: no cover - Pillow is optional
+    PILImage = None
+
+# Errors Pillow raises for data it can't decode
+if PILImage is not None:
+    DECODE_ERRORS = (OSError, ValueError, SyntaxError, PILImage.DecompressionBombError)
+else:  # pragma: no cover
+    DECODE_ERRORS = ()
+
+
+class FetchError(Exception):
+    """An image that couldn't be fetched. Permanent errors (a 404, data that
+    isn't an image) mark the image failed; others fail the job, which retries."""
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def public_connection(host, port, timeout, source_address=None):
+    """Connects to `host` once every address it resolves to is checked to
+    be public. The socket goes to an address that was checked, so a name
+    that resolves somewhere else by the time of the connect can't slip
+    past. Raises FetchError for a private or unresolvable host."""
+    if getattr(settings, 'ARTPARTY_IMAGE_ALLOW_PRIVATE_HOSTS', False):
+        return socket.create_connection((host, port), timeout, source_address)
+    try:
+        addresses = [info[4] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    except (socket.gaierror, UnicodeError) as ex:
+        raise FetchError(f'Can not resolve {host}: {ex}') from None
+    for address in addresses:
+        if not ipaddress.ip_address(address[0].split('%')[0]).is_global:
+            raise FetchError(f'{host} is not a public address', permanent=True)
+    error = OSError(f'Can not connect to {host}')
+    for address in addresses:
+        try:
+            return socket.create_connection(address[:2], timeout, source_address)
+        except OSError as ex:
+            error = ex
+    raise error
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    """An HTTP connection to public addresses only"""
+
+    def connect(self):
+        self.sock = public_connection(self.host, self.port, self.timeout, self.source_address)
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    """An HTTPS connection to public addresses only. The certificate is
+    still checked against the host name."""
+
+    def connect(self):
+        sock = public_connection(self.host, self.port, self.timeout, self.source_address)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class HTTPRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follows redirects to http and https URLs only"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urlsplit(newurl).scheme not in ('http', 'https'):
+            raise FetchError('Only http and https URLs are fetched', permanent=True)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class HTTPFetcher:
+    """Fetches images over HTTP(S), up to ARTPARTY_IMAGE_MAX_BYTES"""
+
+    def __init__(self):
+        self.timeout = getattr(settings, 'ARTPARTY_IMAGE_FETCH_TIMEOUT', 10)
+        self.max_bytes = getattr(settings, 'ARTPARTY_IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+        # Every connection, redirects included, checks where it goes. A
+        # proxy would make the connection instead, so none is used.
+        self.opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler({}), PublicHTTPHandler, PublicHTTPSHandler, HTTPRedirectHandler,
+        )
+
+    def fetch(self, url):
+        """Returns: (bytes, content type)"""
+        if urlsplit(url).scheme not in ('http', 'https'):
+            raise FetchError('Only http and https URLs are fetched', permanent=True)
+        request = urllib.request.Request(url, headers={'User-Agent': 'artparty-images'})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                data = response.read(self.max_bytes + 1)
+                content_type = response.headers.get_content_type()
+        except urllib.error.HTTPError as ex:
+            # Timeouts and rate limits are worth another try, other client errors aren't
+            raise FetchError(f'HTTP {ex.code}', permanent=400 <= ex.code < 500 and ex.code not in (408, 429)) from None
+        except (urllib.error.URLError, OSError) as ex:
+            raise FetchError(str(ex)) from None
+        if len(data) > self.max_bytes:
+            raise FetchError('Image is over ARTPARTY_IMAGE_MAX_BYTES', permanent=True)
+        return data, content_type
+
+
+def fetcher_path():
+    return getattr(settings, 'ARTPARTY_IMAGE_FETCHER', 'artpartyapi.images.HTTPFetcher')
+
+
+def get_fetcher():
+    return import_string(fetcher_path())() if fetcher_path() else None
+
+
+def header_dimensions(data):
+    """(width, height) from a PNG, GIF, JPEG or WebP header, or None"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+        return struct.unpack('>II', data[16:24])
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', data[6:10])
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':
+            bits = int.from_bytes(data[21:25], 'little')
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+        return None
+    if data[:2] == b'\xff\xd8':
+        # Walk the segments to the frame header
+        position = 2
+        while position + 9 <= len(data):
+            if data[position] != 0xFF:
+                position += 1
+                continue
+            marker = data[position + 1]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', data[position + 5:position + 9])
+                return width, height
+            if marker in (0x01, 0xD8, 0xFF) or 0xD0 <= marker <= 0xD7:
+                position += 2 if marker != 0xFF else 1
+                continue
+            position += 2 + struct.unpack('>H', data[position + 2:position + 4])[0]
+    return None
+
+
+def decode(data):
+    """The image as upright RGB, with transparency over white.
+    Raises FetchError if Pillow can't read it."""
+    try:
+        image = ImageOps.exif_transpose(PILImage.open(io.BytesIO(data)))
+        image.load()
+    except DECODE_ERRORS as ex:
+        raise FetchError(f'Unreadable image: {ex}', permanent=True) from None
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = PILImage.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def dominant_color(image):
+    """The most common colour of a few, as #rrggbb"""
+    small = image.copy()
+    small.thumbnail((64, 64))
+    palette = small.quantize(colors=8)
+    _, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def write_thumbnails(image, content_hash):
+    """Writes the thumbnails of a decoded image that the store doesn't have.
+    Images are never scaled up, so small ones get fewer thumbnails.
+    Returns: the bounding box of each thumbnail"""
+    store = get_store()
+    sizes = [size for size in thumbnail_sizes() if size < max(image.size)]
+    for size in sizes:
+        if store.exists(content_hash, size):
+            continue
+        output = io.BytesIO()
+        image.resize(thumbnail_dimensions(*image.size, size), PILImage.Resampling.LANCZOS) \
+            .save(output, 'JPEG', quality=80, optimize=True, progressive=True)
+        store.save(content_hash, size, output.getvalue())
+    return sizes
+
+
+def attach(artworks):
+    """Points each of `artworks` at the Image row for its img, creating
+    rows for new URLs.
+    Returns: ids of the images still to be fetched"""
+    artworks = [artwork for artwork in artworks if artwork.img]
+    if not artworks or not fetcher_path():
+        return []
+    urls = {artwork.img for artwork in artworks}
+    images = {image.url: image for image in Image.objects.filter(url__in=urls)}
+    missing = urls - set(images)
+    if missing:
+        Image.objects.bulk_create([Image(url=url) for url in missing], ignore_conflicts=True)
+        images.update((image.url, image) for image in Image.objects.filter(url__in=missing))
+    for artwork in artworks:
+        artwork.image = images[artwork.img]
+        artwork._attached_img = artwork.img
+    return sorted({image.id for image in images.values() if image.status == Image.PENDING})
+
+
+def queue(image_ids):
+    """Queues fetching each of `image_ids`"""
+    for image_id in image_ids:
+        jobs.enqueue('images.ingest', {'image_id': image_id}, key=f'images.ingest:{image_id}')
+
+
+@jobs.register('images.ingest')
+def ingest(image_id):
+    """Fetches an image, records what it is and writes its thumbnails"""
+    image = Image.objects.filter(id=image_id).first()
+    fetcher = get_fetcher()
+    if image is None or fetcher is None:
+        return
+    try:
+        data, content_type = fetcher.fetch(image.url)
+        decoded = decode(data) if PILImage is not None else None
+        dimensions = decoded.size if decoded is not None else header_dimensions(data)
+        if dimensions is None:
+            raise FetchError('Not a PNG, GIF, JPEG or WebP image', permanent=True)
+    except FetchError as ex:
+        if not ex.permanent:
+            raise
+        Image.objects.filter(id=image.id).update(status=Image.FAILED, error=str(ex), fetched_at=timezone.now())
+        images_changed([image.id])
+        return
+
+    content_hash = hashlib.sha256(data).hexdigest()
+    Image.objects.filter(id=image.id).update(
+        status=Image.READY,
+        content_hash=content_hash,
+        content_type=content_type,
+        size=len(data),
+        width=dimensions[0],
+        height=dimensions[1],
+        color=dominant_color(decoded) if decoded is not None else '',
+        thumbnails=write_thumbnails(decoded, content_hash) if decoded is not None else [],
+        error='',
+        fetched_at=timezone.now(),
+    )
+    images_changed([image.id])
+
+
+def images_changed(image_ids):
+    """Artworks showing `image_ids` serialize differently now: touch them so
+    their ETags and Last-Modified move, log them for /sync, rebuild their
+    feed entries and move cached responses on"""
+    artworks = list(Artwork.objects.filter(image_id__in=image_ids).only('id', 'user_id', 'featured'))
+    if not artworks:
+        return
+    Artwork.objects.filter(id__in=[artwork.id for artwork in artworks]).update(updated_at=timezone.now())
+    changelog.record(artworks)
+    refresh_featured(artwork.id for artwork in artworks if artwork.featured)
+    bump_generation(Artwork, FeaturedArtwork)
@@ -0,0 +1,246 @@
+"""Background jobs, queued in the Job table and run by `manage.py runworker`.
+
+register() names a function as a job and enqueue() queues a call to it
+with JSON keyword arguments. The job row is written in the caller's
+transaction, so work is queued exactly when the write that needs it
+commits. A worker runs each job in a transaction that also deletes its
+row: the database side of a job happens once, or is rolled back and
+retried. Failures are retried ARTPARTY_JOBS_MAX_ATTEMPTS times with
+exponential backoff, and a job whose worker died is picked up again after
+ARTPARTY_JOBS_LOCK_SECONDS.
+
+A job queued with a `key` is dropped while another with the same key is
+still waiting, so ten saves of one artwork refresh it once. A job that has
+already started doesn't absorb new ones, since it may have read the data
+before the latest write.
+
+With ARTPARTY_JOBS_EAGER, as in the test suite, enqueue() runs the job
+there and then instead."""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+from multiprocessing import get_context
+import django
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from artpartyapi.models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class JobType:
+    """A registered job function"""
+
+    def __init__(self, name, function, max_attempts=None):
+        self.name = name
+        self.function = function
+        self.max_attempts = max_attempts
+
+    def attempts(self):
+        return self.max_attempts or getattr(settings, 'ARTPARTY_JOBS_MAX_ATTEMPTS', 5)
+
+
+class LostClaim(Exception):
+    """The job was handed to another worker while this one ran it"""
+
+
+def register(name, max_attempts=None):
+    """Registers the decorated function as the job `name`"""
+    def decorator(function):
+        _registry[name] = JobType(name, function, max_attempts)
+        return function
+    return decorator
+
+
+def is_eager():
+    return getattr(settings, 'ARTPARTY_JOBS_EAGER', False)
+
+
+def enqueue(name, payload=None, key=None, delay=0):
+    """Queues the job `name` with `payload` as its keyword arguments, to
+    run `delay` seconds from now at the earliest.
+    Returns: the Job, the waiting one with the same `key`, or None when
+    the job ran eagerly"""
+    if name not in _registry:
+        raise LookupError(f'No job named {name!r}')
+    # Round trip the payload, so eager runs see what a worker would
+    payload = json.loads(json.dumps(payload or {}, cls=DjangoJSONEncoder))
+    if is_eager():
+        with transaction.atomic():
+            _registry[name].function(**payload)
+        return None
+
+    job = Job(name=name, payload=payload, key=key, run_at=timezone.now() + timedelta(seconds=delay))
+    if key is None:
+        job.save()
+        return job
+    waiting = Job.objects.filter(key=key, status=Job.QUEUED).first()
+    if waiting is not None:
+        return waiting
+    try:
+        with transaction.atomic():
+            job.save()
+        return job
+    except IntegrityError:
+        # Queued by someone else since the check above
+        return Job.objects.filter(key=key, status=Job.QUEUED).first()
+
+
+def backoff(attempts):
+    """Seconds before retrying a job that failed `attempts` times: doubling
+    from ARTPARTY_JOBS_RETRY_SECONDS, capped at ARTPARTY_JOBS_MAX_RETRY_SECONDS
+    and jittered so jobs that failed together don't retry together"""
+    delay = getattr(settings, 'ARTPARTY_JOBS_RETRY_SECONDS', 10) * 2 ** (attempts - 1)
+    delay = min(delay, getattr(settings, 'ARTPARTY_JOBS_MAX_RETRY_SECONDS', 3600))
+    return delay * random.uniform(0.5, 1)
+
+
+def claim(limit, worker):
+    """Marks up to `limit` due jobs as running for `worker`, oldest first.
+    Returns: ids of the jobs claimed"""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id').values_list('id', flat=True)
+    running = {'status': Job.RUNNING, 'locked_by': worker, 'locked_at': now, 'attempts': F('attempts') + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        # Other workers skip the rows locked here
+        with transaction.atomic():
+            job_ids = list(due.select_for_update(skip_locked=True)[:limit])
+            Job.objects.filter(id__in=job_ids).update(**running)
+        return job_ids
+    # Without row locks each claim is an update only one worker can win, made
+    # outside a transaction: SQLite can't turn a read into a write while
+    # another connection writes
+    return [job_id for job_id in list(due[:limit]) if Job.objects.filter(id=job_id, status=Job.QUEUED).update(**running)]
+
+
+def run_job(job_id):
+    """Runs a claimed job. Its changes and the removal of its row commit
+    together; a failure rolls both back and schedules a retry."""
+    job = Job.objects.filter(id=job_id, status=Job.RUNNING).first()
+    if job is None:
+        return
+    job_type = _registry.get(job.name)
+    try:
+        if job_type is None:
+            raise LookupError(f'No job named {job.name!r}')
+        with transaction.atomic():
+            # Deleting the row first checks the claim and, on SQLite, takes the
+            # write lock up front, where a busy database is waited for
+            if not Job.objects.filter(id=job.id, status=Job.RUNNING, attempts=job.attempts).delete()[0]:
+                raise LostClaim(job.id)
+            job_type.function(**job.payload)
+    except LostClaim:
+        pass
+    except Exception:
+        failed(job, traceback.format_exc(), job_type.attempts() if job_type else 1)
+
+
+def failed(job, error, max_attempts):
+    """Schedules another attempt at `job`, or marks it failed for good"""
+    attempt = Job.objects.filter(id=job.id, status=Job.RUNNING, attempts=job.attempts)
+    if job.attempts >= max_attempts:
+        attempt.update(status=Job.FAILED, last_error=error, locked_by='', locked_at=None)
+        return
+    try:
+        with transaction.atomic():
+            attempt.update(
+                status=Job.QUEUED, last_error=error, locked_by='', locked_at=None,
+                run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)),
+            )
+    except IntegrityError:
+        # A job with the same key was queued meanwhile and does the same work
+        attempt.delete()
+
+
+def requeue_stale():
+    """Retries jobs whose worker has held them for over
+    ARTPARTY_JOBS_LOCK_SECONDS, presumably because it died.
+    Returns: number of jobs requeued or failed"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'ARTPARTY_JOBS_LOCK_SECONDS', 600))
+    stale = list(Job.objects.filter(status=Job.RUNNING, locked_at__lt=cutoff))
+    for job in stale:
+        job_type = _registry.get(job.name)
+        failed(job, f'Worker {job.locked_by} stopped before finishing', job_type.attempts() if job_type else 1)
+    return len(stale)
+
+
+def run_pending(worker='inline'):
+    """Runs every due job in this thread, e.g. from a cron job or a test.
+    Returns: number of jobs run"""
+    count = 0
+    while True:
+        job_ids = claim(1, worker)
+        if not job_ids:
+            return count
+        run_job(job_ids[0])
+        count += 1
+
+
+def _run_in_pool(job_id):
+    # Pool threads and processes keep a connection each, like request threads
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+class Worker:
+    """Claims due jobs and runs them on a pool of `concurrency` threads or
+    processes. Processes are spawned fresh rather than forked, so none of
+    them shares the parent's database connection."""
+
+    def __init__(self, concurrency=None, pool='thread', poll_interval=None, name=None):
+        self.concurrency = concurrency or getattr(settings, 'ARTPARTY_JOBS_CONCURRENCY', 4)
+        self.pool = pool
+        self.poll_interval = poll_interval if poll_interval is not None \
+            else getattr(settings, 'ARTPARTY_JOBS_POLL_SECONDS', 1)
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+
+    def executor(self):
+        if self.pool == 'process':
+            return ProcessPoolExecutor(self.concurrency, mp_context=get_context('spawn'), initializer=django.setup)
+        return ThreadPoolExecutor(self.concurrency, thread_name_prefix='runworker')
+
+    def stop(self):
+        """Stops claiming jobs; the ones running are finished first"""
+        self.stopping.set()
+
+    def run(self, once=False):
+        """Runs jobs until stop(), or with `once` until none are due.
+        Returns: number of jobs run"""
+        count = 0
+        running = set()
+        with self.executor() as executor:
+            while not self.stopping.is_set():
+                close_old_connections()
+                requeue_stale()
+                job_ids = claim(self.concurrency - len(running), self.name) if len(running) < self.concurrency else []
+                running.update(executor.submit(_run_in_pool, job_id) for job_id in job_ids)
+                count += len(job_ids)
+                if once and not running:
+                    break
+                if running:
+                    done, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            future.result()
+                        except Exception:
+                            # Only this job is lost, and requeue_stale() picks it up again
+                            logger.exception('Job runner failed')
+                elif not job_ids:
+                    self.stopping.wait(self.poll_interval)
+            wait(running)
+        return count
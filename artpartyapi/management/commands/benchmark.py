@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from artpartyapi import benchmark
+from artpartyapi.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the main endpoints at several synthetic data sizes in a throwaway '
+            'database and saves the results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Comma separated artwork counts; other tables scale with them')
+        parser.add_argument('--requests', type=int, default=20, help='Requests per endpoint and size')
+        parser.add_argument('--warm-cache', action='store_true', help='Let the response cache serve repeat requests')
+        parser.add_argument('--concurrency', type=int, default=0,
+                            help='Also compare WSGI and ASGI throughput with this many requests in flight')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--baseline', help='Earlier results to check for p95 regressions')
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help='p95 ratio over the baseline that counts as a regression')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',')})
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of numbers') from None
+        if options['concurrency'] < 0:
+            raise CommandError('--concurrency must not be negative')
+
+        results = {'environment': benchmark.environment(), 'options': {
+            key: options[key] for key in ('requests', 'warm_cache', 'concurrency', 'seed')
+        }, 'sizes': {}, 'concurrency': {}}
+
+        # Never touch the real database: benchmark in a test database like the test runner does
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            client = Client()
+            loaded = 0
+            for step, size in enumerate(sizes):
+                # Sizes only grow, so each step adds the difference to the data already there
+                extra = size - loaded
+                self.stdout.write(f'Generating {size} artworks')
+                generate(
+                    users=max(1, extra // 1000),
+                    artists=max(1, extra // 100),
+                    artworks=extra,
+                    artwork_tags=extra * 5,
+                    tags=200 if step == 0 else 0,
+                    seed=options['seed'] + step,
+                )
+                loaded = size
+                self.stdout.write(f'Measuring {size} artworks')
+                results['sizes'][str(size)] = benchmark.run(
+                    client, options['requests'], options['warm_cache'], options['seed'],
+                )
+                for name, stats in results['sizes'][str(size)].items():
+                    self.stdout.write(
+                        f"  {name:24} p50 {stats['latency_ms']['p50']:8.2f}ms  p95 {stats['latency_ms']['p95']:8.2f}ms  "
+                        f"{stats['throughput_rps']:8.1f} req/s  {stats['queries']:4g} queries  "
+                        f"{stats['peak_memory_bytes'] / 1024:9.0f} KiB peak"
+                    )
+                if options['concurrency']:
+                    self.stdout.write(f"Measuring {size} artworks, {options['concurrency']} requests in flight")
+                    results['concurrency'][str(size)] = benchmark.run_concurrent(
+                        options['requests'], options['concurrency'], options['warm_cache'], options['seed'],
+                    )
+                    for name, servers in results['concurrency'][str(size)].items():
+                        self.stdout.write(f'  {name:24} ' + '  '.join(
+                            f"{server} {stats['throughput_rps']:8.1f} req/s p95 {stats['latency_ms']['p95']:8.2f}ms"
+                            for server, stats in servers.items()
+                        ))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        benchmark.save(results, options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Saved results to {options['output']}"))
+
+        if options['baseline']:
+            regressions = benchmark.compare(results, benchmark.load(options['baseline']), options['threshold'])
+            for size, name, before, after in regressions:
+                self.stdout.write(self.style.ERROR(f'{name} at {size} artworks: p95 {before:.2f}ms -> {after:.2f}ms'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} endpoint(s) regressed past {options["threshold"]}x the baseline')
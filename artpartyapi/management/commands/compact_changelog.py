@@ -0,0 +1,19 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from artpartyapi.changelog import compact
+
+
+class Command(BaseCommand):
+    help = ('Compacts the /sync change log: drops changes superseded by later ones and every change '
+            'older than the retention window (ARTPARTY_SYNC_RETENTION_DAYS)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=float,
+                            help='Keep this many days of changes instead of ARTPARTY_SYNC_RETENTION_DAYS')
+
+    def handle(self, *args, **options):
+        days = options['retention_days']
+        if days is not None and days < 0:
+            raise CommandError('--retention-days must not be negative')
+        removed = compact(None if days is None else timedelta(days=days))
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} change rows'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from artpartyapi.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = 'Adds reproducible synthetic users, artists, artworks and tags for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--artists', type=int, default=10000)
+        parser.add_argument('--artworks', type=int, default=100000)
+        parser.add_argument('--artwork-tags', type=int, default=500000)
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            generate(
+                users=options['users'],
+                artists=options['artists'],
+                artworks=options['artworks'],
+                artwork_tags=options['artwork_tags'],
+                tags=options['tags'],
+                seed=options['seed'],
+                batch_size=options['batch_size'],
+                log=self.stdout.write,
+            )
+        except ValueError as ex:
+            raise CommandError(ex) from None
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from artpartyapi.images import attach, fetcher_path, queue
+from artpartyapi.models import Artwork, Image
+
+
+class Command(BaseCommand):
+    help = ('Queues fetching the images of artworks that have no image metadata yet, e.g. ones '
+            'loaded from fixtures or created before image ingestion existed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Also fetch images that failed before')
+
+    def handle(self, *args, **options):
+        if not fetcher_path():
+            raise CommandError('Image ingestion is off: ARTPARTY_IMAGE_FETCHER is not set')
+        if options['retry_failed']:
+            Image.objects.filter(status=Image.FAILED).update(status=Image.PENDING, error='')
+
+        attached = 0
+        artworks = Artwork.objects.filter(image__isnull=True).exclude(img='').only('id', 'img', 'image')
+        # Ids first, since attaching takes artworks out of the filter
+        ids = list(artworks.values_list('id', flat=True))
+        for start in range(0, len(ids), 500):
+            batch = list(artworks.filter(id__in=ids[start:start + 500]))
+            attach(batch)
+            Artwork.objects.bulk_update(batch, ['image'])
+            attached += len(batch)
+
+        pending = list(Image.objects.filter(status=Image.PENDING).values_list('id', flat=True))
+        queue(pending)
+        self.stdout.write(self.style.SUCCESS(f'Attached {attached} artworks; queued {len(pending)} images'))
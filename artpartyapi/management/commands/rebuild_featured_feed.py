@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from artpartyapi.feed import rebuild_feed
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the materialized feed of featured artworks'
+
+    def handle(self, *args, **options):
+        count = rebuild_feed()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} featured artworks'))
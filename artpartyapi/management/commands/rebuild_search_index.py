@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from artpartyapi.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the artwork full-text search index'
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        if count is None:
+            self.stdout.write('No full-text index on this database; search uses the LIKE fallback')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Indexed {count} artworks'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from artpartyapi.cache import bump_generation
+from artpartyapi.counters import reconcile
+from artpartyapi.models import Artist, Tag, User
+
+
+class Command(BaseCommand):
+    help = 'Recounts the artist, user and tag counters and the tag usage table, fixing any that drifted'
+
+    def handle(self, *args, **options):
+        fixed = reconcile()
+        bump_generation(Artist, Tag, User)
+        for model_name, count in fixed.items():
+            self.stdout.write(self.style.SUCCESS(f'{model_name}: fixed {count} rows'))
@@ -0,0 +1,30 @@
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from artpartyapi.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = ('Runs queued background jobs: the search index, feed and counter updates left by artwork '
+            'writes. Stops cleanly on SIGINT or SIGTERM once the running jobs finish.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int,
+                            help='Jobs run at once, instead of ARTPARTY_JOBS_CONCURRENCY')
+        parser.add_argument('--pool', choices=('thread', 'process'), default='thread',
+                            help='Run jobs on threads (the default) or on separate processes')
+        parser.add_argument('--poll-interval', type=float,
+                            help='Seconds between polls of an idle queue, instead of ARTPARTY_JOBS_POLL_SECONDS')
+        parser.add_argument('--once', action='store_true', help='Exit once no jobs are due')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] is not None and options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        if options['poll_interval'] is not None and options['poll_interval'] <= 0:
+            raise CommandError('--poll-interval must be positive')
+
+        worker = Worker(options['concurrency'], options['pool'], options['poll_interval'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: worker.stop())
+        self.stdout.write(f'Worker {worker.name} running up to {worker.concurrency} jobs at once on a {options["pool"]} pool')
+        count = worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f'Ran {count} jobs'))
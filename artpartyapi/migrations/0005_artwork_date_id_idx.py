@@ -0,0 +1,17 @@
+# Generated by Django 4.1.3 on 2026-10-18 00:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artpartyapi', '0004_remove_user_email'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='artwork',
+            index=models.Index(fields=['-date', '-id'], name='artwork_date_id_idx'),
+        ),
+    ]
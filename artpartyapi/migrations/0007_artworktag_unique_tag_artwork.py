@@ -0,0 +1,25 @@
+# Generated by Django 4.1.3 on 2026-10-18 00:10
+
+from django.db import migrations, models
+
+
+def remove_duplicate_links(apps, schema_editor):
+    """Keeps the oldest link for each (tag, artwork) pair"""
+    ArtworkTag = apps.get_model('artpartyapi', 'ArtworkTag')
+    keep = ArtworkTag.objects.values('tag_id', 'artwork_id').annotate(keep_id=models.Min('id')).values('keep_id')
+    ArtworkTag.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artpartyapi', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_links, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='artworktag',
+            constraint=models.UniqueConstraint(fields=('tag', 'artwork'), name='unique_tag_artwork'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+def create_fts_table(apps, schema_editor):
+    """FTS5 is SQLite only; other backends search with the LIKE fallback"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE artpartyapi_artwork_fts USING fts5("
+                "title, medium, description, artist_name, tokenize='unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5
+            return
+        cursor.execute(
+            'INSERT INTO artpartyapi_artwork_fts (rowid, title, medium, description, artist_name) '
+            'SELECT artwork.id, artwork.title, artwork.medium, artwork.description, artist.name '
+            'FROM artpartyapi_artwork artwork JOIN artpartyapi_artist artist ON artist.id = artwork.artist_id'
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS artpartyapi_artwork_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artpartyapi', '0007_artworktag_unique_tag_artwork'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.3 on 2026-10-18 00:16
+
+from django.db import migrations, models
+
+
+def merge_duplicate_uids(apps, schema_editor):
+    """Keeps the oldest user for each uid and moves the duplicates' artists
+    and artworks over to it"""
+    User = apps.get_model('artpartyapi', 'User')
+    Artist = apps.get_model('artpartyapi', 'Artist')
+    Artwork = apps.get_model('artpartyapi', 'Artwork')
+    duplicated = User.objects.values('uid').annotate(users=models.Count('id'), keep_id=models.Min('id')).filter(users__gt=1)
+    for row in duplicated:
+        duplicates = User.objects.filter(uid=row['uid']).exclude(id=row['keep_id'])
+        Artist.objects.filter(user__in=duplicates).update(user_id=row['keep_id'])
+        Artwork.objects.filter(user__in=duplicates).update(user_id=row['keep_id'])
+        duplicates.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artpartyapi', '0008_artwork_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_uids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='uid',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.3 on 2026-10-18 00:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artpartyapi', '0009_user_uid_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeaturedArtwork',
+            fields=[
+                ('artwork', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feed_entry', serialize=False, to='artpartyapi.artwork')),
+                ('rank', models.IntegerField(default=0)),
+                ('data', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='featuredartwork',
+            index=models.Index(fields=['rank', 'artwork'], name='featured_rank_idx'),
+        ),
+    ]
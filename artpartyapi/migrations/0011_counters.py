@@ -0,0 +1,51 @@
+# Generated by Django 4.1.3 on 2026-10-18 00:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artpartyapi', '0010_featuredartwork'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='artwork_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='featured_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='tag_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='artwork_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='featured_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='tag_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='artwork',
+            index=models.Index(fields=['artist', '-date', '-id'], name='artwork_artist_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='artwork',
+            index=models.Index(fields=['user', '-date', '-id'], name='artwork_user_date_idx'),
+        ),
+    ]
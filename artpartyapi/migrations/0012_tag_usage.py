@@ -0,0 +1,85 @@
+# Generated by Django 4.1.3 on 2026-10-18 00:25
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+import django.db.models.functions.text
+
+
+def count_existing(apps, schema_editor):
+    """Fills in the counters of 0011 and this migration. A frozen copy of
+    counters.reconcile, which may change after this migration has run."""
+    Artwork = apps.get_model('artpartyapi', 'Artwork')
+    ArtworkTag = apps.get_model('artpartyapi', 'ArtworkTag')
+    TagUsage = apps.get_model('artpartyapi', 'TagUsage')
+
+    def count(queryset, group_by):
+        counts = queryset.filter(**{group_by: OuterRef('pk')}).order_by().values(group_by) \
+            .annotate(count=Count('id')).values('count')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    for model_name, field in (('Artist', 'artist'), ('User', 'user')):
+        apps.get_model('artpartyapi', model_name).objects.update(
+            artwork_count=count(Artwork.objects.all(), field),
+            featured_count=count(Artwork.objects.filter(featured=True), field),
+            tag_count=count(ArtworkTag.objects.all(), f'artwork__{field}'),
+        )
+    apps.get_model('artpartyapi', 'Tag').objects.update(usage_count=count(ArtworkTag.objects.all(), 'tag'))
+
+    usages = ArtworkTag.objects.order_by().values('artwork__artist_id', 'artwork__user_id', 'tag_id') \
+        .annotate(count=Count('id'))
+    TagUsage.objects.bulk_create([
+        TagUsage(artist_id=row['artwork__artist_id'], user_id=row['artwork__user_id'], tag_id=row['tag_id'], count=row['count'])
+        for row in usages
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artpartyapi', '0011_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='usage_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(django.db.models.functions.text.Lower('label'), name='tag_label_lower_idx'),
+        ),
+        migrations.AddField(
+            model_name='tagusage',
+            name='artist',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='artpartyapi.artist'),
+        ),
+        migrations.AddField(
+            model_name='tagusage',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='artpartyapi.tag'),
+        ),
+        migrations.AddField(
+            model_name='tagusage',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='artpartyapi.user'),
+        ),
+        migrations.AddIndex(
+            model_name='tagusage',
+            index=models.Index(fields=['user', 'tag'], name='tag_usage_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tagusage',
+            constraint=models.UniqueConstraint(fields=('artist', 'user', 'tag'), name='unique_tag_usage'),
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.3 on 2026-10-18 00:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artpartyapi', '0012_tag_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('artwork', 'Artwork'), ('artist', 'Artist'), ('tag', 'Tag'), ('artworktag', 'Artwork tag')], max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('user_id', models.IntegerField(null=True)),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['user_id', 'seq'], name='change_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['kind', 'object_id'], name='change_object_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['changed_at'], name='change_changed_at_idx'),
+        ),
+    ]
@@ -1,5 +1,10 @@
 from .artist import Artist
 from .artwork import Artwork
 from .artworktag import ArtworkTag
+from .change import Change
+from .featuredartwork import FeaturedArtwork
+from .image import Image
+from .job import Job
 from .tag import Tag
+from .tagusage import TagUsage
 from .user import User
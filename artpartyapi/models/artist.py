@@ -7,3 +7,8 @@ class Artist(models.Model):
     name = models.CharField(max_length=50)
     img = models.CharField(max_length=500)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Kept up to date by counters.py; reconcile_counters repairs any drift
+    artwork_count = models.IntegerField(default=0)
+    featured_count = models.IntegerField(default=0)
+    tag_count = models.IntegerField(default=0)
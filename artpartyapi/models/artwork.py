@@ -1,6 +1,31 @@
 from django.db import models
 from .user import User
 from .artist import Artist
+from .image import Image
+
+
+class ArtworkQuerySet(models.QuerySet):
+
+    def with_related(self):
+        """Load user, artist and artwork tags with their labels up front,
+        so serializing a list costs a fixed number of queries"""
+        # Imported here because ArtworkTag itself depends on Artwork
+        from .artworktag import ArtworkTag
+        return self.select_related('user', 'artist', 'image').prefetch_related(
+            models.Prefetch('tags', queryset=ArtworkTag.objects.select_related('tag').order_by('id'))
+        )
+
+    def tagged(self, tag_ids, match_all=False):
+        """Artworks carrying any (or all) of `tag_ids`, as one query that
+        reads the (tag, artwork) index on ArtworkTag"""
+        from .artworktag import ArtworkTag
+        tag_ids = set(tag_ids)
+        links = ArtworkTag.objects.filter(tag_id__in=tag_ids)
+        if match_all:
+            links = links.values('artwork_id').annotate(
+                matched=models.Count('tag_id', distinct=True)
+            ).filter(matched=len(tag_ids))
+        return self.filter(id__in=links.values('artwork_id'))
 
 
 class Artwork(models.Model):
@@ -14,3 +39,17 @@ class Artwork(models.Model):
     featured = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
+    # Metadata and thumbnails of `img`, filled in by images.py
+    image = models.ForeignKey(Image, null=True, blank=True, on_delete=models.SET_NULL, related_name='artworks')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ArtworkQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (date, id)
+            models.Index(fields=['-date', '-id'], name='artwork_date_id_idx'),
+            # Latest artwork of an artist or user, for their stats
+            models.Index(fields=['artist', '-date', '-id'], name='artwork_artist_date_idx'),
+            models.Index(fields=['user', '-date', '-id'], name='artwork_user_date_idx'),
+        ]
@@ -7,3 +7,10 @@ class ArtworkTag(models.Model):
 
     artwork = models.ForeignKey(Artwork, on_delete=models.CASCADE, related_name='tags')
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # Also the composite index that tag searches scan
+            models.UniqueConstraint(fields=['tag', 'artwork'], name='unique_tag_artwork'),
+        ]
@@ -0,0 +1,30 @@
+from django.db import models
+
+
+class Change(models.Model):
+    """One entry of the change log behind /sync: an artwork, artist, tag or
+    artwork tag that was saved, or deleted (a tombstone). `seq` orders the
+    log, and sync tokens count from it. changelog.py writes and compacts it."""
+
+    KINDS = (
+        ('artwork', 'Artwork'),
+        ('artist', 'Artist'),
+        ('tag', 'Tag'),
+        ('artworktag', 'Artwork tag'),
+    )
+
+    seq = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.IntegerField()
+    # Owner of an artwork or artist, so a client can sync just its own. A
+    # plain id rather than a foreign key, since tombstones outlive their user.
+    user_id = models.IntegerField(null=True)
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'seq'], name='change_user_seq_idx'),
+            models.Index(fields=['kind', 'object_id'], name='change_object_idx'),
+            models.Index(fields=['changed_at'], name='change_changed_at_idx'),
+        ]
@@ -0,0 +1,20 @@
+from django.db import models
+from .artwork import Artwork
+
+
+class FeaturedArtwork(models.Model):
+    """Precomputed homepage entry for a featured artwork.
+
+    `data` holds the artwork exactly as the artwork list serializes it, so
+    the homepage is one indexed read. feed.py keeps it in step with the
+    artwork, its tags, artist and user."""
+
+    artwork = models.OneToOneField(Artwork, on_delete=models.CASCADE, primary_key=True, related_name='feed_entry')
+    rank = models.IntegerField(default=0)
+    data = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['rank', 'artwork'], name='featured_rank_idx'),
+        ]
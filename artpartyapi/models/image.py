@@ -0,0 +1,30 @@
+from django.db import models
+
+
+class Image(models.Model):
+    """What images.py learned from fetching an artwork image URL: its size,
+    dimensions, SHA-256 and placeholder colour, and the thumbnail sizes
+    written to the thumbnail store. Artworks with the same URL share a row."""
+
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
+
+    url = models.CharField(max_length=500, unique=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.PositiveIntegerField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    # Dominant colour as #rrggbb, shown while the image loads
+    color = models.CharField(max_length=7, blank=True)
+    # Bounding box of each thumbnail written, smallest first
+    thumbnails = models.JSONField(default=list)
+    error = models.TextField(blank=True)
+    fetched_at = models.DateTimeField(null=True, blank=True)
@@ -1,6 +1,15 @@
 from django.db import models
+from django.db.models.functions import Lower
 
 
 class Tag(models.Model):
 
     label = models.CharField(max_length=50)
+    # Links to artworks; kept up to date by counters.py
+    usage_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Case-insensitive ?prefix= autocomplete seeks on this
+            models.Index(Lower('label'), name='tag_label_lower_idx'),
+        ]
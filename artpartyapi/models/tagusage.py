@@ -0,0 +1,24 @@
+from django.db import models
+from .artist import Artist
+from .tag import Tag
+from .user import User
+
+
+class TagUsage(models.Model):
+    """How many artworks by one artist, posted by one user, carry a tag.
+
+    A pre-aggregated ArtworkTag, so per-artist and per-user tag counts sum a
+    few rows instead of grouping every link. counters.py keeps it current."""
+
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['artist', 'user', 'tag'], name='unique_tag_usage'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'tag'], name='tag_usage_user_idx'),
+        ]
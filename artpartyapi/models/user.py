@@ -4,4 +4,13 @@ from django.db import models
 class User(models.Model):
 
     name = models.CharField(max_length=50)
-    uid = models.CharField(max_length=50)
+    uid = models.CharField(max_length=50, unique=True)
+    # Counts of the artworks this user posted; see counters.py
+    artwork_count = models.IntegerField(default=0)
+    featured_count = models.IntegerField(default=0)
+    tag_count = models.IntegerField(default=0)
+
+    @property
+    def is_authenticated(self):
+        """Lets DRF permissions treat a user resolved from a uid as logged in"""
+        return True
@@ -0,0 +1,163 @@
+"""Keyset (cursor) pagination for the list endpoints"""
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination:
+    """Paginates a queryset by seeking past the last row seen instead of
+    counting an offset, so deep pages cost the same as the first one.
+
+    The cursor is an opaque token holding the ordering values of the row at
+    the page boundary. Pagination only kicks in when the client sends
+    `cursor` or `page_size`, or when REST_FRAMEWORK['PAGE_SIZE'] is set,
+    so clients that expect a bare list keep getting one."""
+
+    ordering = ('id',)
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    default_page_size = 50
+    max_page_size = 500
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    def get_page_size(self, request):
+        """Page size requested by the client, or None if the client did not ask to paginate"""
+        # request.GET rather than query_params, so plain Django requests (the async views) work too
+        page_size = request.GET.get(self.page_size_query_param)
+        if page_size is not None:
+            try:
+                page_size = int(page_size)
+            except ValueError:
+                page_size = 0
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        if api_settings.PAGE_SIZE:
+            return api_settings.PAGE_SIZE
+        if self.cursor_query_param in request.GET or page_size is not None:
+            return self.default_page_size
+        return None
+
+    def paginate_queryset(self, queryset, request):
+        """Returns the rows for the requested page, or None when pagination is not requested"""
+        queryset = self.page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset for async views"""
+        queryset = self.page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.set_page([row async for row in queryset])
+
+    def page_queryset(self, queryset, request):
+        """The query for the requested page plus one row, or None when pagination is not requested"""
+        self.page_size = self.get_page_size(request)
+        if self.page_size is None:
+            return None
+        self.request = request
+
+        self.cursor = self.decode_cursor(request)
+        self.reverse = bool(self.cursor and self.cursor['r'])
+        ordering = self.reversed_ordering() if self.reverse else self.ordering
+        if self.cursor is not None:
+            try:
+                queryset = queryset.filter(self.seek(self.cursor['p'], ordering))
+            except (ValidationError, ValueError, TypeError):
+                # Values the ordering fields can't hold, such as a title where a date goes
+                raise NotFound('Invalid cursor') from None
+        return queryset.order_by(*ordering)[:self.page_size + 1]
+
+    def set_page(self, rows):
+        """Trims the extra row off what page_queryset fetched and notes which links exist"""
+        cursor, reverse = self.cursor, self.reverse
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Walked off the end, so there is no boundary row to seek from
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.position(self.page[0]), reverse=True)
+
+    def reversed_ordering(self):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering)
+
+    def position(self, row):
+        """Ordering values of a row, in a JSON friendly form"""
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            # Rows are model instances, or dicts when paginating .values()
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return values
+
+    def seek(self, position, ordering):
+        """Builds (a > x) OR (a = x AND b > y) ... for the given ordering"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, position, reverse):
+        token = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.GET.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            token = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+            cursor = json.loads(token)
+            if not isinstance(cursor, dict) or cursor.get('r') not in (0, 1):
+                raise ValueError
+            position = cursor['p']
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            if any(isinstance(value, (list, dict)) for value in position):
+                raise ValueError
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+            raise NotFound('Invalid cursor') from None
+        return cursor
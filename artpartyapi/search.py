@@ -0,0 +1,130 @@
+"""Full-text search over artworks.
+
+On SQLite the artworks are indexed in an FTS5 table (created by migration
+0008) and ranked with BM25. The index is kept current by the signal
+receivers in signals.py and can be rebuilt with
+`manage.py rebuild_search_index`. Other backends, or SQLite builds without
+FTS5, fall back to a LIKE scan. Searches read from the database the
+router picks for artwork reads (a replica during GET requests), and index
+writes go to the one it picks for artwork writes."""
+import re
+from django.db import connections, router
+from django.db.models import Q
+from artpartyapi.models import Artwork
+
+FTS_TABLE = 'artpartyapi_artwork_fts'
+
+SEARCH_COLUMNS = ('title', 'medium', 'description', 'artist_name')
+
+# BM25 weight of each column: a hit in the title counts for more than one in the description
+COLUMN_WEIGHTS = (10.0, 4.0, 1.0, 4.0)
+
+# (database alias, name) -> whether the FTS5 table exists there
+_fts_tables = {}
+
+
+def read_connection():
+    return connections[router.db_for_read(Artwork)]
+
+
+def write_connection():
+    return connections[router.db_for_write(Artwork)]
+
+
+def fts_available(connection):
+    """True when the FTS5 index exists on `connection`'s database"""
+    if connection.vendor != 'sqlite':
+        return False
+    key = (connection.alias, str(connection.settings_dict['NAME']))
+    if key not in _fts_tables:
+        _fts_tables[key] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_tables[key]
+
+
+def forget_fts_tables():
+    """Makes fts_available() look again, after migrations may have added or
+    dropped the table"""
+    _fts_tables.clear()
+
+
+def search_terms(query):
+    """Words in a user query, with FTS5 syntax stripped out"""
+    return re.findall(r'\w+', query)
+
+
+def fts_query(terms):
+    """Every term must match; the last one also matches as a prefix so
+    results keep up while a user is typing"""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_artwork_ids(query, limit, offset=0):
+    """Ids of artworks matching `query`, best match first"""
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    connection = read_connection()
+    if fts_available(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {", ".join(map(str, COLUMN_WEIGHTS))}), rowid '
+                'LIMIT %s OFFSET %s',
+                [fts_query(terms), limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    artworks = Artwork.objects.all()
+    for term in terms:
+        artworks = artworks.filter(
+            Q(title__icontains=term) | Q(medium__icontains=term)
+            | Q(description__icontains=term) | Q(artist__name__icontains=term)
+        )
+    return list(artworks.order_by('-date', '-id').values_list('id', flat=True)[offset:offset + limit])
+
+
+def index_artworks(artworks):
+    """Adds or refreshes the index rows of `artworks`"""
+    connection = write_connection()
+    if not fts_available(connection):
+        return
+    rows = [
+        (artwork.id, artwork.title, artwork.medium, artwork.description, artwork.artist.name)
+        for artwork in artworks
+    ]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(SEARCH_COLUMNS)}) VALUES (%s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def unindex_artworks(artwork_ids):
+    connection = write_connection()
+    if not fts_available(connection) or not artwork_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(artwork_id,) for artwork_id in artwork_ids])
+
+
+def rebuild_index():
+    """Rebuilds the whole index from the artwork and artist tables.
+    Returns the number of artworks indexed, or None without FTS5."""
+    connection = write_connection()
+    if not fts_available(connection):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(SEARCH_COLUMNS)}) '
+            'SELECT artwork.id, artwork.title, artwork.medium, artwork.description, artist.name '
+            'FROM artpartyapi_artwork artwork JOIN artpartyapi_artist artist ON artist.id = artwork.artist_id'
+        )
+        cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
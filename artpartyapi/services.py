@@ -0,0 +1,83 @@
+"""Write paths shared by several views"""
+from django.db import transaction
+from rest_framework import serializers
+from artpartyapi import changelog, counters, tasks
+from artpartyapi.cache import bump_generation
+from artpartyapi.feed import refresh_featured_where
+from artpartyapi.models import ArtworkTag, Tag
+
+
+TAG_IDS = serializers.ListField(child=serializers.IntegerField())
+
+
+def read_tag_ids(tag_ids):
+    """`tag_ids` as sent by a client, as numbers.
+    Raises ValidationError, a 400, for anything that isn't a list of them"""
+    try:
+        return TAG_IDS.run_validation(tag_ids)
+    except serializers.ValidationError as ex:
+        raise serializers.ValidationError({'tags': ex.detail}) from None
+
+
+def check_tags_exist(tag_ids):
+    """Raises Tag.DoesNotExist unless every id in `tag_ids` is a tag"""
+    tag_ids = set(tag_ids)
+    if tag_ids and Tag.objects.filter(id__in=tag_ids).count() != len(tag_ids):
+        raise Tag.DoesNotExist('Tag matching query does not exist.')
+
+
+def set_artwork_tags(artwork, tag_ids):
+    """Makes `tag_ids` the artwork's exact set of tags, with one insert for
+    the new links and one delete for the dropped ones.
+    Returns: (ids of tags added, ids of tags removed)"""
+    tag_ids = set(read_tag_ids(tag_ids))
+    with transaction.atomic():
+        current = set(ArtworkTag.objects.filter(artwork=artwork).values_list('tag_id', flat=True))
+        to_add = tag_ids - current
+        to_remove = current - tag_ids
+        _add_links(artwork, to_add)
+        if to_remove:
+            ArtworkTag.objects.filter(artwork=artwork, tag_id__in=to_remove).delete()
+    return to_add, to_remove
+
+
+def add_artwork_tags(artwork, tag_ids):
+    """Links the artwork to each of `tag_ids` it isn't linked to yet.
+    Returns: the artwork's links to `tag_ids`, keyed by tag id"""
+    tag_ids = list(dict.fromkeys(read_tag_ids(tag_ids)))
+    with transaction.atomic():
+        links = {link.tag_id: link for link in ArtworkTag.objects.filter(artwork=artwork, tag_id__in=tag_ids)}
+        created = _add_links(artwork, [tag_id for tag_id in tag_ids if tag_id not in links])
+        links.update((link.tag_id, link) for link in created)
+    return links
+
+
+def remove_artwork_tags(artwork, tag_ids=(), link_ids=()):
+    """Unlinks the artwork from tags, given by tag id or by ArtworkTag id.
+    Returns: number of links removed"""
+    if tag_ids and link_ids:
+        raise ValueError('Pass tag_ids or link_ids, not both')
+    links = ArtworkTag.objects.filter(artwork=artwork)
+    if tag_ids:
+        links = links.filter(tag_id__in=tag_ids)
+    elif link_ids:
+        links = links.filter(id__in=link_ids)
+    else:
+        return 0
+    with transaction.atomic():
+        removed, _ = links.delete()
+    return removed
+
+
+def _add_links(artwork, tag_ids):
+    if not tag_ids:
+        return []
+    check_tags_exist(tag_ids)
+    links = ArtworkTag.objects.bulk_create([ArtworkTag(artwork=artwork, tag_id=tag_id) for tag_id in tag_ids])
+    # bulk_create sends no signals
+    bump_generation(ArtworkTag)
+    changelog.record(links)
+    if not tasks.defer_refresh([artwork.id]):
+        refresh_featured_where(id=artwork.id)
+    tasks.move_counters([], counters.link_deltas(((artwork.id, link.tag_id, 1) for link in links), {artwork.id: artwork}))
+    return links
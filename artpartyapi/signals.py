@@ -0,0 +1,219 @@
+"""Model signal receivers"""
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+from artpartyapi import changelog, counters, events, images, tasks
+from artpartyapi.authentication import uid_cache
+from artpartyapi.cache import bump_generation
+from artpartyapi.feed import rebuild_feed, refresh_featured, refresh_featured_where
+from artpartyapi.models import Artist, Artwork, ArtworkTag, FeaturedArtwork, Tag, User
+from artpartyapi.search import forget_fts_tables, index_artworks, unindex_artworks
+
+
+@receiver(post_save, sender=Artwork)
+@receiver(post_delete, sender=Artwork)
+@receiver(post_save, sender=ArtworkTag)
+@receiver(post_delete, sender=ArtworkTag)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=FeaturedArtwork)
+def invalidate_cached_responses(sender, **kwargs):
+    """Moves cached responses built from `sender` to a new generation"""
+    bump_generation(sender)
+
+
+@receiver(post_save, sender=Artwork)
+def index_saved_artwork(sender, instance, raw, **kwargs):
+    # Fixture loads are indexed afterwards with rebuild_search_index
+    if not raw and not tasks.defer_refresh([instance.id]):
+        index_artworks([instance])
+
+
+@receiver(post_delete, sender=Artwork)
+def unindex_deleted_artwork(sender, instance, **kwargs):
+    if not tasks.defer_refresh([instance.id]):
+        unindex_artworks([instance.id])
+
+
+@receiver(post_save, sender=Artist)
+def reindex_artist_artworks(sender, instance, created, raw, **kwargs):
+    """The artist's name is indexed with each of their artworks"""
+    if not created and not raw:
+        index_artworks(instance.artwork_set.select_related('artist'))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_uid(sender, instance, **kwargs):
+    uid_cache.discard(instance.uid)
+
+
+# Fixture loads skip the feed too; rebuild it afterwards with rebuild_featured_feed
+
+@receiver(post_save, sender=Artwork)
+def refresh_saved_artwork(sender, instance, raw, **kwargs):
+    if raw or tasks.defer_refresh([instance.id]):
+        return
+    if instance.featured:
+        refresh_featured([instance.id])
+    else:
+        FeaturedArtwork.objects.filter(artwork_id=instance.id).delete()
+
+
+@receiver(post_delete, sender=Artwork)
+def drop_deleted_artwork(sender, instance, **kwargs):
+    """Cascading deletes of the artwork's tags refresh its entry before
+    the artwork itself goes, so remove that entry last"""
+    if not tasks.defer_refresh([instance.id]):
+        FeaturedArtwork.objects.filter(artwork_id=instance.id).delete()
+
+
+@receiver(post_save, sender=ArtworkTag)
+@receiver(post_delete, sender=ArtworkTag)
+def refresh_tagged_artwork(sender, instance, raw=False, **kwargs):
+    if not raw and not tasks.defer_refresh([instance.artwork_id]):
+        refresh_featured_where(id=instance.artwork_id)
+
+
+@receiver(post_save, sender=Tag)
+def refresh_relabelled_tag(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        refresh_featured_where(tags__tag=instance)
+
+
+@receiver(post_save, sender=Artist)
+def refresh_artist_artworks(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        refresh_featured_where(artist=instance)
+
+
+@receiver(post_save, sender=User)
+def refresh_user_artworks(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        refresh_featured_where(user=instance)
+
+
+@receiver(post_migrate)
+def recheck_search_index(sender, app_config, **kwargs):
+    """Migrations may have added or dropped the full-text index table"""
+    if app_config.name == 'artpartyapi':
+        forget_fts_tables()
+
+
+@receiver(post_migrate)
+def seed_featured_feed(sender, app_config, using, **kwargs):
+    """Fills the feed when it is missing entries, e.g. right after the
+    migration that adds it to a database with featured artworks"""
+    if app_config.name != 'artpartyapi':
+        return
+    featured = Artwork.objects.using(using).filter(featured=True)
+    if featured.exists() and not FeaturedArtwork.objects.using(using).exists():
+        rebuild_feed()
+
+
+# Fixture loads skip the counters as well; fix them up with reconcile_counters
+
+@receiver(post_init, sender=Artwork)
+def remember_counted_state(sender, instance, **kwargs):
+    """Lets a later save tell which counters it moves"""
+    instance._counted_state = counters.counted_state(instance)
+
+
+@receiver(post_save, sender=Artwork)
+def count_saved_artwork(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        tasks.move_counters(*counters.creation_deltas([instance]))
+        instance._counted_state = counters.counted_state(instance)
+    else:
+        tasks.move_counters(*counters.change_deltas([instance]))
+
+
+@receiver(post_delete, sender=Artwork)
+def uncount_deleted_artwork(sender, instance, **kwargs):
+    tasks.move_counters(*counters.deletion_deltas(instance))
+
+
+@receiver(post_save, sender=ArtworkTag)
+def count_added_tag(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        # Skip the owner lookup when the link came with its artwork loaded
+        artwork = instance.artwork if ArtworkTag.artwork.is_cached(instance) else None
+        tasks.move_counters([], counters.link_deltas(
+            [(instance.artwork_id, instance.tag_id, 1)], {artwork.id: artwork} if artwork else None,
+        ))
+
+
+@receiver(post_delete, sender=ArtworkTag)
+def uncount_removed_tag(sender, instance, **kwargs):
+    tasks.move_counters([], counters.link_deltas([(instance.artwork_id, instance.tag_id, -1)]))
+
+
+# Change log for /sync. Fixture loads are logged too, so synced clients see them
+
+@receiver(post_init, sender=Artwork)
+@receiver(post_init, sender=Artist)
+def remember_synced_owner(sender, instance, **kwargs):
+    """Lets a later save tell the previous owner that the row moved away"""
+    instance._synced_user_id = changelog.owner(instance)
+
+
+@receiver(post_save, sender=Artwork)
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=ArtworkTag)
+def log_saved_change(sender, instance, **kwargs):
+    changelog.record([instance])
+
+
+@receiver(post_delete, sender=Artwork)
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=ArtworkTag)
+def log_deleted_change(sender, instance, **kwargs):
+    changelog.record([instance], deleted=True)
+
+
+# Live events for /events, published once the write commits
+
+@receiver(post_init, sender=Artwork)
+def remember_published_featured(sender, instance, **kwargs):
+    """Lets a later save tell whether it featured or unfeatured the artwork"""
+    instance._published_featured = instance.__dict__.get('featured')
+
+
+@receiver(post_save, sender=Artwork)
+def publish_saved_artwork(sender, instance, created, raw, **kwargs):
+    if not raw:
+        events.artworks_saved([instance], created)
+
+
+@receiver(post_delete, sender=Artwork)
+def publish_deleted_artwork(sender, instance, **kwargs):
+    events.artwork_deleted(instance.id, instance.featured)
+
+
+# Image metadata and thumbnails, fetched by an images.ingest job
+
+@receiver(post_init, sender=Artwork)
+def remember_attached_img(sender, instance, **kwargs):
+    """Lets a later save tell whether img moved away from the attached image"""
+    instance._attached_img = instance.__dict__.get('img') if instance.__dict__.get('image_id') else None
+
+
+@receiver(pre_save, sender=Artwork)
+def attach_artwork_image(sender, instance, raw, **kwargs):
+    # An img that wasn't loaded hasn't changed
+    img = instance.__dict__.get('img')
+    if not raw and img is not None and img != instance._attached_img:
+        instance._ingest_images = images.attach([instance])
+
+
+@receiver(post_save, sender=Artwork)
+def ingest_artwork_image(sender, instance, raw, **kwargs):
+    if not raw:
+        images.queue(instance.__dict__.pop('_ingest_images', ()))
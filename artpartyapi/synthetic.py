@@ -0,0 +1,86 @@
+"""Synthetic data for load testing and benchmarks"""
+import datetime
+import random
+from django.db import transaction
+from artpartyapi.cache import bump_generation
+from artpartyapi.counters import reconcile
+from artpartyapi.feed import rebuild_feed
+from artpartyapi.models import Artist, Artwork, ArtworkTag, Tag, User
+from artpartyapi.search import rebuild_index
+
+MEDIUMS = ('Crayon', 'Watercolor', 'Marker', 'Pencil', 'Tempera', 'Clay', 'Collage', 'Chalk', 'Oil pastel')
+
+WORDS = (
+    'sunset', 'dragon', 'house', 'family', 'rainbow', 'cat', 'dog', 'tree', 'rocket', 'ocean',
+    'castle', 'flower', 'robot', 'monster', 'garden', 'train', 'unicorn', 'mountain', 'snow', 'bird',
+)
+
+
+def generate(users, artists, artworks, artwork_tags, tags=200, seed=0, batch_size=5000, log=None):
+    """Adds the given number of rows of each model, reproducibly for a given seed.
+
+    Rows are built and inserted a batch at a time, so memory use doesn't grow
+    with the dataset. Artwork tags are spread evenly over the new artworks,
+    at most one link per (artwork, tag) pair. User uids include the seed, so
+    use a new seed for each run against the same database."""
+    if artworks and not artists:
+        raise ValueError('Artworks need at least one artist')
+    if artists and not users:
+        raise ValueError('Artists need at least one user')
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+
+    def insert(model, rows):
+        created = []
+        for start in range(0, len(rows), batch_size):
+            created.extend(model.objects.bulk_create(rows[start:start + batch_size]))
+        return created
+
+    with transaction.atomic():
+        insert(Tag, [Tag(label=f'{rng.choice(WORDS)}-{i}') for i in range(tags)])
+        # New artworks are tagged from every tag, including ones from earlier runs
+        tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        user_ids = [user.id for user in insert(User, [
+            User(name=f'User {i}', uid=f'synthetic-{seed}-{i}') for i in range(users)
+        ])]
+        artist_rows = insert(Artist, [
+            Artist(name=f'{rng.choice(WORDS).title()} {i}', img=f'https://example.com/artists/{i}.png', user_id=rng.choice(user_ids))
+            for i in range(artists)
+        ])
+        log(f'{len(tag_ids)} tags, {len(user_ids)} users, {len(artist_rows)} artists')
+
+        links_per_artwork, extra_links = divmod(artwork_tags, artworks) if artworks else (0, 0)
+        start_date = datetime.date(2015, 1, 1)
+        links_made = 0
+        for batch_start in range(0, artworks, batch_size):
+            batch = []
+            for i in range(batch_start, min(batch_start + batch_size, artworks)):
+                artist = rng.choice(artist_rows)
+                batch.append(Artwork(
+                    title=f'{rng.choice(WORDS).title()} {rng.choice(WORDS)}',
+                    img=f'https://example.com/artworks/{i}.png',
+                    medium=rng.choice(MEDIUMS),
+                    description=' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 30))),
+                    date=start_date + datetime.timedelta(days=rng.randint(0, 3650)),
+                    age=rng.randint(2, 12),
+                    featured=rng.random() < 0.02,
+                    user_id=artist.user_id,
+                    artist_id=artist.id,
+                ))
+            Artwork.objects.bulk_create(batch)
+
+            links = []
+            for offset, artwork in enumerate(batch):
+                count = links_per_artwork + (1 if batch_start + offset < extra_links else 0)
+                for tag_id in rng.sample(tag_ids, min(count, len(tag_ids))):
+                    links.append(ArtworkTag(artwork_id=artwork.id, tag_id=tag_id))
+            ArtworkTag.objects.bulk_create(links, batch_size=batch_size)
+            links_made += len(links)
+            log(f'{batch_start + len(batch)}/{artworks} artworks, {links_made} artwork tags')
+
+        # bulk_create skips the signal receivers, so catch up on their work.
+        # The change log is left out: synced clients get this data with a full sync
+        rebuild_index()
+        rebuild_feed()
+        reconcile()
+        bump_generation(Tag, User, Artist, Artwork, ArtworkTag)
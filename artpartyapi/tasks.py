@@ -0,0 +1,93 @@
+"""Post-write work that artwork writes leave to background jobs.
+
+Inside deferred(), the signal receivers in signals.py don't update the
+search index, the featured feed or the counters themselves. They note
+which artworks need refreshing and which counts move, and when the block
+ends that is queued as jobs (see jobs.py) in the same transaction:
+one `artworks.refresh` per artwork, keyed so repeated saves collapse into
+one, and one `counters.move` with the write's counter deltas.
+
+The rest stays in the request. The cache generation bump makes the
+writer's next read fresh, the change log has to be in the write's
+transaction, and events are only published after it commits anyway. The
+jobs bump the generations again once the data they derive has changed."""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from artpartyapi import counters, jobs
+from artpartyapi.cache import bump_generation
+from artpartyapi.feed import refresh_featured
+from artpartyapi.models import Artist, Artwork, FeaturedArtwork, Tag, User
+from artpartyapi.search import index_artworks, unindex_artworks
+
+_deferred = ContextVar('artparty_deferred_work', default=None)
+
+
+class DeferredWork:
+    """What a deferred() block leaves for the jobs"""
+
+    def __init__(self):
+        self.artwork_ids = set()
+        self.owners = []
+        self.links = []
+
+    def enqueue(self):
+        for artwork_id in sorted(self.artwork_ids):
+            jobs.enqueue('artworks.refresh', {'ids': [artwork_id]}, key=f'artworks.refresh:{artwork_id}')
+        if self.owners or self.links:
+            jobs.enqueue('counters.move', {'owners': self.owners, 'links': self.links})
+
+
+@contextmanager
+def deferred():
+    """Queues the search index, feed and counter updates of the artwork
+    writes inside the block as jobs. Use it inside the write's transaction."""
+    if _deferred.get() is not None:
+        yield
+        return
+    work = DeferredWork()
+    token = _deferred.set(work)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+    work.enqueue()
+
+
+def defer_refresh(artwork_ids):
+    """Leaves refreshing the index and feed entries of `artwork_ids` to a
+    job when inside deferred().
+    Returns: whether it did"""
+    work = _deferred.get()
+    if work is None:
+        return False
+    work.artwork_ids.update(artwork_ids)
+    return True
+
+
+def move_counters(owners, links=()):
+    """Applies counter deltas (see counters.apply_deltas), or leaves them
+    to a job when inside deferred()"""
+    work = _deferred.get()
+    if work is None:
+        counters.apply_deltas(owners, links)
+    else:
+        work.owners.extend(owners)
+        work.links.extend(links)
+
+
+@jobs.register('artworks.refresh')
+def refresh(ids):
+    """Brings the search index and feed entries of the artworks `ids` up
+    to date, whether they were saved or deleted"""
+    artworks = list(Artwork.objects.select_related('artist').filter(id__in=ids))
+    index_artworks(artworks)
+    unindex_artworks(sorted(set(ids) - {artwork.id for artwork in artworks}))
+    refresh_featured(ids)
+    # Search results and the homepage were read from what just changed
+    bump_generation(Artwork, FeaturedArtwork)
+
+
+@jobs.register('counters.move')
+def move(owners, links):
+    counters.apply_deltas(owners, links)
+    bump_generation(Artist, User, Tag)
@@ -1,3 +1,1526 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from artparty.database import database_config, replica_configs
+from artparty.metrics import registry
+from artparty import sse
+from artpartyapi import cache as cache_module, jobs
+from artparty.routers import STICKY_COOKIE, STICKY_HEADER, ReplicaMiddleware, ReplicaRouter
+from artpartyapi.authentication import uid_cache
+from artpartyapi.changelog import compact
+from artpartyapi.checks import check_response_cache, check_throttle_cache
+from artpartyapi.coalesce import SingleFlight
+from artpartyapi.events import Event, Subscription, hub
+from artpartyapi.counters import reconcile
+from artpartyapi.export import artwork_rows
+from artpartyapi.feed import rebuild_feed
+from artpartyapi.images import FetchError, HTTPFetcher, PILImage, header_dimensions, ingest
+from artpartyapi.fastserializers import artwork_data, artwork_values, artworktag_data, artworktag_values, tag_data
+from artpartyapi.renderers import FastJSONRenderer
+from artpartyapi.thumbnails import ThumbnailStore, get_store
+from artpartyapi.views.artwork import ArtworkSerializer
+from artpartyapi.views.artworktag import ArtworkTagSerializer
+from artpartyapi.views.tag import TagSerializer
+from artpartyapi.synthetic import generate
+from artpartyapi.models import Artist, Artwork, ArtworkTag, Change, FeaturedArtwork, Image, Job, Tag, User
 
-# Create your tests here.
+
+def make_artworks(count, user=None, artist=None, tags=(), **fields):
+    """Create `count` artworks, each linked to every tag in `tags`"""
+    user = user or User.objects.create(name='Test User', uid=f'uid-{User.objects.count()}')
+    artist = artist or Artist.objects.create(name='Test Artist', img='http://example.com/a.png', user=user)
+    artworks = []
+    for i in range(count):
+        artwork = Artwork.objects.create(
+            title=f'Artwork {i}',
+            img='http://example.com/art.png',
+            medium='Crayon',
+            description='A drawing',
+            date=fields.get('date', datetime.date(2024, 1, 1) + datetime.timedelta(days=i)),
+            age=6,
+            featured=fields.get('featured', False),
+            user=user,
+            artist=artist,
+        )
+        for tag in tags:
+            ArtworkTag.objects.create(artwork=artwork, tag=tag)
+        artworks.append(artwork)
+    return artworks
+
+
+def verify_test_token(token):
+    """Stands in for verify_firebase_token: 'valid:<uid>' is a token for <uid>"""
+    if token.startswith('valid:'):
+        return {'sub': token.removeprefix('valid:'), 'exp': time.time() + 3600}
+    return None
+
+
+# Post-write jobs run inline, so each test sees its writes' full effect.
+# Images aren't fetched except by the tests for that, from a local server.
+# The tests run in one process, so its cache can serve responses, and
+# their ID tokens are checked by verify_test_token. Tokenless writes name
+# their user in the body, as in local development.
+@override_settings(
+    ARTPARTY_JOBS_EAGER=True, ARTPARTY_IMAGE_FETCHER=None, ARTPARTY_CACHE_RESPONSES=True,
+    ARTPARTY_ID_TOKEN_VERIFIER='artpartyapi.tests.verify_test_token', ARTPARTY_BODY_USER=True,
+)
+class ArtpartyTestCase(TestCase):
+
+    def setUp(self):
+        # Cached responses would otherwise outlive each test's rolled back data
+        cache.clear()
+        self.client = APIClient()
+
+
+class ArtworkListQueryTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tags = [Tag.objects.create(label='watercolor'), Tag.objects.create(label='portrait')]
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_list_query_count_is_constant(self):
+        make_artworks(2, tags=self.tags)
+        small = self.count_queries('/artworks')
+        make_artworks(20, tags=self.tags)
+        self.assertEqual(self.count_queries('/artworks'), small)
+
+    def test_list_serializes_nested_relations(self):
+        artwork = make_artworks(1, tags=self.tags)[0]
+        data = self.client.get('/artworks').json()
+        self.assertEqual(data[0]['user']['id'], artwork.user_id)
+        self.assertEqual(data[0]['artist']['id'], artwork.artist_id)
+        self.assertEqual([t['tag']['label'] for t in data[0]['tags']], ['watercolor', 'portrait'])
+
+
+class KeysetPaginationTests(ArtpartyTestCase):
+
+    def walk(self, url):
+        """Follow `next` links and return every id seen, plus the last page"""
+        ids = []
+        while url:
+            page = self.client.get(url).json()
+            ids.extend(row['id'] for row in page['results'])
+            last, url = page, page['next']
+        return ids, last
+
+    def test_artworks_walk_newest_first_without_gaps(self):
+        # Several artworks share a date so the id tie-breaker matters
+        artworks = make_artworks(4, date=datetime.date(2024, 5, 1)) + make_artworks(3)
+        expected = [a.id for a in sorted(artworks, key=lambda a: (a.date, a.id), reverse=True)]
+        ids, _ = self.walk('/artworks?page_size=2')
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_returns_prior_page(self):
+        make_artworks(5)
+        first = self.client.get('/artworks?page_size=2').json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_filters_apply_across_pages(self):
+        make_artworks(3, featured=True)
+        make_artworks(3, featured=False)
+        ids, _ = self.walk('/artworks?featured=true&page_size=2')
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(Artwork.objects.filter(id__in=ids, featured=True).count(), 3)
+
+    def test_unpaginated_by_default(self):
+        make_artworks(2)
+        self.assertIsInstance(self.client.get('/users').json(), list)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/users?cursor=nonsense').status_code, 404)
+
+    def test_malformed_cursors(self):
+        make_artworks(3)
+        for url, cursor in (
+            ('/users', {'p': [1]}),
+            ('/users', {'p': [1], 'r': 2}),
+            ('/users', [1]),
+            ('/artworks', {'p': ['notadate', 1], 'r': 0}),
+            ('/artworks', {'p': [[1], {}], 'r': 0}),
+            ('/artworks', {'p': ['2024-01-01', 'x'], 'r': 0}),
+        ):
+            token = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode().rstrip('=')
+            self.assertEqual(self.client.get(f'{url}?page_size=2&cursor={token}').status_code, 404, cursor)
+
+
+class ResponseCacheTests(ArtpartyTestCase):
+
+    def test_hit_skips_the_database(self):
+        make_artworks(2, featured=True)
+        first = self.client.get('/artworks?featured=true').json()
+        with self.assertNumQueries(0):
+            second = self.client.get('/artworks?featured=true').json()
+        self.assertEqual(first, second)
+
+    def test_write_is_visible_to_the_next_read(self):
+        tag = Tag.objects.create(label='pastel')
+        self.client.get('/tags')
+        self.client.get(f'/tags/{tag.id}')
+        self.client.post('/tags', {'label': 'charcoal'}, format='json')
+        self.assertEqual([t['label'] for t in self.client.get('/tags').json()], ['pastel', 'charcoal'])
+
+    def test_related_write_invalidates_artwork(self):
+        artwork = make_artworks(1)[0]
+        self.client.get(f'/artworks/{artwork.id}')
+        ArtworkTag.objects.create(artwork=artwork, tag=Tag.objects.create(label='ink'))
+        data = self.client.get(f'/artworks/{artwork.id}').json()
+        self.assertEqual([t['tag']['label'] for t in data['tags']], ['ink'])
+
+
+    @override_settings(ARTPARTY_CACHE_RESPONSES=False)
+    def test_off_unless_enabled(self):
+        make_artworks(1, featured=True)
+        self.client.get('/artworks?featured=true')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/artworks?featured=true')
+        self.assertGreater(len(ctx.captured_queries), 0)
+
+    @override_settings(ARTPARTY_CACHE_RESPONSES=False, ARTPARTY_COALESCE={})
+    def test_no_generation_lookups_when_off(self):
+        make_artworks(1)
+        with mock.patch('artpartyapi.cache.get_generations', wraps=cache_module.get_generations) as get_generations, \
+                mock.patch('artpartyapi.cache.aget_generations', wraps=cache_module.aget_generations) as aget_generations:
+            self.assertEqual(self.client.get('/artworks').status_code, 200)
+            self.assertEqual(AsyncViewTests.async_request(self, 'get', '/artworks').status_code, 200)
+        # Only the ETags still read the Tag and User generations
+        self.assertEqual([call.args for call in get_generations.call_args_list], [((Tag, User),)])
+        self.assertEqual([call.args for call in aget_generations.call_args_list], [((Tag, User),)])
+
+    def test_per_process_cache_is_refused(self):
+        with override_settings(ARTPARTY_CACHE_RESPONSES=True):
+            self.assertEqual([error.id for error in check_response_cache(None)], ['artpartyapi.E001'])
+        with override_settings(
+            ARTPARTY_CACHE_RESPONSES=True,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}},
+        ):
+            self.assertEqual(check_response_cache(None), [])
+        with override_settings(ARTPARTY_CACHE_RESPONSES=False):
+            self.assertEqual(check_response_cache(None), [])
+
+
+class ConditionalGetTests(ArtpartyTestCase):
+
+    def test_matching_etag_returns_304(self):
+        artwork = make_artworks(2)[0]
+        url = f'/artworks?user={artwork.user_id}'
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        # A cached response, then a fresh path through the view
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(f'{url}&uncached=1', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_etag_changes_after_write(self):
+        artwork = make_artworks(2)[0]
+        url = f'/artworks?artist={artwork.artist_id}'
+        etag = self.client.get(url)['ETag']
+        ArtworkTag.objects.create(artwork=artwork, tag=Tag.objects.create(label='ink'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        artwork = make_artworks(1)[0]
+        url = f'/artworks?user={artwork.user_id}'
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(f'{url}&uncached=1', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+
+class TagSearchTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.watercolor = Tag.objects.create(label='watercolor')
+        self.portrait = Tag.objects.create(label='portrait')
+        self.both = make_artworks(1, tags=[self.watercolor, self.portrait])[0]
+        self.one = make_artworks(1, tags=[self.watercolor])[0]
+        make_artworks(1)
+
+    def search(self, query):
+        return sorted(row['id'] for row in self.client.get(f'/artworks?{query}').json())
+
+    def test_match_all(self):
+        self.assertEqual(self.search(f'tags={self.watercolor.id},{self.portrait.id}&match=all'), [self.both.id])
+
+    def test_match_any(self):
+        self.assertEqual(self.search(f'tags={self.watercolor.id},{self.portrait.id}&match=any'),
+                         sorted([self.both.id, self.one.id]))
+
+    def test_search_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            ids = list(Artwork.objects.tagged([self.watercolor.id, self.portrait.id], match_all=True).values_list('id', flat=True))
+        self.assertEqual(ids, [self.both.id])
+
+    def test_invalid_tags(self):
+        self.assertEqual(self.client.get('/artworks?tags=watercolor').status_code, 400)
+
+
+class SearchTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sunset = make_artworks(1)[0]
+        self.sunset.title = 'Sunset over the lake'
+        self.sunset.medium = 'Watercolor'
+        self.sunset.save()
+        self.lake = make_artworks(1)[0]
+        self.lake.description = 'The lake again'
+        self.lake.save()
+
+    def search(self, query):
+        return [row['id'] for row in self.client.get(f'/artworks/search?{query}').json()['results']]
+
+    @skipUnless(connection.vendor == 'sqlite', 'BM25 ranking needs the SQLite FTS5 index')
+    def test_ranks_title_matches_and_prefixes(self):
+        self.assertEqual(self.search('q=lake'), [self.sunset.id, self.lake.id])
+        self.assertEqual(self.search('q=water'), [self.sunset.id])
+
+    def test_artist_name_and_deletes_stay_in_sync(self):
+        self.lake.artist.name = 'Milo'
+        self.lake.artist.save()
+        self.assertEqual(self.search('q=milo'), [self.lake.id])
+        self.lake.delete()
+        self.assertEqual(self.search('q=milo'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'BM25 ranking needs the SQLite FTS5 index')
+    def test_pages(self):
+        page = self.client.get('/artworks/search?q=lake&page_size=1').json()
+        self.assertEqual([row['id'] for row in page['results']], [self.sunset.id])
+        self.assertEqual([row['id'] for row in self.client.get(page['next']).json()['results']], [self.lake.id])
+
+    def test_query_syntax_is_not_passed_through(self):
+        self.assertEqual(self.client.get('/artworks/search?q=%22lake%20OR').status_code, 200)
+
+    def test_reads_follow_the_router(self):
+        with mock.patch.object(ReplicaRouter, 'db_for_read', autospec=True, return_value='default') as routed:
+            self.assertEqual(set(self.search('q=lake')), {self.sunset.id, self.lake.id})
+        self.assertIn(Artwork, [call.args[1] for call in routed.call_args_list])
+
+
+class BulkWriteTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(name='Importer', uid='importer')
+        self.artist = Artist.objects.create(name='Jo', img='http://example.com/jo.png', user=self.user)
+        self.tag = Tag.objects.create(label='crayon')
+
+    def item(self, **fields):
+        return {
+            'title': 'Cat', 'img': 'http://example.com/cat.png', 'medium': 'Crayon',
+            'description': 'A cat', 'date': '2024-02-01', 'age': 5,
+            'user': self.user.id, 'artist': self.artist.id, 'tags': [self.tag.id], **fields,
+        }
+
+    def test_bulk_create_uses_a_fixed_number_of_queries(self):
+        response = self.client.post('/artworks/bulk', [self.item() for _ in range(3)], format='json')
+        self.assertEqual(response.status_code, 201)
+        small = len(response.json()['ids'])
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post('/artworks/bulk', [self.item() for _ in range(3)], format='json')
+        with CaptureQueriesContext(connection) as ctx_large:
+            self.client.post('/artworks/bulk', [self.item() for _ in range(30)], format='json')
+        self.assertEqual(small, 3)
+        self.assertEqual(len(ctx.captured_queries), len(ctx_large.captured_queries))
+        self.assertEqual(ArtworkTag.objects.filter(tag=self.tag).count(), 36)
+
+    def test_bulk_create_reports_every_bad_item_and_writes_nothing(self):
+        response = self.client.post('/artworks/bulk', [
+            self.item(), self.item(artist=9999), self.item(tags=[9999]), self.item(age='old'),
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual([error['index'] for error in errors], [1, 2, 3])
+        self.assertIn('artist', errors[0])
+        self.assertIn('tags', errors[1])
+        self.assertIn('age', errors[2])
+        self.assertFalse(Artwork.objects.exists())
+
+    def test_bulk_update_and_delete(self):
+        ids = self.client.post('/artworks/bulk', [self.item(), self.item()], format='json').json()['ids']
+        response = self.client.put('/artworks/bulk', [{'id': pk, 'featured': True} for pk in ids], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Artwork.objects.filter(featured=True).count(), 2)
+        self.assertEqual(self.client.delete('/artworks/bulk', ids, format='json').status_code, 204)
+        self.assertFalse(Artwork.objects.exists())
+
+    def test_bulk_artworktags_skip_existing_links(self):
+        artwork = make_artworks(1, tags=[self.tag])[0]
+        other = Tag.objects.create(label='paint')
+        response = self.client.post('/artworktags/bulk', [
+            {'artwork': artwork.id, 'tag': self.tag.id},
+            {'artwork': artwork.id, 'tag': other.id},
+            {'artwork': artwork.id, 'tag': other.id},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['ids']), 1)
+        self.assertEqual(artwork.tags.count(), 2)
+
+    def test_create_with_missing_tag_leaves_nothing_behind(self):
+        response = self.client.post('/artworks', self.item(tags=[self.tag.id, 9999]), format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Artwork.objects.exists())
+
+
+class TagSyncTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tags = [Tag.objects.create(label=label) for label in ('ink', 'paint', 'clay')]
+        self.artwork = make_artworks(1, tags=self.tags[:2])[0]
+
+    def test_update_keeps_unchanged_links(self):
+        kept = ArtworkTag.objects.get(artwork=self.artwork, tag=self.tags[0])
+        response = self.client.put(f'/artworks/{self.artwork.id}', {'tags': [self.tags[0].id, self.tags[2].id]}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(set(self.artwork.tags.values_list('tag_id', flat=True)), {self.tags[0].id, self.tags[2].id})
+        self.assertTrue(ArtworkTag.objects.filter(id=kept.id).exists())
+
+    def test_update_without_tags_leaves_them_alone(self):
+        self.client.put(f'/artworks/{self.artwork.id}', {'title': 'Renamed'}, format='json')
+        self.assertEqual(self.artwork.tags.count(), 2)
+
+    def test_update_with_missing_tag_changes_nothing(self):
+        response = self.client.put(f'/artworks/{self.artwork.id}', {'title': 'Renamed', 'tags': [9999]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.artwork.refresh_from_db()
+        self.assertEqual(self.artwork.title, 'Artwork 0')
+        self.assertEqual(self.artwork.tags.count(), 2)
+
+    def test_malformed_tag_ids_are_bad_requests(self):
+        for tags in (['abc'], [None], 'abc', None):
+            response = self.client.put(f'/artworks/{self.artwork.id}', {'title': 'Renamed', 'tags': tags}, format='json')
+            self.assertEqual(response.status_code, 400, tags)
+            self.assertIn('tags', response.json())
+        self.artwork.refresh_from_db()
+        self.assertEqual(self.artwork.title, 'Artwork 0')
+        response = self.client.post('/artworks', {
+            'title': 'Cat', 'img': 'http://example.com/cat.png', 'medium': 'Crayon', 'description': '',
+            'date': '2024-02-01', 'age': 5, 'user': self.artwork.user_id, 'artist': self.artwork.artist_id, 'tags': ['abc'],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Artwork.objects.count(), 1)
+        response = self.client.post(f'/artworks/{self.artwork.id}/add_artwork_tag', {'tag': 'abc'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_add_and_remove_actions(self):
+        self.client.post(f'/artworks/{self.artwork.id}/add_artwork_tag', {'tag': self.tags[2].id}, format='json')
+        self.client.post(f'/artworks/{self.artwork.id}/add_artwork_tag', {'tag': self.tags[2].id}, format='json')
+        link = ArtworkTag.objects.get(artwork=self.artwork, tag=self.tags[2])
+        response = self.client.delete(f'/artworks/{self.artwork.id}/remove_artwork_tag', {'artwork_tag': link.id}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.artwork.tags.count(), 2)
+
+
+class MetricsTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    def test_reports_per_route_percentiles_to_staff(self):
+        make_artworks(2)
+        self.client.get('/artworks')
+        self.client.get('/artworks')
+        self.assertEqual(self.client.get('/_metrics').status_code, 403)
+
+        staff = get_user_model().objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        body = self.client.get('/_metrics').content.decode()
+        self.assertIn('artparty_request_seconds_count{route="artwork-list"} 2', body)
+        self.assertIn('artparty_db_queries{route="artwork-list",quantile="0.99"}', body)
+
+    def test_slow_requests_log_heaviest_sql(self):
+        with self.settings(ARTPARTY_SLOW_REQUEST_SECONDS=0):
+            with self.assertLogs('artparty.metrics', 'WARNING') as logs:
+                self.client.get('/tags')
+        self.assertIn('SELECT', logs.output[0])
+
+
+class SyntheticDataTests(ArtpartyTestCase):
+
+    def test_generates_requested_counts_reproducibly(self):
+        generate(users=2, artists=3, artworks=10, artwork_tags=25, tags=5, seed=7, batch_size=4)
+        self.assertEqual((User.objects.count(), Artist.objects.count(), Artwork.objects.count()), (2, 3, 10))
+        self.assertEqual(ArtworkTag.objects.count(), 25)
+        first = list(Artwork.objects.order_by('id').values_list('title', 'description', 'date'))
+        for model in (Tag, User):
+            model.objects.all().delete()
+        generate(users=2, artists=3, artworks=10, artwork_tags=25, tags=5, seed=7, batch_size=4)
+        self.assertEqual(list(Artwork.objects.order_by('id').values_list('title', 'description', 'date')), first)
+
+
+class UidAuthenticationTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        uid_cache.clear()
+        self.user = User.objects.create(name='Stacey', uid='firebase-uid')
+
+    def test_register_twice_returns_the_same_user(self):
+        first = self.client.post('/register', {'name': 'Jo', 'uid': 'new-uid'}, format='json').json()
+        second = self.client.post('/register', {'name': 'Jo', 'uid': 'new-uid'}, format='json').json()
+        self.assertEqual(first['id'], second['id'])
+        self.assertEqual(User.objects.filter(uid='new-uid').count(), 1)
+
+    def test_checkuser_is_cached(self):
+        self.client.post('/checkuser', {'uid': 'firebase-uid'}, format='json')
+        with self.assertNumQueries(0):
+            data = self.client.post('/checkuser', {'uid': 'firebase-uid'}, format='json').json()
+        self.assertEqual(data['id'], self.user.id)
+        self.assertEqual(self.client.post('/checkuser', {'uid': 'nobody'}, format='json').json(), {'valid': False})
+
+    def test_rename_is_seen_by_checkuser(self):
+        self.client.post('/checkuser', {'uid': 'firebase-uid'}, format='json')
+        self.user.name = 'Stacey V'
+        self.user.save()
+        self.assertEqual(self.client.post('/checkuser', {'uid': 'firebase-uid'}, format='json').json()['name'], 'Stacey V')
+
+    def test_id_token_supplies_the_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer valid:firebase-uid')
+        response = self.client.post('/artists', {'name': 'Milo', 'img': 'http://example.com/m.png'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['user'], self.user.id)
+
+    def test_uids_are_not_credentials(self):
+        other = User.objects.create(name='Jo', uid='jo')
+        self.client.credentials(HTTP_AUTHORIZATION='firebase-uid')
+        response = self.client.post('/artists', {'name': 'Milo', 'img': 'http://example.com/m.png', 'user': other.id}, format='json')
+        self.assertEqual(response.json()['user'], other.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer forged')
+        self.assertEqual(self.client.get('/artworks').status_code, 401)
+
+    def test_writes_can_not_name_another_user(self):
+        other = User.objects.create(name='Jo', uid='jo')
+        artist = {'name': 'Milo', 'img': 'http://example.com/m.png', 'user': other.id}
+        artwork = make_artworks(1, user=other)[0]
+        with override_settings(ARTPARTY_BODY_USER=False):
+            self.assertEqual(self.client.post('/artists', artist, format='json').status_code, 401)
+            self.assertEqual(self.client.put(f'/artworks/{artwork.id}', {'user': self.user.id}, format='json').status_code, 401)
+            self.assertEqual(self.client.post('/artworks/bulk', [], format='json').status_code, 401)
+        with override_settings(ARTPARTY_FIREBASE_PROJECT_ID='artparty'):
+            self.assertEqual(self.client.post('/artists', artist, format='json').status_code, 401)
+        # Once a token is sent, the body never names the user
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer valid:unregistered')
+        self.assertEqual(self.client.post('/artists', artist, format='json').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer valid:firebase-uid')
+        self.assertEqual(self.client.post('/artists', artist, format='json').status_code, 403)
+        self.assertEqual(self.client.put(f'/artworks/{artwork.id}', {'user': other.id}, format='json').status_code, 403)
+        self.assertEqual(Artist.objects.filter(name='Milo').count(), 0)
+
+    def test_uids_are_not_published(self):
+        make_artworks(1, user=self.user)
+        self.assertNotIn('uid', self.client.get(f'/users/{self.user.id}').json())
+        self.assertNotIn('uid', self.client.get('/artworks').json()[0]['user'])
+        self.assertNotIn('uid', self.client.get('/artworks?fields=id,user&expand=user').json()[0]['user'])
+
+
+class ExportTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tag = Tag.objects.create(label='ink')
+        self.featured = make_artworks(3, tags=[self.tag], featured=True)
+        make_artworks(2)
+
+    def test_ndjson_streams_filtered_rows_with_tags(self):
+        response = self.client.get('/artworks/export?featured=true')
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [a.id for a in self.featured])
+        self.assertEqual(rows[0]['tags'], [{'id': self.tag.id, 'label': 'ink'}])
+
+    def test_csv(self):
+        response = self.client.get(f'/artworks/export?format=csv&artist={self.featured[0].artist_id}')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][-1], 'tags')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][-1], 'ink')
+
+    def test_queries_grow_with_chunks_not_rows(self):
+        artworks = Artwork.objects.all()
+        with CaptureQueriesContext(connection) as ctx:
+            rows = list(artwork_rows(artworks, chunk_size=2))
+        self.assertEqual(len(rows), 5)
+        # Each chunk of two adds one tag query; the iterator itself is one query
+        self.assertEqual(len(ctx.captured_queries), 1 + 3)
+
+    def test_unknown_user(self):
+        self.assertEqual(self.client.get('/artworks/export?user=9999').status_code, 404)
+
+
+class FastSerializerParityTests(ArtpartyTestCase):
+    fixtures = ['users', 'artists', 'artworks', 'tags', 'artworktags']
+
+    def assertSameBytes(self, fast, slow):
+        self.assertEqual(FastJSONRenderer().render(fast), JSONRenderer().render(slow))
+
+    def test_artworks(self):
+        # Text that JSON encoders disagree about most often
+        Artwork.objects.filter(pk=1).update(description='Naïve “quotes”\n  emoji 🎨 </script>')
+        artworks = Artwork.objects.with_related().order_by('id')
+        self.assertTrue(artworks.exists())
+        self.assertSameBytes(artwork_data(artwork_values(artworks)), ArtworkSerializer(artworks, many=True).data)
+
+    def test_artworktags_and_tags(self):
+        artworktags = ArtworkTag.objects.select_related('tag').order_by('id')
+        self.assertSameBytes(artworktag_data(artworktag_values(artworktags)), ArtworkTagSerializer(artworktags, many=True).data)
+        tags = Tag.objects.order_by('id')
+        self.assertSameBytes(tag_data(tags), TagSerializer(tags, many=True).data)
+
+    def test_list_endpoint_matches_serializer(self):
+        response = self.client.get('/artworks')
+        artworks = Artwork.objects.with_related().order_by('id')
+        self.assertEqual(response.content, JSONRenderer().render(ArtworkSerializer(artworks, many=True).data))
+
+    def test_renders_without_orjson(self):
+        artworks = Artwork.objects.with_related().order_by('id')
+        with mock.patch('artpartyapi.renderers.orjson', None):
+            response = self.client.get('/artworks')
+        self.assertEqual(response.content, JSONRenderer().render(ArtworkSerializer(artworks, many=True).data))
+
+
+class SparseFieldsetTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tag = Tag.objects.create(label='ink')
+        self.artwork = make_artworks(1, tags=[self.tag])[0]
+
+    def test_grid_fields_read_only_the_artwork_table(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/artworks?fields=id,title,img').json()
+        self.assertEqual(data, [{'id': self.artwork.id, 'title': 'Artwork 0', 'img': 'http://example.com/art.png'}])
+        listing = [query['sql'] for query in ctx.captured_queries if 'description' in query['sql'] or 'label' in query['sql']]
+        self.assertEqual(listing, [])
+
+    def test_expanded_artist(self):
+        data = self.client.get(f'/artworks/{self.artwork.id}?fields=id,artist').json()
+        self.assertEqual(data['artist'], {
+            'id': self.artwork.artist_id, 'name': 'Test Artist', 'img': 'http://example.com/a.png', 'user': self.artwork.user_id,
+        })
+        self.assertEqual(ArtworkSerializer(self.artwork).data['artist'], data['artist'])
+
+    def test_unexpanded_relations_are_ids(self):
+        data = self.client.get('/artworks?fields=id,user,artist,tags&expand=').json()[0]
+        self.assertEqual(data, {
+            'id': self.artwork.id, 'user': self.artwork.user_id, 'artist': self.artwork.artist_id, 'tags': [self.tag.id],
+        })
+
+    def test_expand_tags_only(self):
+        data = self.client.get(f'/artworks/{self.artwork.id}?fields=id,artist,tags&expand=tags').json()
+        self.assertEqual(data['artist'], self.artwork.artist_id)
+        self.assertEqual(data['tags'][0]['tag'], {'id': self.tag.id, 'label': 'ink'})
+
+    def test_unknown_field(self):
+        self.assertEqual(self.client.get('/artworks?fields=id,secret').status_code, 400)
+        self.assertEqual(self.client.get('/artworks/9999?fields=id').status_code, 404)
+
+
+class FeaturedFeedTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tag = Tag.objects.create(label='ink')
+        self.featured = make_artworks(3, tags=[self.tag], featured=True)
+        make_artworks(2)
+
+    def unfed(self):
+        """The same list through the regular, filtered path"""
+        return self.client.get('/artworks?featured=true&uncached=1').json()
+
+    def test_matches_filtered_list(self):
+        self.assertEqual(self.client.get('/artworks?featured=true').json(), self.unfed())
+
+    def test_homepage_is_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.client.get('/artworks?featured=true').json()
+        self.assertEqual([row['id'] for row in data], [artwork.id for artwork in self.featured])
+
+    def test_follows_featured_flag_and_tags(self):
+        first = self.featured[0]
+        first.featured = False
+        first.save()
+        Tag.objects.filter(pk=self.tag.pk).update(label='pen')
+        self.tag.refresh_from_db()
+        self.tag.save()
+        self.client.post(f'/artworks/{self.featured[1].id}/add_artwork_tag', {'tag': Tag.objects.create(label='clay').id}, format='json')
+        data = self.client.get('/artworks?featured=true').json()
+        self.assertEqual(data, self.unfed())
+        self.assertEqual([row['id'] for row in data], [artwork.id for artwork in self.featured[1:]])
+        self.assertEqual([t['tag']['label'] for t in data[0]['tags']], ['pen', 'clay'])
+
+    def test_rank_orders_the_feed(self):
+        FeaturedArtwork.objects.filter(artwork=self.featured[0]).update(rank=1)
+        self.assertEqual(rebuild_feed(), 3)
+        data = self.client.get('/artworks?featured=true').json()
+        self.assertEqual([row['id'] for row in data], [artwork.id for artwork in self.featured[1:] + self.featured[:1]])
+
+    def test_deleting_an_artwork_drops_its_entry(self):
+        self.featured[0].delete()
+        self.assertFalse(FeaturedArtwork.objects.filter(artwork_id=self.featured[0].id).exists())
+
+
+class CounterTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tags = [Tag.objects.create(label='ink'), Tag.objects.create(label='clay')]
+        self.artworks = make_artworks(3, tags=self.tags[:1])
+        self.artist = self.artworks[0].artist
+
+    def counts(self, owner):
+        owner.refresh_from_db()
+        return owner.artwork_count, owner.featured_count, owner.tag_count
+
+    def test_single_writes(self):
+        self.assertEqual(self.counts(self.artist), (3, 0, 3))
+        self.client.put(f'/artworks/{self.artworks[0].id}', {'featured': True, 'tags': [t.id for t in self.tags]}, format='json')
+        self.assertEqual(self.counts(self.artist), (3, 1, 4))
+        self.artworks[1].delete()
+        self.assertEqual(self.counts(self.artist), (2, 1, 3))
+        self.assertEqual(self.counts(self.artist.user), (2, 1, 3))
+
+    def test_moving_an_artwork_moves_its_counts(self):
+        other = Artist.objects.create(name='Other', img='http://example.com/b.png', user=self.artist.user)
+        self.client.put(f'/artworks/{self.artworks[0].id}', {'artist': other.id}, format='json')
+        self.assertEqual(self.counts(self.artist), (2, 0, 2))
+        self.assertEqual(self.counts(other), (1, 0, 1))
+
+    def test_bulk_writes(self):
+        items = [{
+            'title': 'Bulk', 'img': 'http://example.com/x.png', 'medium': 'Ink', 'description': '',
+            'date': '2024-02-01', 'age': 7, 'featured': True, 'user': self.artist.user_id, 'artist': self.artist.id,
+            'tags': [t.id for t in self.tags],
+        }] * 2
+        self.assertEqual(self.client.post('/artworks/bulk', items, format='json').status_code, 201)
+        self.assertEqual(self.counts(self.artist), (5, 2, 7))
+        self.client.post('/artworktags/bulk', [{'artwork': self.artworks[0].id, 'tag': self.tags[1].id}], format='json')
+        self.assertEqual(self.counts(self.artist), (5, 2, 8))
+
+    def test_reconcile_fixes_drift(self):
+        Artist.objects.filter(pk=self.artist.pk).update(artwork_count=40, tag_count=-1)
+        self.assertEqual(reconcile(), {'Artist': 1, 'User': 0, 'Tag': 0, 'TagUsage': 0})
+        self.assertEqual(self.counts(self.artist), (3, 0, 3))
+        self.assertEqual(set(reconcile().values()), {0})
+
+    def test_stats(self):
+        ArtworkTag.objects.create(artwork=self.artworks[2], tag=self.tags[1])
+        for url in (f'/artists/{self.artist.id}/stats', f'/users/{self.artist.user_id}/stats'):
+            data = self.client.get(url).json()
+            self.assertEqual((data['artwork_count'], data['tag_count']), (3, 4))
+            self.assertEqual([(t['label'], t['count']) for t in data['tags']], [('ink', 3), ('clay', 1)])
+            self.assertEqual(data['latest_artwork']['id'], self.artworks[2].id)
+        self.assertEqual(self.client.get('/artists/9999/stats').status_code, 404)
+
+
+class TagCountTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ink, self.clay, self.wax = (Tag.objects.create(label=label) for label in ('Ink', 'clay', 'Watercolor'))
+        self.mine = make_artworks(2, tags=[self.ink, self.clay])
+        self.theirs = make_artworks(1, tags=[self.ink])
+
+    def counts(self, query):
+        return [(t['label'], t['count']) for t in self.client.get(f'/tags?with_counts=true&{query}').json()]
+
+    def test_counts_follow_writes(self):
+        self.assertEqual(self.counts(''), [('Ink', 3), ('clay', 2), ('Watercolor', 0)])
+        self.client.put(f'/artworks/{self.mine[0].id}', {'tags': [self.wax.id]}, format='json')
+        self.theirs[0].delete()
+        self.assertEqual(self.counts('top=2'), [('Ink', 1), ('Watercolor', 1)])
+        self.assertEqual(set(reconcile().values()), {0})
+
+    def test_scoped_counts(self):
+        artist = self.mine[0].artist
+        self.assertEqual(self.counts(f'artist={artist.id}'), [('Ink', 2), ('clay', 2)])
+        self.assertEqual(self.counts(f'user={self.theirs[0].user_id}'), [('Ink', 1)])
+        self.assertEqual(self.client.get('/tags?with_counts=true&user=9999').status_code, 404)
+
+    def test_prefix(self):
+        self.assertEqual([t['label'] for t in self.client.get('/tags?prefix=w').json()], ['Watercolor'])
+        self.assertEqual([t['label'] for t in self.client.get('/tags?prefix=I').json()], ['Ink'])
+        self.assertEqual(self.counts(f'prefix=c&artist={self.mine[0].artist_id}'), [('clay', 2)])
+        self.assertEqual(self.client.get('/tags?top=0').status_code, 400)
+
+    def test_non_ascii_prefix(self):
+        Tag.objects.create(label='éclair')
+        Tag.objects.create(label='Eclipse')
+        self.assertEqual([t['label'] for t in self.client.get('/tags?prefix=%C3%A9c').json()], ['éclair'])
+        self.assertEqual([t['label'] for t in self.client.get('/tags?prefix=ec').json()], ['Eclipse'])
+        self.assertEqual([t['label'] for t in self.client.get('/tags?prefix=%C3%A9cl&with_counts=true').json()], ['éclair'])
+
+    def test_prefix_range_is_sqlite_only(self):
+        Tag.objects.create(label='Eclipse')
+        Tag.objects.create(label='Ed')
+        with mock.patch.object(connection, 'vendor', 'postgresql'), CaptureQueriesContext(connection) as ctx:
+            labels = [t['label'] for t in self.client.get('/tags?prefix=ec&uncached=1').json()]
+        self.assertEqual(labels, ['Eclipse'])
+        self.assertTrue(any('LIKE' in query['sql'] for query in ctx.captured_queries))
+
+
+class DatabaseConfigTests(TestCase):
+
+    def test_sqlite_is_the_default(self):
+        config = database_config({}, Path('/srv/artparty'))
+        self.assertEqual(config['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(config['NAME'], Path('/srv/artparty/db.sqlite3'))
+
+    def test_postgres_from_environment(self):
+        config = database_config({
+            'ARTPARTY_DB_ENGINE': 'postgres', 'ARTPARTY_DB_HOST': 'db', 'ARTPARTY_DB_CONN_MAX_AGE': '300',
+            'ARTPARTY_DB_DISABLE_SERVER_SIDE_CURSORS': 'true',
+        })
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((config['HOST'], config['CONN_MAX_AGE']), ('db', 300))
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+        self.assertTrue(config['DISABLE_SERVER_SIDE_CURSORS'])
+        with self.assertRaises(ImproperlyConfigured):
+            database_config({'ARTPARTY_DB_ENGINE': 'oracle'})
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+@override_settings(ARTPARTY_DATABASE_REPLICAS=['replica_1'], ARTPARTY_REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+
+    def route(self, request, status_code=200):
+        """Runs `request` through ReplicaMiddleware, noting where the view's reads would go"""
+        seen = {}
+
+        def view(request):
+            seen['read'] = ReplicaRouter().db_for_read(Artwork)
+            seen['write'] = ReplicaRouter().db_for_write(Artwork)
+            return HttpResponse(status=status_code)
+
+        response = ReplicaMiddleware(view)(request)
+        return seen, response
+
+    def test_reads_go_to_a_replica_and_writes_to_the_primary(self):
+        seen, response = self.route(RequestFactory().get('/artworks'))
+        self.assertEqual(seen, {'read': 'replica_1', 'write': 'default'})
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.route(RequestFactory().post('/artworks'))[0]['read'], 'default')
+        # Outside a request everything uses the primary
+        self.assertEqual(ReplicaRouter().db_for_read(Artwork), 'default')
+
+    def test_clients_read_their_writes(self):
+        _, response = self.route(RequestFactory().post('/artworks'), status_code=201)
+        until = response[STICKY_HEADER]
+        self.assertEqual(response.cookies[STICKY_COOKIE].value, until)
+
+        factory = RequestFactory()
+        factory.cookies[STICKY_COOKIE] = until
+        self.assertEqual(self.route(factory.get('/artworks'))[0]['read'], 'default')
+        header = {f'HTTP_{STICKY_HEADER.upper().replace("-", "_")}': until}
+        self.assertEqual(self.route(RequestFactory().get('/artworks', **header))[0]['read'], 'default')
+        expired = {f'HTTP_{STICKY_HEADER.upper().replace("-", "_")}': '1'}
+        self.assertEqual(self.route(RequestFactory().get('/artworks', **expired))[0]['read'], 'replica_1')
+
+    def test_failed_writes_are_not_sticky(self):
+        _, response = self.route(RequestFactory().post('/artworks'), status_code=400)
+        self.assertFalse(response.has_header(STICKY_HEADER))
+
+    def test_database_config_for_replicas(self):
+        primary = database_config({}, Path('/srv/artparty'))
+        self.assertEqual(
+            {alias: config['NAME'] for alias, config in replica_configs(primary, {'ARTPARTY_DB_REPLICAS': 'a.sqlite3, b.sqlite3'}).items()},
+            {'replica_1': 'a.sqlite3', 'replica_2': 'b.sqlite3'},
+        )
+        primary = database_config({'ARTPARTY_DB_ENGINE': 'postgres'})
+        replica = replica_configs(primary, {'ARTPARTY_DB_REPLICAS': 'replica.internal:6432'})['replica_1']
+        self.assertEqual((replica['HOST'], replica['PORT'], replica['TEST']), ('replica.internal', '6432', {'MIRROR': 'default'}))
+
+
+class AsyncViewTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        uid_cache.clear()
+        registry.clear()
+        self.user = User.objects.create(name='Stacey', uid='firebase-uid')
+        self.tag = Tag.objects.create(label='ink')
+        self.artworks = make_artworks(3, user=self.user, tags=[self.tag], featured=True)
+        make_artworks(2)
+
+    def async_request(self, method, url, **extra):
+        """Sends the request to the ASGI URLconf; the async views' queries
+        run back on this thread, inside the test's transaction"""
+        async def send():
+            return await getattr(self.async_client, method)(url, **extra)
+        with override_settings(ROOT_URLCONF='artparty.urls_asgi'):
+            return async_to_sync(send)()
+
+    # Uncached, so each server builds its own response and validators
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    )
+    def test_reads_match_the_sync_views(self):
+        artwork = self.artworks[0]
+        for url in (
+            '/artworks', '/artworks?featured=true', f'/artworks?user={self.user.id}&tags={self.tag.id}',
+            '/artworks?page_size=2', '/artworks?fields=id,title&expand=user', '/artworks?user=999',
+            '/artworks?tags=x', f'/artworks/{artwork.id}', f'/artworks/{artwork.id}?fields=id,tags',
+            '/artworks/999', '/tags', '/tags?prefix=in&top=1', '/tags?top=0', '/tags?with_counts=true',
+        ):
+            expected = self.client.get(url)
+            response = self.async_request('get', url)
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(response.content, expected.content, url)
+            self.assertEqual(response.get('ETag'), expected.get('ETag'), url)
+
+    def test_conditional_get_and_cache(self):
+        etag = self.async_request('get', '/artworks')['ETag']
+        self.assertEqual(self.async_request('get', '/artworks', **{'If-None-Match': etag}).status_code, 304)
+        data = self.async_request('get', '/artworks?featured=true').json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.async_request('get', '/artworks?featured=true').json(), data)
+
+    def test_writes_reach_the_sync_views(self):
+        response = self.async_request('post', '/tags', data={'label': 'clay'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = self.async_request(
+            'put', f'/artworks/{self.artworks[0].id}', data={'title': 'Renamed'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.async_request('get', f'/artworks/{self.artworks[0].id}').json()['title'], 'Renamed')
+        self.assertEqual(self.async_request('get', '/artworks/export').status_code, 200)
+
+    def test_checkuser(self):
+        data = self.async_request('post', '/checkuser', data={'uid': 'firebase-uid'}, content_type='application/json').json()
+        self.assertEqual(data, {'id': self.user.id, 'uid': 'firebase-uid', 'name': 'Stacey'})
+        self.assertEqual(self.async_request('post', '/checkuser', data={'uid': 'nobody'}, content_type='application/json').json(), {'valid': False})
+        self.assertEqual(self.async_request('get', '/checkuser').status_code, 405)
+
+    def test_metrics_cover_async_requests(self):
+        self.async_request('get', '/artworks')
+        samples, count, _ = registry.snapshot()['artwork-list']
+        self.assertEqual(count, 1)
+        self.assertGreater(samples[0]['queries'], 0)
+
+
+@override_settings(ARTPARTY_SYNC_SETTLE_SECONDS=0)
+class SyncTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tag = Tag.objects.create(label='ink')
+        self.mine = make_artworks(2, tags=[self.tag])
+        self.user = self.mine[0].user
+        self.theirs = make_artworks(1)[0]
+
+    def sync(self, token=None, **params):
+        params = {'user': self.user.id, **params}
+        if token:
+            params['since'] = token
+        response = self.client.get('/sync', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_snapshot_then_deltas(self):
+        data = self.sync()
+        self.assertTrue(data['reset'])
+        self.assertEqual([row['id'] for row in data['artworks']], [artwork.id for artwork in self.mine])
+        self.assertEqual(data['artists'], [{'id': self.mine[0].artist_id, 'user': self.user.id, 'name': 'Test Artist', 'img': 'http://example.com/a.png'}])
+        self.assertEqual(len(data['artworktags']), 2)
+        self.assertEqual(self.sync(data['token'])['artworks'], [])
+
+        token = data['token']
+        added = make_artworks(1, user=self.user, artist=self.mine[0].artist)[0]
+        make_artworks(1)
+        self.tag.label = 'pen'
+        self.tag.save()
+        link = ArtworkTag.objects.get(artwork=self.mine[0])
+        link_id = link.id
+        link.delete()
+        deleted_id = self.mine[1].id
+        self.mine[1].delete()
+
+        data = self.sync(token)
+        self.assertFalse(data['reset'])
+        self.assertEqual([row['id'] for row in data['artworks']], [added.id])
+        self.assertNotIn('tags', data['artworks'][0])
+        self.assertEqual(data['tags'], [{'id': self.tag.id, 'label': 'pen'}])
+        self.assertEqual(data['deleted']['artworks'], [deleted_id])
+        self.assertIn(link_id, data['deleted']['artworktags'])
+        self.assertEqual(self.sync(data['token'])['artworks'], [])
+
+    def test_artwork_moving_away_is_deleted_for_its_old_owner(self):
+        token = self.sync()['token']
+        artwork = Artwork.objects.get(pk=self.mine[0].pk)
+        artwork.user = self.theirs.user
+        artwork.save()
+        self.assertEqual(self.sync(token)['deleted']['artworks'], [artwork.id])
+        data = self.sync(token, user=self.theirs.user_id)
+        self.assertEqual([row['id'] for row in data['artworks']], [artwork.id])
+        # Without a user, the move is an update
+        everything = self.client.get('/sync', {'since': token}).json()
+        self.assertEqual([row['id'] for row in everything['artworks']], [artwork.id])
+        self.assertEqual(everything['deleted']['artworks'], [])
+
+    def test_recent_changes_are_sent_again(self):
+        token = self.sync()['token']
+        Tag.objects.create(label='clay')
+        with self.settings(ARTPARTY_SYNC_SETTLE_SECONDS=60):
+            data = self.sync(token)
+            self.assertEqual(len(data['tags']), 1)
+            self.assertEqual(len(self.sync(data['token'])['tags']), 1)
+        self.assertEqual(len(self.sync(data['token'])['tags']), 1)
+
+    def test_pages(self):
+        token = self.sync()['token']
+        tags = [Tag.objects.create(label=f'tag {i}') for i in range(5)]
+        seen = []
+        with self.settings(ARTPARTY_SYNC_PAGE_SIZE=2):
+            while True:
+                data = self.sync(token)
+                seen += [tag['id'] for tag in data['tags']]
+                token = data['token']
+                if not data['has_more']:
+                    break
+        self.assertEqual(seen, [tag.id for tag in tags])
+
+    def test_snapshot_pages(self):
+        seen = {'artworks': [], 'artists': [], 'tags': [], 'artworktags': []}
+        resets = []
+        token = None
+        with self.settings(ARTPARTY_SYNC_PAGE_SIZE=2):
+            while True:
+                data = self.sync(token)
+                resets.append(data['reset'])
+                for name, ids in seen.items():
+                    ids += [row['id'] for row in data[name]]
+                token = data['token']
+                if not data['has_more']:
+                    break
+        # Two artworks, one artist, one tag and two artwork tags
+        self.assertEqual(resets, [True, False, False])
+        self.assertEqual(seen['artworks'], [artwork.id for artwork in self.mine])
+        self.assertEqual(len(seen['artists'] + seen['tags'] + seen['artworktags']), 4)
+
+        added = make_artworks(1, user=self.user, artist=self.mine[0].artist)[0]
+        self.assertEqual([row['id'] for row in self.sync(token)['artworks']], [added.id])
+
+    def test_artworktags_are_scoped(self):
+        token = self.sync()['token']
+        theirs = ArtworkTag.objects.create(artwork=self.theirs, tag=self.tag)
+        self.assertEqual(self.sync()['artworktags'], [
+            {'id': link.id, 'artwork': link.artwork_id, 'tag': self.tag.id}
+            for link in ArtworkTag.objects.filter(artwork__user=self.user).order_by('id')
+        ])
+        data = self.sync(token)
+        self.assertEqual(data['artworktags'], [])
+        self.assertEqual(data['deleted']['artworktags'], [])
+        everything = self.client.get('/sync', {'since': token}).json()
+        self.assertEqual([row['id'] for row in everything['artworktags']], [theirs.id])
+
+    def test_compaction_and_expired_tokens(self):
+        token = self.sync()['token']
+        for label in ('a', 'b', 'c'):
+            self.tag.label = label
+            self.tag.save()
+        # The tag's creation and first two relabels are superseded
+        self.assertEqual(compact(), 3)
+        self.assertEqual(self.sync(token)['tags'], [{'id': self.tag.id, 'label': 'c'}])
+
+        Change.objects.update(changed_at=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc))
+        count = Change.objects.count()
+        self.assertEqual(compact(), count)
+        self.assertFalse(Change.objects.exists())
+        with self.settings(ARTPARTY_SYNC_RETENTION_DAYS=0):
+            self.assertTrue(self.sync(token)['reset'])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get('/sync', {'since': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.get('/sync', {'user': 999}).status_code, 404)
+
+
+class LiveEventTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        hub.subscriptions.clear()
+        hub.recent.clear()
+        self.addCleanup(hub.subscriptions.clear)
+
+    def test_saves_publish_after_commit(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        subscription = Subscription(loop, 10)
+        hub.subscriptions.add(subscription)
+        with self.captureOnCommitCallbacks(execute=True):
+            artwork = make_artworks(1, featured=True)[0]
+        artwork.featured = False
+        with self.captureOnCommitCallbacks(execute=True):
+            artwork.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Artwork.objects.get(pk=artwork.pk).delete()
+
+        loop.run_until_complete(asyncio.sleep(0))
+        events = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+        self.assertEqual([event.type for event in events], ['created', 'featured', 'updated', 'unfeatured', 'deleted'])
+        self.assertEqual(events[1].data['title'], 'Artwork 0')
+        self.assertEqual([event.featured for event in events], [True, True, False, True, False])
+
+    def stream(self, deliver, query_string=b'', headers=(), disconnect=True):
+        """Runs the SSE app until `deliver`'s events are sent, then disconnects.
+        Returns: the body sent"""
+        async def scenario():
+            inbox = asyncio.Queue()
+            sent = []
+
+            async def receive():
+                return await inbox.get()
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': '/events', 'query_string': query_string, 'headers': list(headers)}
+            task = asyncio.ensure_future(sse.events(scope, receive, send))
+            while not hub.has_subscribers():
+                await asyncio.sleep(0)
+            hub.deliver(deliver)
+            for _ in range(20):
+                await asyncio.sleep(0)
+            if disconnect:
+                await inbox.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(task, 1)
+            self.assertEqual(sent[0]['headers'][0], (b'content-type', b'text/event-stream'))
+            return b''.join(message.get('body', b'') for message in sent[1:])
+
+        return async_to_sync(scenario)()
+
+    def test_stream_filters_featured_events(self):
+        body = self.stream([Event('updated', {'id': 1, 'featured': False}), Event('featured', {'id': 2, 'featured': True})],
+                           query_string=b'featured=true')
+        self.assertIn(b'event: featured\ndata: {"id":2,"featured":true}\n\n', body)
+        self.assertNotIn(b'"id":1', body)
+        self.assertFalse(hub.has_subscribers())
+
+    def test_slow_clients_are_dropped_and_replayed(self):
+        events = [Event('updated', {'id': i}) for i in range(5)]
+        hub.queue_size, queue_size = 2, hub.queue_size
+        try:
+            # The stream ends by itself once the queue overflows
+            body = self.stream(events, disconnect=False)
+        finally:
+            hub.queue_size = queue_size
+        self.assertNotIn(b'"id":4', body)
+
+        # Reconnecting replays what came after the last event seen
+        last_id = str(events[1].id).encode()
+        body = self.stream([], headers=[(b'last-event-id', last_id)])
+        self.assertEqual(body.count(b'event: updated'), 3)
+        body = self.stream([], headers=[(b'last-event-id', b'1')])
+        self.assertIn(b'event: reset', body)
+
+
+flaky_calls = []
+
+
+@jobs.register('tests.flaky', max_attempts=2)
+def flaky(fail):
+    flaky_calls.append(fail)
+    if fail:
+        raise RuntimeError('Flaky job failed')
+
+
+@override_settings(ARTPARTY_JOBS_EAGER=False)
+class JobQueueTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        flaky_calls.clear()
+        self.user = User.objects.create(name='Jo', uid='jo')
+        self.artist = Artist.objects.create(name='Jo', img='http://example.com/jo.png', user=self.user)
+        self.tag = Tag.objects.create(label='crayon')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer valid:jo')
+
+    def counts(self):
+        self.artist.refresh_from_db()
+        return self.artist.artwork_count, self.artist.featured_count, self.artist.tag_count
+
+    def test_artwork_writes_queue_their_post_write_work(self):
+        response = self.client.post('/artworks', {
+            'title': 'Cat', 'img': 'http://example.com/cat.png', 'medium': 'Crayon', 'description': 'A cat',
+            'date': '2024-02-01', 'age': 5, 'featured': True, 'artist': self.artist.id, 'tags': [self.tag.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        artwork_id = response.json()['id']
+        self.assertEqual(sorted(Job.objects.values_list('name', flat=True)), ['artworks.refresh', 'counters.move'])
+        self.assertEqual((self.counts(), FeaturedArtwork.objects.count()), ((0, 0, 0), 0))
+
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual((self.counts(), FeaturedArtwork.objects.count()), ((1, 1, 1), 1))
+        self.assertFalse(Job.objects.exists())
+
+        # Saves waiting on the same refresh share it
+        for title in ('Dog', 'Bird'):
+            self.client.put(f'/artworks/{artwork_id}', {'title': title}, format='json')
+        self.assertEqual(Job.objects.filter(name='artworks.refresh').count(), 1)
+        jobs.run_pending()
+        self.assertEqual(FeaturedArtwork.objects.get().data['title'], 'Bird')
+
+        self.client.delete(f'/artworks/{artwork_id}')
+        jobs.run_pending()
+        self.assertEqual((self.counts(), FeaturedArtwork.objects.count()), ((0, 0, 0), 0))
+
+    def test_failed_jobs_retry_with_backoff(self):
+        job = jobs.enqueue('tests.flaky', {'fail': True})
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('Flaky job failed', job.last_error)
+        self.assertEqual(jobs.run_pending(), 0)
+
+        # Out of attempts, the job stays behind as failed
+        Job.objects.update(run_at=timezone.now())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, len(flaky_calls)), (Job.FAILED, 2, 2))
+
+    def test_a_failing_runner_does_not_stop_the_worker(self):
+        jobs.enqueue('tests.flaky', {'fail': False})
+        jobs.enqueue('tests.flaky', {'fail': False})
+        with mock.patch('artpartyapi.jobs.run_job', side_effect=[RuntimeError('Database went away'), None]) as run_job, \
+                self.assertLogs('artpartyapi.jobs', 'ERROR') as logs:
+            self.assertEqual(jobs.Worker(concurrency=1, poll_interval=0.01).run(once=True), 2)
+        self.assertEqual(run_job.call_count, 2)
+        self.assertIn('Database went away', logs.output[0])
+        # The failed one is still claimed, for requeue_stale() to retry
+        self.assertEqual(Job.objects.order_by('id').first().status, Job.RUNNING)
+
+    def test_abandoned_jobs_are_retried(self):
+        job = jobs.enqueue('tests.flaky', {'fail': False})
+        jobs.claim(1, 'gone')
+        Job.objects.update(locked_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.QUEUED, ''))
+
+
+    def test_idempotency_keys_and_eager_mode(self):
+        first = jobs.enqueue('tests.flaky', {'fail': False}, key='flaky')
+        self.assertEqual(jobs.enqueue('tests.flaky', {'fail': False}, key='flaky'), first)
+        # A job that has started may have read the data already, so it absorbs nothing
+        jobs.claim(1, 'worker')
+        self.assertNotEqual(jobs.enqueue('tests.flaky', {'fail': False}, key='flaky'), first)
+        with override_settings(ARTPARTY_JOBS_EAGER=True):
+            self.assertIsNone(jobs.enqueue('tests.flaky', {'fail': False}))
+        self.assertEqual(flaky_calls, [False])
+
+
+def png(width, height, rgb):
+    """A solid PNG, written without an imaging library"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    pixels = b''.join(b'\x00' + bytes(rgb) * width for _ in range(height))
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) \
+        + chunk(b'IDAT', zlib.compress(pixels)) + chunk(b'IEND', b'')
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ImageTests(ArtpartyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.served = tempfile.TemporaryDirectory()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=cls.served.name))
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        Path(cls.served.name, 'cat.png').write_bytes(png(40, 20, (200, 30, 30)))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.served.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        store = tempfile.TemporaryDirectory()
+        self.addCleanup(store.cleanup)
+        settings = override_settings(
+            ARTPARTY_IMAGE_FETCHER='artpartyapi.images.HTTPFetcher', ARTPARTY_IMAGE_ALLOW_PRIVATE_HOSTS=True,
+            ARTPARTY_THUMBNAIL_ROOT=Path(store.name), ARTPARTY_THUMBNAIL_SIZES=(16, 64),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.store = get_store()
+        self.user = User.objects.create(name='Jo', uid='jo')
+        self.artist = Artist.objects.create(name='Jo', img='http://example.com/jo.png', user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer valid:jo')
+
+    def create(self, img):
+        response = self.client.post('/artworks', {
+            'title': 'Cat', 'img': img, 'medium': 'Crayon', 'description': '',
+            'date': '2024-02-01', 'age': 5, 'featured': True, 'artist': self.artist.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def test_new_artworks_get_their_image_read(self):
+        artwork_id = self.create(f'{self.base_url}/cat.png')
+        image = Image.objects.get()
+        self.assertEqual((image.status, image.width, image.height), (Image.READY, 40, 20))
+        self.assertEqual(image.content_hash, hashlib.sha256(png(40, 20, (200, 30, 30))).hexdigest())
+
+        data = self.client.get(f'/artworks/{artwork_id}').json()['image']
+        self.assertEqual((data['width'], data['height']), (40, 20))
+        # The list, the homepage feed and the serializer agree
+        self.assertEqual(self.client.get('/artworks?user=%d' % self.user.id).json()[0]['image'], data)
+        self.assertEqual(self.client.get('/artworks?featured=true').json()[0]['image'], data)
+
+        # Another artwork with the same picture shares the image
+        self.create(f'{self.base_url}/cat.png')
+        self.assertEqual(Image.objects.count(), 1)
+
+    @skipUnless(PILImage, 'Pillow is not installed')
+    def test_thumbnails_are_written_and_served(self):
+        artwork_id = self.create(f'{self.base_url}/cat.png')
+        data = self.client.get(f'/artworks/{artwork_id}').json()['image']
+        self.assertEqual(data['color'], '#c81e1e')
+        # 64 would scale the picture up, so there is one thumbnail
+        self.assertEqual([(t['width'], t['height']) for t in data['thumbnails']], [(16, 8)])
+
+        response = self.client.get(data['thumbnails'][0]['url'])
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/jpeg'))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(PILImage.open(io.BytesIO(b''.join(response.streaming_content))).size, (16, 8))
+
+        # An evicted thumbnail sends clients to the original while it is written again
+        for _, _, path in self.store.files():
+            path.unlink()
+        with override_settings(ARTPARTY_JOBS_EAGER=False):
+            response = self.client.get(data['thumbnails'][0]['url'])
+        self.assertEqual((response.status_code, response['Location']), (302, f'{self.base_url}/cat.png'))
+        self.assertEqual(Job.objects.get().name, 'images.ingest')
+
+    def test_ingest_moves_the_etag(self):
+        with override_settings(ARTPARTY_JOBS_EAGER=False):
+            self.create(f'{self.base_url}/cat.png')
+            self.create(f'{self.base_url}/missing.png')
+        url = f'/artworks?user={self.user.id}'
+        for image in Image.objects.order_by('id'):
+            etag = self.client.get(url)['ETag']
+            ingest(image.id)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_unreachable_images_fail_for_good(self):
+        artwork_id = self.create(f'{self.base_url}/missing.png')
+        self.assertEqual((Image.objects.get().status, Image.objects.get().error), (Image.FAILED, 'HTTP 404'))
+        self.assertIsNone(self.client.get(f'/artworks/{artwork_id}').json()['image'])
+
+    def test_private_hosts_are_refused(self):
+        with override_settings(ARTPARTY_IMAGE_ALLOW_PRIVATE_HOSTS=False):
+            self.create(f'{self.base_url}/cat.png')
+        self.assertEqual(Image.objects.get().status, Image.FAILED)
+        self.assertIn('not a public address', Image.objects.get().error)
+
+    def test_connections_go_to_the_checked_address(self):
+        resolved = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', 80))]
+        with override_settings(ARTPARTY_IMAGE_ALLOW_PRIVATE_HOSTS=False), \
+                mock.patch('artpartyapi.images.socket.getaddrinfo', return_value=resolved) as getaddrinfo, \
+                mock.patch('artpartyapi.images.socket.create_connection', side_effect=ConnectionRefusedError) as connect:
+            with self.assertRaises(FetchError) as caught:
+                HTTPFetcher().fetch('http://images.example/cat.png')
+            self.assertFalse(caught.exception.permanent)
+            # The name is resolved once, and never again by the connect
+            self.assertEqual(getaddrinfo.call_count, 1)
+            self.assertEqual(connect.call_args[0][0], ('93.184.216.34', 80))
+
+            resolved[0] = (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.1', 443))
+            with self.assertRaises(FetchError) as caught:
+                HTTPFetcher().fetch('https://images.example/cat.png')
+            self.assertTrue(caught.exception.permanent)
+            self.assertEqual(connect.call_count, 1)
+
+    def test_header_dimensions(self):
+        jpeg = b'\xff\xd8\xff\xe0' + struct.pack('>H', 4) + b'\0\0' + b'\xff\xc0' + struct.pack('>HBHH', 11, 8, 7, 9)
+        self.assertEqual(header_dimensions(jpeg), (9, 7))
+        self.assertEqual(header_dimensions(b'GIF89a' + struct.pack('<HH', 3, 5)), (3, 5))
+        self.assertEqual(header_dimensions(png(6, 2, (0, 0, 0))), (6, 2))
+        self.assertIsNone(header_dimensions(b'<html>'))
+
+    def test_store_evicts_least_recently_used(self):
+        store = ThumbnailStore(self.store.root, max_bytes=25)
+        store.save('a' * 64, 16, b'x' * 10)
+        store.save('b' * 64, 16, b'x' * 10)
+        os.utime(store.path('a' * 64, 16), (1000, 1000))
+        os.utime(store.path('b' * 64, 16), (2000, 2000))
+        # Serving the older one makes it the most recently used
+        store.open('a' * 64, 16).close()
+        store.save('c' * 64, 16, b'x' * 10)
+        self.assertEqual([store.exists(c * 64, 16) for c in 'abc'], [True, False, True])
+
+
+class ThrottleTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        uid_cache.clear()
+        self.user = User.objects.create(name='Stacey', uid='firebase-uid')
+        self.artworks = make_artworks(3, user=self.user, featured=True)
+
+    async_request = AsyncViewTests.async_request
+
+    def test_clients_get_a_burst_then_the_rate(self):
+        with override_settings(ARTPARTY_THROTTLES={'artwork': {'ip': (1, 3)}}):
+            self.assertEqual([self.client.get('/artworks').status_code for _ in range(4)], [200, 200, 200, 429])
+            response = self.client.get('/artworks/1')
+            self.assertEqual((response.status_code, response['Retry-After']), (429, '1'))
+            # The bucket is the client's, and signed in clients draw on their user's
+            self.assertEqual(self.client.get('/artworks', REMOTE_ADDR='10.0.0.2').status_code, 200)
+            self.client.credentials(HTTP_AUTHORIZATION='Bearer valid:firebase-uid')
+            self.assertEqual(self.client.get('/artworks').status_code, 200)
+            # Other views aren't limited
+            self.assertEqual(self.client.get('/tags').status_code, 200)
+
+    def test_limits_per_action(self):
+        with override_settings(ARTPARTY_THROTTLES={'artwork.bulk': {'ip': (1, 1)}}):
+            bulk = lambda: self.client.post('/artworks/bulk', [], format='json').status_code
+            self.assertNotEqual(bulk(), 429)
+            self.assertEqual(bulk(), 429)
+            # Other actions of the viewset aren't limited
+            self.assertEqual([self.client.get('/artworks').status_code for _ in range(3)], [200, 200, 200])
+            self.assertEqual(self.async_request('get', '/artworks').status_code, 200)
+
+    def test_per_process_buckets_are_refused(self):
+        self.assertEqual(check_throttle_cache(None), [])
+        with override_settings(ARTPARTY_THROTTLES={'check_user': {'ip': (1, 10)}}):
+            self.assertEqual([error.id for error in check_throttle_cache(None)], ['artpartyapi.E003'])
+
+    def test_buckets_refill(self):
+        with override_settings(ARTPARTY_THROTTLES={'check_user': {'ip': (20, 1)}}):
+            check = lambda: self.client.post('/checkuser', {'uid': 'nobody'}, format='json').status_code
+            self.assertEqual([check(), check()], [200, 429])
+            time.sleep(0.06)
+            self.assertEqual(check(), 200)
+
+    def test_async_views_share_the_buckets(self):
+        with override_settings(ARTPARTY_THROTTLES={'artwork': {'uid': (1, 2)}}):
+            self.client.credentials(HTTP_AUTHORIZATION='Bearer valid:firebase-uid')
+            self.assertEqual(self.client.get('/artworks').status_code, 200)
+            self.assertEqual(self.async_request('get', '/artworks', Authorization='Bearer valid:firebase-uid').status_code, 200)
+            response = self.async_request('get', f'/artworks/{self.artworks[0].id}', Authorization='Bearer valid:firebase-uid')
+            self.assertEqual((response.status_code, response['Retry-After']), (429, '1'))
+            self.assertEqual(response.json(), self.client.get('/artworks').json())
+            # Anonymous clients aren't limited here
+            self.assertEqual(self.async_request('get', '/artworks').status_code, 200)
+
+
+class CoalesceTests(ArtpartyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        uid_cache.clear()
+        self.user = User.objects.create(name='Stacey', uid='firebase-uid')
+        self.artworks = make_artworks(3, user=self.user, featured=True)
+
+    async_request = AsyncViewTests.async_request
+
+    def test_identical_calls_share_one_run(self):
+        single = SingleFlight()
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        def run():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'response', 'entry'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(single.do('key', run, 5)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.append(single.do('key', run, 5)))
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(len(calls), 1)
+        self.assertCountEqual(results, [('response', 'entry'), (None, 'entry')])
+        # Done flights are forgotten
+        self.assertEqual(single.do('key', run, 5), ('response', 'entry'))
+        self.assertEqual(len(calls), 2)
+
+    def test_nothing_to_share_runs_again(self):
+        single = SingleFlight()
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        def run():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'not found', None
+
+        leader = threading.Thread(target=single.do, args=('key', run, 5))
+        leader.start()
+        started.wait()
+        release.set()
+        self.assertEqual(single.do('key', run, 5), ('not found', None))
+        leader.join()
+        self.assertEqual(len(calls), 2)
+
+    def test_concurrent_async_reads_run_once(self):
+        async def send_together():
+            return await asyncio.gather(*(self.async_client.get('/artworks?featured=true') for _ in range(3)))
+
+        with override_settings(ROOT_URLCONF='artparty.urls_asgi'), CaptureQueriesContext(connection) as ctx:
+            responses = async_to_sync(send_together)()
+        alone = len(ctx.captured_queries)
+        self.assertEqual({response.content for response in responses}, {responses[0].content})
+        cache.clear()
+        with override_settings(ROOT_URLCONF='artparty.urls_asgi', ARTPARTY_COALESCE={}), \
+                CaptureQueriesContext(connection) as ctx:
+            async_to_sync(send_together)()
+        self.assertEqual(len(ctx.captured_queries), alone * 3)
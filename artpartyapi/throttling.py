@@ -0,0 +1,144 @@
+"""Per-client rate limits.
+
+Each client has a token bucket per view: it holds up to `burst` requests
+and refills at `rate` requests a second, so a client can burst and then
+keeps to the rate. Authenticated clients are limited by user and anonymous
+ones by IP address (behind proxies, set REST_FRAMEWORK's NUM_PROXIES).
+ARTPARTY_THROTTLES sets the limits per viewset basename or function view
+name, or for one action of a viewset as "basename.action" (which takes
+precedence); views it doesn't list aren't limited, and it lists none by
+default. Limited requests get a 429 with a Retry-After header.
+
+Buckets live in the cache, which must be one all workers share: with a
+per-process cache each worker keeps its own buckets, so the real limit
+grows with the number of workers (the system checks refuse that). A bucket is a single number, the
+time at which it would be full again (the "generic cell rate algorithm"),
+moved by an atomic incr, so concurrent requests can't both take its last
+token. Clients whose bucket was full race to restart it, which can let a
+few extra requests through at that moment."""
+import functools
+import math
+import time
+from rest_framework import status
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+from django.conf import settings
+from artpartyapi.authentication import arequest_user
+from artpartyapi.cache import KEY_PREFIX, get_cache
+from artpartyapi.models import User
+
+
+def limits(scopes, kind):
+    """The first of `scopes` with limits for `kind` ('uid' or 'ip') buckets.
+    Returns: (scope, (rate, burst)), or None"""
+    throttles = getattr(settings, 'ARTPARTY_THROTTLES', {})
+    for scope in scopes:
+        scope_limits = throttles.get(scope, {}).get(kind)
+        if scope_limits is not None:
+            return scope, scope_limits
+    return None
+
+
+def scopes_of(name, action=None):
+    """The ARTPARTY_THROTTLES entries that can limit `action` of view `name`,
+    most specific first"""
+    return (f'{name}.{action}', name) if action else (name,)
+
+
+def bucket(scopes, user, ident):
+    """The cache key and limits of the bucket a request draws on, or None
+    if the request isn't limited"""
+    kind, client = ('uid', user.id) if user is not None else ('ip', ident)
+    found = limits(scopes, kind)
+    if found is None:
+        return None
+    scope, bucket_limits = found
+    return f'{KEY_PREFIX}:throttle:{scope}:{kind}:{client}', bucket_limits
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def take(key, rate, burst):
+    """Takes a token from the bucket at `key`.
+    Returns: None, or the seconds until the bucket has a token again"""
+    cache = get_cache()
+    interval = max(1, round(1000 / rate))
+    now = now_ms()
+    try:
+        full_at = cache.incr(key, interval)
+    except ValueError:
+        full_at = None
+    if full_at is None or full_at - interval < now:
+        # A new bucket, or one that filled up while idle
+        full_at = now + interval
+        cache.set(key, full_at, timeout=math.ceil(interval / 1000) + 1)
+        return None
+    if full_at - now > interval * burst:
+        cache.decr(key, interval)
+        return (full_at - now - interval * burst) / 1000
+    # Forget the bucket once it is full again
+    cache.touch(key, math.ceil((full_at - now) / 1000) + 1)
+    return None
+
+
+async def atake(key, rate, burst):
+    """take() for async views"""
+    cache = get_cache()
+    interval = max(1, round(1000 / rate))
+    now = now_ms()
+    try:
+        full_at = await cache.aincr(key, interval)
+    except ValueError:
+        full_at = None
+    if full_at is None or full_at - interval < now:
+        full_at = now + interval
+        await cache.aset(key, full_at, timeout=math.ceil(interval / 1000) + 1)
+        return None
+    if full_at - now > interval * burst:
+        await cache.adecr(key, interval)
+        return (full_at - now - interval * burst) / 1000
+    await cache.atouch(key, math.ceil((full_at - now) / 1000) + 1)
+    return None
+
+
+def view_scopes(view):
+    """A DRF view's names in ARTPARTY_THROTTLES: the viewset basename with
+    and without the action, or the name of an @api_view function"""
+    return scopes_of(getattr(view, 'basename', None) or type(view).__name__, getattr(view, 'action', None))
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Applies ARTPARTY_THROTTLES to the DRF views"""
+
+    def allow_request(self, request, view):
+        user = request.user if isinstance(request.user, User) else None
+        limited = bucket(view_scopes(view), user, self.get_ident(request))
+        self.delay = take(limited[0], *limited[1]) if limited is not None else None
+        return self.delay is None
+
+    def wait(self):
+        return self.delay
+
+
+def athrottle(name, action=None):
+    """Applies the ARTPARTY_THROTTLES limits of view `name` (and `action`)
+    to an async view, answering like TokenBucketThrottle does for the DRF views"""
+    scopes = scopes_of(name, action)
+    # Imported here because the renderers aren't needed by the sync paths
+    from artpartyapi.renderers import JSONDataResponse
+
+    def decorator(view_function):
+        @functools.wraps(view_function)
+        async def wrapper(request, *args, **kwargs):
+            user = await arequest_user(request)
+            limited = bucket(scopes, user, BaseThrottle().get_ident(request))
+            delay = await atake(limited[0], *limited[1]) if limited is not None else None
+            if delay is None:
+                return await view_function(request, *args, **kwargs)
+            response = JSONDataResponse({'detail': str(Throttled(delay).detail)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = str(math.ceil(delay))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,139 @@
+"""Thumbnail store, and the `image` field artworks are serialized with.
+
+Thumbnails are files named by the SHA-256 of the original and their
+bounding box, so artworks with identical images share them and a file
+never changes once written. The store under ARTPARTY_THUMBNAIL_ROOT is a
+cache capped at ARTPARTY_THUMBNAIL_STORE_BYTES: serving a thumbnail marks
+it used, and a write that goes over the cap deletes the least recently
+used ones. images.py writes them; /thumbnails serves them."""
+import os
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from artpartyapi.models import Image
+
+# How often serving a thumbnail refreshes its last-used time
+TOUCH_SECONDS = 60
+
+# Columns artwork_values() reads for the `image` field
+IMAGE_VALUES = ('image__status', 'image__width', 'image__height', 'image__color', 'image__content_hash', 'image__thumbnails')
+
+# (root, max bytes) -> ThumbnailStore
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class ThumbnailStore:
+    """Content-addressed thumbnail files with least-recently-used eviction"""
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Bytes stored, counted on the first write
+        self.used = None
+
+    def path(self, content_hash, size):
+        return self.root / content_hash[:2] / f'{content_hash}-{size}.jpg'
+
+    def exists(self, content_hash, size):
+        return self.path(content_hash, size).exists()
+
+    def save(self, content_hash, size, data):
+        path = self.path(content_hash, size)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, so readers never see half a file
+        temporary = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+        with self.lock:
+            self.used = self.disk_usage() if self.used is None else self.used + len(data)
+            if self.used > self.max_bytes:
+                self.evict()
+
+    def open(self, content_hash, size):
+        """Returns: the thumbnail opened for reading and marked used, or None if it isn't stored"""
+        path = self.path(content_hash, size)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        if time.time() - os.fstat(file.fileno()).st_mtime > TOUCH_SECONDS:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Evicted meanwhile; the open file can still be served
+                pass
+        return file
+
+    def files(self):
+        """(last used, bytes, path) of every stored thumbnail"""
+        files = []
+        for path in self.root.glob('*/*.jpg'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def disk_usage(self):
+        return sum(size for _, size, _ in self.files())
+
+    def evict(self):
+        """Deletes the least recently used thumbnails until the store is back
+        to 90% of its cap, so the next few writes don't evict again.
+        Returns: number of thumbnails deleted"""
+        files = sorted(self.files())
+        used = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in files:
+            if used <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            used -= size
+            removed += 1
+        self.used = used
+        return removed
+
+
+def get_store():
+    root = getattr(settings, 'ARTPARTY_THUMBNAIL_ROOT', settings.BASE_DIR / 'thumbnails')
+    max_bytes = getattr(settings, 'ARTPARTY_THUMBNAIL_STORE_BYTES', 1024 ** 3)
+    with _stores_lock:
+        if (root, max_bytes) not in _stores:
+            _stores[root, max_bytes] = ThumbnailStore(root, max_bytes)
+        return _stores[root, max_bytes]
+
+
+def thumbnail_sizes():
+    return sorted(getattr(settings, 'ARTPARTY_THUMBNAIL_SIZES', (160, 320, 640)))
+
+
+def thumbnail_dimensions(width, height, box):
+    """(width, height) of a thumbnail fitting `box`, keeping the aspect ratio"""
+    scale = box / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def thumbnail_url(content_hash, size):
+    return f'{getattr(settings, "ARTPARTY_THUMBNAIL_URL", "/thumbnails/")}{content_hash}-{size}.jpg'
+
+
+def image_data(status, width, height, color, content_hash, thumbnails):
+    """An artwork's `image`: its dimensions, placeholder colour and
+    thumbnails, or None until the image has been fetched"""
+    if status != Image.READY:
+        return None
+    return {
+        'width': width,
+        'height': height,
+        'color': color or None,
+        'thumbnails': [thumbnail_data(content_hash, width, height, size) for size in thumbnails],
+    }
+
+
+def thumbnail_data(content_hash, width, height, size):
+    thumbnail_width, thumbnail_height = thumbnail_dimensions(width, height, size)
+    return {'url': thumbnail_url(content_hash, size), 'width': thumbnail_width, 'height': thumbnail_height}
@@ -4,3 +4,5 @@ from .tag import TagView
 from .artworktag import ArtworkTagView
 from .user import UserView
 from .auth import check_user, register_user
+from .sync import sync
+from .thumbnail import thumbnail
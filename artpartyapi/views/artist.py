@@ -3,12 +3,18 @@ from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
-from artpartyapi.models import Artist, User
+from rest_framework.decorators import action
+from artpartyapi.models import Artist, Artwork, ArtworkTag, Tag, User
+from artpartyapi.authentication import check_writer, get_request_user
+from artpartyapi.cache import cache_response
+from artpartyapi.counters import owner_stats
+from artpartyapi.pagination import KeysetPagination
 
 
 class ArtistView(ViewSet):
     """Artist view"""
 
+    @cache_response(Artist)
     def retrieve(self, request, pk):
         """Handle GET requests for single artist
         Returns: Response -- JSON serialized artist"""
@@ -20,6 +26,7 @@ class ArtistView(ViewSet):
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
 
 
+    @cache_response(Artist, User)
     def list(self, request):
         """Handle GET requests to get all artists
         Returns: Response -- JSON serialized list of artists"""
@@ -36,6 +43,12 @@ class ArtistView(ViewSet):
         else: # Return no artists if no uid is found
             artists=Artist.objects.none()
         
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(artists, request)
+        if page is not None:
+            serializer = ArtistSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
         serializer = ArtistSerializer(artists, many=True)
         return Response(serializer.data)
     
@@ -43,7 +56,7 @@ class ArtistView(ViewSet):
     def create(self, request):
         """Handle POST operations
         Returns Response -- JSON serialized artist instance"""
-        user = User.objects.get(pk=request.data["user"])
+        user = get_request_user(request)
 
         artist = Artist.objects.create(
             name=request.data["name"],
@@ -58,11 +71,10 @@ class ArtistView(ViewSet):
         """Handle PUT requests for an artist
         Returns: Response -- Empty body with 204 status code"""
 
+        user = get_request_user(request)
         artist = Artist.objects.get(pk=pk)
         artist.name = request.data["name"]
         artist.img = request.data["img"]
-
-        user = User.objects.get(pk=request.data["user"])
         artist.user = user
         artist.save()
 
@@ -70,9 +82,21 @@ class ArtistView(ViewSet):
     
     
     def destroy(self, request, pk):
+        check_writer(request)
         artist = Artist.objects.get(pk=pk)
         artist.delete()
         return Response(None, status=status.HTTP_204_NO_CONTENT)
+
+    @action(methods=['get'], detail=True)
+    @cache_response(Artist, Artwork, ArtworkTag, Tag, User)
+    def stats(self, request, pk):
+        """Handle GET requests for an artist's profile stats
+        Returns: Response -- artwork, featured and tag counts, tags by use and the latest artwork"""
+        try:
+            artist = Artist.objects.get(pk=pk)
+        except Artist.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+        return Response(owner_stats(artist, 'artist'))
         
 
 
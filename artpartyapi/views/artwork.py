@@ -1,84 +1,130 @@
 """View module for handling requests about game types"""
-from django.http import HttpResponseServerError
+from django.db import transaction
+from django.http import HttpResponseServerError, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
 from rest_framework.decorators import action
-from artpartyapi.models import Artwork, Artist, User, Tag, ArtworkTag
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from artpartyapi.models import Artwork, Artist, User, Tag, ArtworkTag, FeaturedArtwork
+from artpartyapi import changelog, counters, events, images, tasks
+from artpartyapi.authentication import check_writer, get_request_user, owner_id
+from artpartyapi.bulk import BATCH_SIZE, check_foreign_keys, error_payload, validate_items
+from artpartyapi.cache import bump_generation, cache_response
+from artpartyapi.feed import feed, refresh_featured
+from artpartyapi.fastserializers import artwork_data, artwork_values, sparse_fieldset
+from artpartyapi.export import CSVRenderer, NDJSONRenderer, artwork_rows, csv_lines, ndjson_lines
+from artpartyapi.conditional import artwork_validators, is_not_modified, not_modified_response, set_validators
+from artpartyapi.pagination import KeysetPagination
+from artpartyapi.search import index_artworks, search_artwork_ids
+from artpartyapi.thumbnails import image_data
+from artpartyapi.services import add_artwork_tags, remove_artwork_tags, set_artwork_tags
 from .artworktag import ArtworkTagSerializer
 
 
 class ArtworkView(ViewSet):
     """Artwork view"""
 
+    @cache_response(Artwork, ArtworkTag, Tag, Artist, User)
     def retrieve(self, request, pk):
         """Handle GET requests for single artwork
         Returns: Response -- JSON serialized artwork"""
+        # ?fields= and ?expand= trim the payload and the columns read
+        if 'fields' in request.query_params or 'expand' in request.query_params:
+            try:
+                fields, expand = sparse_fieldset(request.query_params)
+            except ValueError as ex:
+                return Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+            data = artwork_data(artwork_values(Artwork.objects.filter(pk=pk), fields, expand), fields, expand)
+            if not data:
+                return Response({'message': 'Artwork matching query does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(data[0])
+
         try:
-            artwork = Artwork.objects.get(pk=pk)
+            artwork = Artwork.objects.with_related().get(pk=pk)
             serializer = ArtworkSerializer(artwork)
             return Response(serializer.data)
         except Artwork.DoesNotExist as ex:
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
     
+    @cache_response(Artwork, ArtworkTag, Tag, Artist, User, FeaturedArtwork)
     def list(self, request):
         """Handle GET requests to get all artworks
         Returns: Response -- JSON serialized list of artworks"""
-        # Looking at query parameters in the url
-        user_id = request.query_params.get('user', None)
-        artist_id = request.query_params.get('artist', None)
-        featured = request.query_params.get('featured', None)
-        
-        artworks = Artwork.objects.all()
-        
-        if user_id:
-            try:
-                user = User.objects.get(id=user_id)
-                artworks = artworks.filter(user=user)
-            except User.DoesNotExist:
-                return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
-        
-        if artist_id:
-            try:
-                artist = Artist.objects.get(id=artist_id)
-                artworks = artworks.filter(artist=artist)
-            except Artist.DoesNotExist:
-                return Response({'message': 'Artist not found'}, status=status.HTTP_404_NOT_FOUND)
-        
-        # Check if 'featured' query parameter is provided, then filter based on featured status; '.lower() == 'true'' ensures casing isn't an issue
-        if featured is not None:  
-            artworks = artworks.filter(featured=featured.lower() == 'true')  # 
-        
-        serializer = ArtworkSerializer(artworks, many=True)
-        return Response(serializer.data)
+        if is_homepage(request.query_params):
+            data, etag, last_modified = feed()
+            if is_not_modified(request, etag, last_modified):
+                return not_modified_response(etag, last_modified)
+            return set_validators(Response(data), etag, last_modified)
+
+        artworks, error = self.filter_artworks(request, Artwork.objects.with_related())
+        if error is not None:
+            return error
+
+        # ?fields=id,title,img&expand=tags trims the payload and the columns read
+        try:
+            fields, expand = sparse_fieldset(request.query_params)
+        except ValueError as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Galleries are polled, so answer 304 before serializing anything if the client is current
+        etag, last_modified = artwork_validators(artworks)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        # Lists skip ArtworkSerializer for plain dicts built from .values() rows
+        rows = artwork_values(artworks, fields, expand)
+        paginator = KeysetPagination(ordering=('-date', '-id'))
+        page = paginator.paginate_queryset(rows, request)
+        if page is not None:
+            return set_validators(paginator.get_paginated_response(artwork_data(page, fields, expand)), etag, last_modified)
+
+        return set_validators(Response(artwork_data(rows, fields, expand)), etag, last_modified)
         
       
+    def filter_artworks(self, request, artworks):
+        """Applies the user, artist, featured and tags query parameters to `artworks`
+        Returns: (filtered queryset, None), or (None, error Response)"""
+        try:
+            filters = read_artwork_filters(request.query_params)
+        except ValueError as ex:
+            return None, Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        if 'user' in filters and not User.objects.filter(id=filters['user']).exists():
+            return None, Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        if 'artist' in filters and not Artist.objects.filter(id=filters['artist']).exists():
+            return None, Response({'message': 'Artist not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return filter_by(artworks, filters), None
+
+
     def create(self, request):
         """Handle POST operations
         Returns Response -- JSON serialized artwork instance"""
-        user = User.objects.get(pk=request.data["user"])
+        user = get_request_user(request)
         artist = Artist.objects.get(pk=request.data["artist"])
 
-        artwork = Artwork.objects.create(
-            title=request.data["title"],
-            img=request.data["img"],
-            medium=request.data["medium"],
-            description=request.data["description"],
-            date=request.data["date"],
-            age=request.data["age"],
-            featured=request.data.get("featured", False),
-            user=user,
-            artist=artist,
-        )
-        
-        # Handling artwork tags
-        tags = request.data.get("tags", [])
-        for tag_id in tags:
-            try:
-                tag = Tag.objects.get(id=tag_id)
-                ArtworkTag.objects.create(artwork=artwork, tag=tag)
-            except Tag.DoesNotExist as ex:
-                return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+        # A missing tag rolls the whole artwork back rather than leaving it half created.
+        # The search index, feed and counters catch up in a background job
+        try:
+            with transaction.atomic(), tasks.deferred():
+                artwork = Artwork.objects.create(
+                    title=request.data["title"],
+                    img=request.data["img"],
+                    medium=request.data["medium"],
+                    description=request.data["description"],
+                    date=request.data["date"],
+                    age=request.data["age"],
+                    featured=request.data.get("featured", False),
+                    user=user,
+                    artist=artist,
+                )
+                add_artwork_tags(artwork, request.data.get("tags", []))
+        except Tag.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
         
         serializer = ArtworkSerializer(artwork, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -88,6 +134,7 @@ class ArtworkView(ViewSet):
         """Handle PUT requests for an artwork, allowing partial updates.
         Returns: Response -- Empty body with 204 status code"""
         
+        check_writer(request)
         artwork = Artwork.objects.get(pk=pk)
 
         # Update only fields that are provided in the request
@@ -97,53 +144,219 @@ class ArtworkView(ViewSet):
 
         # Only update user and artist if they are explicitly provided
         if 'user' in request.data:
-            user = User.objects.get(pk=request.data['user'])
-            artwork.user = user
+            artwork.user = get_request_user(request)
 
         if 'artist' in request.data:
             artist = Artist.objects.get(pk=request.data['artist'])
             artwork.artist = artist
         
-        artwork.save()
-    
-        # Update tags
-        current_tags_ids = set(artwork.tags.values_list('id', flat=True))
-        new_tags_ids = set(request.data.get("tags", []))
-
-        # Tags to add
-        tags_to_add = new_tags_ids - current_tags_ids
-        for tag_id in tags_to_add:
-            tag, created = Tag.objects.get_or_create(id=tag_id)
-            ArtworkTag.objects.create(artwork=artwork, tag=tag)
-
-        # Tags to remove
-        tags_to_remove = current_tags_ids - new_tags_ids
-        ArtworkTag.objects.filter(artwork=artwork, tag_id__in=tags_to_remove).delete()
+        # Save the fields and sync the tags together, or not at all
+        try:
+            with transaction.atomic(), tasks.deferred():
+                artwork.save()
+                # Tags are only touched when the request sends them
+                if 'tags' in request.data:
+                    set_artwork_tags(artwork, request.data['tags'])
+        except Tag.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
 
         return Response(None, status=status.HTTP_204_NO_CONTENT)
     
     
     def destroy(self, request, pk):
+        check_writer(request)
         artwork = Artwork.objects.get(pk=pk)
-        artwork.delete()
+        with transaction.atomic(), tasks.deferred():
+            artwork.delete()
         return Response(None, status=status.HTTP_204_NO_CONTENT)
         
 
       
       
       
+    @action(methods=['get'], detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """Handle GET requests to export artworks with their tags as NDJSON (?format=ndjson,
+        the default) or CSV (?format=csv), filtered like the artwork list
+        Returns: StreamingHttpResponse -- one line per artwork, in id order"""
+        artworks, error = self.filter_artworks(request, Artwork.objects.all())
+        if error is not None:
+            return error
+
+        rows = artwork_rows(artworks)
+        if request.accepted_renderer.format == 'csv':
+            response = StreamingHttpResponse(csv_lines(rows), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="artworks.csv"'
+        else:
+            response = StreamingHttpResponse(ndjson_lines(rows), content_type='application/x-ndjson')
+        return response
+
+    @action(methods=['post', 'put', 'delete'], detail=False)
+    def bulk(self, request):
+        """Handle bulk writes: POST creates a list of artworks (with tags), PUT
+        partially updates a list of artworks that each carry an id, and DELETE
+        removes a list of artwork ids. Nothing is written unless every item is valid.
+        Returns: Response -- ids written, or the errors of each failing item"""
+        check_writer(request)
+        if request.method == 'POST':
+            return self.bulk_create(request)
+        if request.method == 'PUT':
+            return self.bulk_update(request)
+        return self.bulk_destroy(request)
+
+    def bulk_create(self, request):
+        items, errors = validate_items(ArtworkBulkSerializer, request.data)
+        if items is None:
+            return Response({'message': errors}, status=status.HTTP_400_BAD_REQUEST)
+        # Items belong to the authenticated user
+        for item, item_errors in zip(items, errors):
+            if item is not None:
+                item['user'] = owner_id(request, item.get('user'))
+                if item['user'] is None:
+                    item_errors['user'] = ['This field is required.']
+        check_foreign_keys(items, errors, 'user', User)
+        check_foreign_keys(items, errors, 'artist', Artist)
+        check_foreign_keys(items, errors, 'tags', Tag, many=True)
+        if any(errors):
+            return Response(error_payload(errors), status=status.HTTP_400_BAD_REQUEST)
+
+        artists = Artist.objects.in_bulk({item['artist'] for item in items})
+        artworks = [
+            Artwork(
+                user_id=item['user'],
+                artist=artists[item['artist']],
+                **{field: value for field, value in item.items() if field not in ('id', 'user', 'artist', 'tags')},
+            )
+            for item in items
+        ]
+        with transaction.atomic():
+            ingest = images.attach(artworks)
+            Artwork.objects.bulk_create(artworks, batch_size=BATCH_SIZE)
+            artworktags = ArtworkTag.objects.bulk_create([
+                ArtworkTag(artwork=artwork, tag_id=tag_id)
+                for artwork, item in zip(artworks, items)
+                for tag_id in dict.fromkeys(item.get('tags', []))
+            ], batch_size=BATCH_SIZE)
+            # bulk_create sends no signals, so do the signal receivers' work here
+            bump_generation(Artwork, ArtworkTag)
+            changelog.record(artworks)
+            changelog.record(artworktags)
+            events.artworks_saved(artworks, created=True)
+            index_artworks(artworks)
+            refresh_featured(artwork.id for artwork in artworks if artwork.featured)
+            counters.artworks_created(artworks, {
+                artwork.id: dict.fromkeys(item.get('tags', [])) for artwork, item in zip(artworks, items)
+            })
+            images.queue(ingest)
+
+        return Response({'ids': [artwork.id for artwork in artworks]}, status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, request):
+        items, errors = validate_items(ArtworkBulkSerializer, request.data, partial=True)
+        if items is None:
+            return Response({'message': errors}, status=status.HTTP_400_BAD_REQUEST)
+        for item, item_errors in zip(items, errors):
+            if item is not None and 'id' not in item:
+                item_errors['id'] = ['This field is required.']
+            if item is not None and 'tags' in item:
+                item_errors['tags'] = ['Tags can not be changed in bulk; use PUT /artworks/<pk>.']
+            if item is not None and 'user' in item:
+                item['user'] = owner_id(request, item['user'])
+        check_foreign_keys(items, errors, 'id', Artwork)
+        check_foreign_keys(items, errors, 'user', User)
+        check_foreign_keys(items, errors, 'artist', Artist)
+        if any(errors):
+            return Response(error_payload(errors), status=status.HTTP_400_BAD_REQUEST)
+
+        artworks = Artwork.objects.select_related('artist').in_bulk([item['id'] for item in items])
+        artists = Artist.objects.in_bulk({item['artist'] for item in items if 'artist' in item})
+        fields = {'updated_at'}
+        now = timezone.now()
+        for item in items:
+            artwork = artworks[item['id']]
+            for field, value in item.items():
+                if field == 'artist':
+                    artwork.artist = artists[value]
+                elif field == 'user':
+                    artwork.user_id = value
+                elif field != 'id':
+                    setattr(artwork, field, value)
+                fields.add(field)
+            # bulk_update skips auto_now
+            artwork.updated_at = now
+        fields.discard('id')
+
+        with transaction.atomic():
+            ingest = []
+            if 'img' in fields:
+                ingest = images.attach(artworks.values())
+                fields.add('image')
+            Artwork.objects.bulk_update(artworks.values(), fields, batch_size=BATCH_SIZE)
+            bump_generation(Artwork)
+            index_artworks(artworks.values())
+            refresh_featured(artworks)
+            changelog.record(artworks.values())
+            events.artworks_saved(artworks.values())
+            counters.artworks_changed(artworks.values())
+            images.queue(ingest)
+
+        return Response({'ids': list(artworks)}, status=status.HTTP_200_OK)
+
+    def bulk_destroy(self, request):
+        if not isinstance(request.data, list) or not all(isinstance(pk, int) for pk in request.data):
+            return Response({'message': 'Expected a list of artwork ids'}, status=status.HTTP_400_BAD_REQUEST)
+        items = [{'id': pk} for pk in request.data]
+        errors = [{} for _ in items]
+        check_foreign_keys(items, errors, 'id', Artwork)
+        if any(errors):
+            return Response(error_payload(errors), status=status.HTTP_400_BAD_REQUEST)
+
+        # QuerySet.delete sends the delete signals itself
+        with transaction.atomic():
+            Artwork.objects.filter(id__in=request.data).delete()
+        return Response(None, status=status.HTTP_204_NO_CONTENT)
+
+    @action(methods=['get'], detail=False)
+    @cache_response(Artwork, ArtworkTag, Tag, Artist, User)
+    def search(self, request):
+        """Handle GET requests to search artworks by title, medium, description and artist name
+        Returns: Response -- JSON serialized page of artworks, best match first"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'message': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Ranked results are paged by number; nobody reads page 50 of a search
+        try:
+            page_size = int(request.query_params.get('page_size', KeysetPagination.default_page_size))
+            page_number = max(int(request.query_params.get('page', 1)), 1)
+        except ValueError:
+            return Response({'message': 'page and page_size must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = min(max(page_size, 1), KeysetPagination.max_page_size)
+
+        # One extra id tells us whether there is a next page
+        ids = search_artwork_ids(query, limit=page_size + 1, offset=(page_number - 1) * page_size)
+        artworks = Artwork.objects.with_related().in_bulk(ids[:page_size])
+        serializer = ArtworkSerializer([artworks[artwork_id] for artwork_id in ids[:page_size] if artwork_id in artworks], many=True)
+
+        url = request.build_absolute_uri()
+        return Response({
+            'next': replace_query_param(url, 'page', page_number + 1) if len(ids) > page_size else None,
+            'previous': replace_query_param(url, 'page', page_number - 1) if page_number > 1 else None,
+            'results': serializer.data,
+        })
+
+
     # Custom actions to add/remove ArtworkTags
      
     @action(methods=['post'], detail=True)
     def add_artwork_tag(self, request, pk):
         """Post request for a user to add an tag to an artwork"""
 
-        tag = Tag.objects.get(pk=request.data["tag"])
         artwork = Artwork.objects.get(pk=pk)
-        artworktag = ArtworkTag.objects.create(
-            tag=tag,
-            artwork=artwork,
-        )
+        try:
+            add_artwork_tags(artwork, [request.data["tag"]])
+        except Tag.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
         return Response({'message': 'Tag added to artwork'}, status=status.HTTP_201_CREATED)
 
     @action(methods=['delete'], detail=True)
@@ -154,21 +367,83 @@ class ArtworkView(ViewSet):
         if not artworktag_id:
             return Response({"error": "Artwork tag ID not provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            artwork_tag = ArtworkTag.objects.get(pk=artworktag_id, artwork__pk=pk)
-            artwork_tag.delete()
+        if remove_artwork_tags(pk, link_ids=[artworktag_id]):
             return Response({"message": "Artwork tag removed"}, status=status.HTTP_204_NO_CONTENT)
-        except ArtworkTag.DoesNotExist:
-            return Response({"error": "Artwork tag not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"error": "Artwork tag not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
+def is_homepage(query_params):
+    """The homepage, ?featured=true and nothing else, is read precomputed from the feed table"""
+    return list(query_params) == ['featured'] and query_params['featured'].lower() == 'true' \
+        and not api_settings.PAGE_SIZE
+
+
+def read_artwork_filters(query_params):
+    """Reads the user, artist, featured, tags and match query parameters
+    Returns: dict of the filters given; raises ValueError for bad tags or match"""
+    filters = {}
+    for name in ('user', 'artist'):
+        if query_params.get(name):
+            filters[name] = query_params[name]
+
+    # '.lower() == 'true'' ensures casing isn't an issue
+    featured = query_params.get('featured', None)
+    if featured is not None:
+        filters['featured'] = featured.lower() == 'true'
+
+    # ?tags=1,4 finds artworks with every listed tag, or any of them with &match=any
+    tags = query_params.get('tags', None)
+    if tags:
+        try:
+            tag_ids = [int(tag_id) for tag_id in tags.split(',') if tag_id.strip()]
+        except ValueError:
+            raise ValueError('tags must be a comma separated list of tag ids') from None
+        match = query_params.get('match', 'all')
+        if match not in ('all', 'any'):
+            raise ValueError('match must be "all" or "any"')
+        filters['tags'] = (tag_ids, match == 'all')
+    return filters
+
+
+def filter_by(artworks, filters):
+    """Applies filters from read_artwork_filters to `artworks`"""
+    if 'user' in filters:
+        artworks = artworks.filter(user_id=filters['user'])
+    if 'artist' in filters:
+        artworks = artworks.filter(artist_id=filters['artist'])
+    if 'featured' in filters:
+        artworks = artworks.filter(featured=filters['featured'])
+    if 'tags' in filters:
+        tag_ids, match_all = filters['tags']
+        artworks = artworks.tagged(tag_ids, match_all=match_all)
+    return artworks
+
+
+class ArtworkUserSerializer(serializers.ModelSerializer):
+    """The user nested in an artwork, without their counters"""
+    class Meta:
+        model = User
+        fields = ('id', 'name')
+
+
+class ArtworkArtistSerializer(serializers.ModelSerializer):
+    """The artist nested in an artwork, without their counters"""
+    class Meta:
+        model = Artist
+        fields = ('id', 'name', 'img', 'user')
 
 
 class ArtworkSerializer(serializers.ModelSerializer):
     """JSON serializer for artworks"""
+    user = ArtworkUserSerializer(read_only=True)
+    artist = ArtworkArtistSerializer(read_only=True)
     # Value of 'tags' will be computed by 'get_tags' method below
     tags = serializers.SerializerMethodField()
+    # Dimensions, placeholder colour and thumbnails, once the image has been fetched
+    image = serializers.SerializerMethodField()
     class Meta:
         model = Artwork
-        fields = ('id', 'user', 'artist', 'title', 'img', 'medium', 'description', 'date', 'age', 'featured', 'tags')
+        fields = ('id', 'user', 'artist', 'title', 'img', 'image', 'medium', 'description', 'date', 'age', 'featured', 'tags')
         depth = 1
         
     # Serializes artwork tags
@@ -177,3 +452,25 @@ class ArtworkSerializer(serializers.ModelSerializer):
         # 'tags' coming from related_name='tags' in ArtworkTag model
         artworktags = artwork.tags.all()
         return ArtworkTagSerializer(artworktags, many=True).data
+
+    def get_image(self, artwork):
+        image = artwork.image
+        if image is None:
+            return None
+        return image_data(image.status, image.width, image.height, image.color, image.content_hash, image.thumbnails)
+
+
+class ArtworkBulkSerializer(serializers.Serializer):
+    """Validates one item of a bulk artwork write. Foreign keys are plain ids
+    here and are checked for the whole batch at once."""
+    id = serializers.IntegerField(required=False)
+    title = serializers.CharField(max_length=50)
+    img = serializers.CharField(max_length=500)
+    medium = serializers.CharField(max_length=500)
+    description = serializers.CharField(allow_blank=True)
+    date = serializers.DateField()
+    age = serializers.IntegerField()
+    featured = serializers.BooleanField(default=False)
+    user = serializers.IntegerField(required=False)
+    artist = serializers.IntegerField()
+    tags = serializers.ListField(child=serializers.IntegerField(), required=False)
@@ -1,9 +1,18 @@
 """View module for handling requests about game types"""
+from django.db import transaction
 from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
+from rest_framework.decorators import action
+from artpartyapi import changelog, counters
 from artpartyapi.models import ArtworkTag, Artwork, Tag
+from artpartyapi.bulk import BATCH_SIZE, check_foreign_keys, error_payload, validate_items
+from artpartyapi.cache import bump_generation
+from artpartyapi.feed import refresh_featured
+from artpartyapi.services import add_artwork_tags
+from artpartyapi.fastserializers import artworktag_data, artworktag_values
+from artpartyapi.pagination import KeysetPagination
 from .tag import TagSerializer
 
 class ArtworkTagView(ViewSet):
@@ -23,14 +32,19 @@ class ArtworkTagView(ViewSet):
     def list(self, request):
         """Handle GET requests to get all artworktags
         Returns: Response -- JSON serialized list of artworktags"""
-        artworktags = ArtworkTag.objects.all()
+        artworktags = ArtworkTag.objects.select_related('tag')
         
         singleartworktags = request.query_params.get('artwork', None)
         if singleartworktags is not None:
             artworktags = artworktags.filter(artwork=singleartworktags)
         
-        serializer = ArtworkTagSerializer(artworktags, many=True)
-        return Response(serializer.data)
+        rows = artworktag_values(artworktags)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(rows, request)
+        if page is not None:
+            return paginator.get_paginated_response(artworktag_data(page))
+
+        return Response(artworktag_data(rows))
 
 
     def create(self, request):
@@ -39,10 +53,7 @@ class ArtworkTagView(ViewSet):
         artwork = Artwork.objects.get(pk=request.data["artwork"])
         tag = Tag.objects.get(pk=request.data["tag"])
 
-        artworktag = ArtworkTag.objects.create(
-            artwork=artwork,
-            tag=tag,
-        )
+        artworktag = add_artwork_tags(artwork, [tag.id])[tag.id]
         serializer = ArtworkTagSerializer(artworktag)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
@@ -51,6 +62,55 @@ class ArtworkTagView(ViewSet):
         artworktag = ArtworkTag.objects.get(pk=pk)
         artworktag.delete()
         return Response(None, status=status.HTTP_204_NO_CONTENT)
+
+
+    @action(methods=['post', 'delete'], detail=False)
+    def bulk(self, request):
+        """Handle bulk writes: POST links a list of {artwork, tag} pairs, skipping
+        pairs that are already linked, and DELETE removes a list of artworktag ids.
+        Nothing is written unless every item is valid.
+        Returns: Response -- ids written, or the errors of each failing item"""
+        if request.method == 'DELETE':
+            return self.bulk_destroy(request)
+
+        items, errors = validate_items(ArtworkTagBulkSerializer, request.data)
+        if items is None:
+            return Response({'message': errors}, status=status.HTTP_400_BAD_REQUEST)
+        check_foreign_keys(items, errors, 'artwork', Artwork)
+        check_foreign_keys(items, errors, 'tag', Tag)
+        if any(errors):
+            return Response(error_payload(errors), status=status.HTTP_400_BAD_REQUEST)
+
+        pairs = list(dict.fromkeys((item['artwork'], item['tag']) for item in items))
+        with transaction.atomic():
+            existing = set(
+                ArtworkTag.objects.filter(artwork_id__in={artwork_id for artwork_id, _ in pairs})
+                .values_list('artwork_id', 'tag_id')
+            )
+            artworktags = ArtworkTag.objects.bulk_create(
+                [ArtworkTag(artwork_id=artwork_id, tag_id=tag_id) for artwork_id, tag_id in pairs if (artwork_id, tag_id) not in existing],
+                batch_size=BATCH_SIZE,
+            )
+            # bulk_create sends no signals
+            bump_generation(ArtworkTag)
+            changelog.record(artworktags)
+            refresh_featured(artworktag.artwork_id for artworktag in artworktags)
+            counters.tags_changed((artworktag.artwork_id, artworktag.tag_id, 1) for artworktag in artworktags)
+
+        return Response({'ids': [artworktag.id for artworktag in artworktags]}, status=status.HTTP_201_CREATED)
+
+    def bulk_destroy(self, request):
+        if not isinstance(request.data, list) or not all(isinstance(pk, int) for pk in request.data):
+            return Response({'message': 'Expected a list of artworktag ids'}, status=status.HTTP_400_BAD_REQUEST)
+        items = [{'id': pk} for pk in request.data]
+        errors = [{} for _ in items]
+        check_foreign_keys(items, errors, 'id', ArtworkTag)
+        if any(errors):
+            return Response(error_payload(errors), status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            ArtworkTag.objects.filter(id__in=request.data).delete()
+        return Response(None, status=status.HTTP_204_NO_CONTENT)
         
 
 class ArtworkTagSerializer(serializers.ModelSerializer):
@@ -59,3 +119,9 @@ class ArtworkTagSerializer(serializers.ModelSerializer):
     class Meta:
         model = ArtworkTag
         fields = ('id', 'artwork', 'tag')
+
+
+class ArtworkTagBulkSerializer(serializers.Serializer):
+    """Validates one item of a bulk artworktag write"""
+    artwork = serializers.IntegerField()
+    tag = serializers.IntegerField()
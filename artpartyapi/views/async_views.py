@@ -0,0 +1,146 @@
+"""Async views for the hot read endpoints, served under ASGI (see artparty/urls_asgi.py).
+
+GET requests to the artwork list and detail, the tag list and POSTs to
+checkuser are answered here without tying up a worker thread per request;
+the ORM's async methods run each query in the request's database thread.
+Everything else (writes, ?with_counts=true, HEAD, OPTIONS) is handed to
+the sync DRF views, so both servers behave the same. DRF has no async
+views, so these are plain Django views that always render JSON."""
+import json
+from asgiref.sync import sync_to_async
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from artpartyapi.authentication import aresolve_uid
+from artpartyapi.cache import acache_response
+from artpartyapi.conditional import aartwork_validators, is_not_modified, not_modified_response, set_validators
+from artpartyapi.fastserializers import aartwork_data, artwork_values, sparse_fieldset
+from artpartyapi.feed import afeed
+from artpartyapi.models import Artist, Artwork, ArtworkTag, FeaturedArtwork, Tag, User
+from artpartyapi.pagination import KeysetPagination
+from artpartyapi.renderers import JSONDataResponse
+from artpartyapi.throttling import athrottle
+from .artwork import ArtworkView, filter_by, is_homepage, read_artwork_filters
+from .auth import check_user as sync_check_user
+from .tag import TagView, labels_starting_with, read_top
+
+sync_artwork_list = sync_to_async(ArtworkView.as_view({'get': 'list', 'post': 'create'}))
+sync_artwork_detail = sync_to_async(ArtworkView.as_view({'get': 'retrieve', 'put': 'update', 'delete': 'destroy'}))
+sync_tag_list = sync_to_async(TagView.as_view({'get': 'list', 'post': 'create'}))
+sync_check_user = sync_to_async(sync_check_user)
+
+
+def async_view(view):
+    """Marks `view` csrf exempt like the DRF views it stands in for. The
+    csrf_exempt decorator can't be used: in Django 4.1 it wraps async
+    views in a sync function."""
+    view.csrf_exempt = True
+    return view
+
+
+@async_view
+async def artwork_list(request):
+    if request.method == 'GET':
+        return await list_artworks(request)
+    return await sync_artwork_list(request)
+
+
+@async_view
+async def artwork_detail(request, pk):
+    if request.method == 'GET':
+        return await retrieve_artwork(request, pk)
+    return await sync_artwork_detail(request, pk=pk)
+
+
+@async_view
+async def tag_list(request):
+    if request.method == 'GET' and request.GET.get('with_counts', '').lower() != 'true':
+        return await list_tags(request)
+    return await sync_tag_list(request)
+
+
+@async_view
+async def check_user(request):
+    if request.method == 'POST':
+        return await resolve_user(request)
+    return await sync_check_user(request)
+
+
+@athrottle('artwork', 'list')
+@acache_response('artwork:list', Artwork, ArtworkTag, Tag, Artist, User, FeaturedArtwork)
+async def list_artworks(request):
+    """ArtworkView.list"""
+    if is_homepage(request.GET):
+        data, etag, last_modified = await afeed()
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified, JSONDataResponse)
+        return set_validators(JSONDataResponse(data), etag, last_modified)
+
+    try:
+        filters = read_artwork_filters(request.GET)
+        fields, expand = sparse_fieldset(request.GET)
+    except ValueError as ex:
+        return JSONDataResponse({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+    if 'user' in filters and not await User.objects.filter(id=filters['user']).aexists():
+        return JSONDataResponse({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    if 'artist' in filters and not await Artist.objects.filter(id=filters['artist']).aexists():
+        return JSONDataResponse({'message': 'Artist not found'}, status=status.HTTP_404_NOT_FOUND)
+    artworks = filter_by(Artwork.objects.all(), filters)
+
+    etag, last_modified = await aartwork_validators(artworks)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified, JSONDataResponse)
+
+    rows = artwork_values(artworks, fields, expand)
+    paginator = KeysetPagination(ordering=('-date', '-id'))
+    try:
+        page = await paginator.apaginate_queryset(rows, request)
+    except NotFound as ex:
+        return JSONDataResponse({'detail': str(ex.detail)}, status=status.HTTP_404_NOT_FOUND)
+    if page is not None:
+        data = paginator.get_paginated_data(await aartwork_data(page, fields, expand))
+    else:
+        data = await aartwork_data([row async for row in rows], fields, expand)
+    return set_validators(JSONDataResponse(data), etag, last_modified)
+
+
+@athrottle('artwork', 'retrieve')
+@acache_response('artwork:retrieve', Artwork, ArtworkTag, Tag, Artist, User)
+async def retrieve_artwork(request, pk):
+    """ArtworkView.retrieve, always through the plain-dict serializer"""
+    try:
+        fields, expand = sparse_fieldset(request.GET)
+    except ValueError as ex:
+        return JSONDataResponse({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+    rows = [row async for row in artwork_values(Artwork.objects.filter(pk=pk), fields, expand)]
+    if not rows:
+        return JSONDataResponse({'message': 'Artwork matching query does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+    return JSONDataResponse((await aartwork_data(rows, fields, expand))[0])
+
+
+@athrottle('tag', 'list')
+@acache_response('tag:list', Tag, ArtworkTag, Artwork, Artist, User)
+async def list_tags(request):
+    """TagView.list without ?with_counts"""
+    try:
+        top = read_top(request.GET.get('top', None))
+    except ValueError as ex:
+        return JSONDataResponse({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+    tags = labels_starting_with(Tag.objects.all(), request.GET.get('prefix', '').strip().lower())
+    return JSONDataResponse([tag async for tag in tags[:top].values('id', 'label')])
+
+
+@athrottle('check_user')
+async def resolve_user(request):
+    """check_user"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError as ex:
+            return JSONDataResponse({'detail': f'JSON parse error - {ex}'}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        data = request.POST
+
+    user = await aresolve_uid(data['uid'])
+    if user is None:
+        return JSONDataResponse({'valid': False})
+    return JSONDataResponse({'id': user.id, 'uid': user.uid, 'name': user.name})
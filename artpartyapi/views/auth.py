@@ -1,3 +1,4 @@
+from artpartyapi.authentication import resolve_uid
 from artpartyapi.models import User
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -9,9 +10,8 @@ def check_user(request):
     Method arguments: request -- The full HTTP request object'''
     uid = request.data['uid']
 
-    # Use the built-in authenticate method to verify
-    # authenticate returns the user object or None if no user is found
-    user = User.objects.filter(uid=uid).first()
+    # Resolved through the uid cache, so repeat checks skip the database
+    user = resolve_uid(uid)
 
     # If authentication was successful, respond with their token
     if user is not None:
@@ -33,9 +33,10 @@ def register_user(request):
     Method arguments: request -- The full HTTP request object'''
 
     # Now save the user info in the artpartyapi_user table
-    user = User.objects.create(
-        name=request.data['name'],
-        uid=request.data['uid']
+    # uids are unique, so registering twice returns the existing user
+    user, created = User.objects.get_or_create(
+        uid=request.data['uid'],
+        defaults={'name': request.data['name']},
     )
 
     # Return the user info to the client
@@ -0,0 +1,27 @@
+from artparty.routers import read_from_primary
+from artpartyapi.changelog import changes_since
+from artpartyapi.models import User
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+
+@api_view(['GET'])
+def sync(request):
+    '''Sends what changed since the client's last sync: the artworks,
+    artists, tags and artwork tags created or updated, and the ids of
+    those deleted. Without ?since= (or with an expired token) it sends
+    everything, a page at a time, with reset set on the first page. ?user=
+    limits artworks and artists to one user's, and artwork tags to theirs.
+    Method arguments: request -- The full HTTP request object'''
+    user_id = request.query_params.get('user', None)
+    if user_id and not User.objects.filter(id=user_id).exists():
+        return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    # A lagging replica could hand out a token past changes it hasn't received yet
+    with read_from_primary():
+        try:
+            data = changes_since(request.query_params.get('since', None), user_id or None)
+        except ValueError as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(data)
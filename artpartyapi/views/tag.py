@@ -1,14 +1,20 @@
 """View module for handling requests about game types"""
+from django.db import connections
+from django.db.models.functions import Lower
 from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
-from artpartyapi.models import Tag
+from artpartyapi.models import Artist, Artwork, ArtworkTag, Tag, User
+from artpartyapi.cache import cache_response
+from artpartyapi.counters import tag_usage
+from artpartyapi.fastserializers import tag_data
 
 
 class TagView(ViewSet):
     """Tag view"""
 
+    @cache_response(Tag)
     def retrieve(self, request, pk):
         """Handle GET requests for single tag
         Returns: Response -- JSON serialized tag"""
@@ -20,12 +26,48 @@ class TagView(ViewSet):
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
 
 
+    @cache_response(Tag, ArtworkTag, Artwork, Artist, User)
     def list(self, request):
-        """Handle GET requests to get all tags
+        """Handle GET requests to get all tags. ?prefix= narrows them to labels
+        starting with it, ?with_counts=true adds how many artworks use each
+        (most used first, optionally within ?user= or ?artist=), and ?top= caps the list
         Returns: Response -- JSON serialized list of tags"""
-        tags = Tag.objects.all()
-        serializer = TagSerializer(tags, many=True)
-        return Response(serializer.data)
+        prefix = request.query_params.get('prefix', '').strip().lower()
+        with_counts = request.query_params.get('with_counts', '').lower() == 'true'
+        user_id = request.query_params.get('user', None)
+        artist_id = request.query_params.get('artist', None)
+        top = request.query_params.get('top', None)
+
+        try:
+            top = read_top(top)
+        except ValueError as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        tags = labels_starting_with(Tag.objects.all(), prefix)
+
+        if not with_counts:
+            return Response(tag_data(tags[:top]))
+
+        if user_id or artist_id:
+            # Scoped counts sum the pre-aggregated TagUsage rows
+            scope = {}
+            if user_id:
+                if not User.objects.filter(id=user_id).exists():
+                    return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+                scope['user'] = user_id
+            if artist_id:
+                if not Artist.objects.filter(id=artist_id).exists():
+                    return Response({'message': 'Artist not found'}, status=status.HTTP_404_NOT_FOUND)
+                scope['artist'] = artist_id
+            if prefix:
+                scope['tag__in'] = tags
+            return Response(tag_usage(**scope)[:top])
+
+        tags = tags.order_by('-usage_count', 'label')
+        return Response([
+            {'id': tag_id, 'label': label, 'count': count}
+            for tag_id, label, count in tags.values_list('id', 'label', 'usage_count')[:top]
+        ])
     
     
     def create(self, request):
@@ -46,6 +88,37 @@ class TagView(ViewSet):
         
 
 
+def read_top(top):
+    """The ?top= limit as a number, or None; raises ValueError unless it is positive"""
+    if top is None:
+        return None
+    try:
+        top = int(top)
+        if top < 1:
+            raise ValueError
+    except ValueError:
+        raise ValueError('top must be a positive number') from None
+    return top
+
+
+def labels_starting_with(tags, prefix):
+    """Tags whose lowercased label starts with `prefix`, by label"""
+    if not prefix:
+        return tags
+    tags = tags.alias(label_key=Lower('label'))
+    # The range below assumes text compares byte by byte, as under SQLite's
+    # default BINARY collation. PostgreSQL compares by the locale's collation,
+    # where the range can miss or take in other labels
+    if connections[tags.db].vendor != 'sqlite' or not prefix.isascii():
+        # SQLite's lower() only folds ASCII, so it and Python's str.lower()
+        # disagree about other letters; let the database match those itself
+        return tags.filter(label__istartswith=prefix).order_by('label_key')
+    # A range on lower(label) seeks tag_label_lower_idx, where LIKE 'x%' would scan
+    return tags.filter(
+        label_key__gte=prefix, label_key__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1),
+    ).order_by('label_key')
+
+
 class TagSerializer(serializers.ModelSerializer):
     """JSON serializer for tags"""
     class Meta:
@@ -0,0 +1,25 @@
+from django.http import FileResponse, HttpResponseNotFound, HttpResponseRedirect
+from django.views.decorators.http import require_safe
+from artpartyapi import images
+from artpartyapi.models import Image
+from artpartyapi.thumbnails import get_store
+
+
+@require_safe
+def thumbnail(request, content_hash, size):
+    """Serves a thumbnail from the store. Thumbnails never change, so
+    clients may keep them forever. One that was evicted redirects to the
+    original while a job writes it again.
+    Returns: FileResponse -- the JPEG, or a redirect or 404"""
+    size = int(size)
+    file = get_store().open(content_hash, size)
+    if file is not None:
+        response = FileResponse(file, content_type='image/jpeg')
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    image = Image.objects.filter(content_hash=content_hash, status=Image.READY).first()
+    if image is None or size not in image.thumbnails:
+        return HttpResponseNotFound()
+    images.queue([image.id])
+    return HttpResponseRedirect(image.url)
@@ -3,7 +3,11 @@ from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
-from artpartyapi.models import User
+from rest_framework.decorators import action
+from artpartyapi.models import Artist, Artwork, ArtworkTag, Tag, User
+from artpartyapi.cache import cache_response
+from artpartyapi.counters import owner_stats
+from artpartyapi.pagination import KeysetPagination
 
 
 class UserView(ViewSet):
@@ -24,6 +28,12 @@ class UserView(ViewSet):
         """Handle GET requests to get all users
         Returns: Response -- JSON serialized list of users"""
         users = User.objects.all()
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(users, request)
+        if page is not None:
+            serializer = UserSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
         serializer = UserSerializer(users, many=True)
         return Response(serializer.data)
     
@@ -32,6 +42,9 @@ class UserView(ViewSet):
         """Handle POST operations
         Returns Response -- JSON serialized user instance"""
 
+        if User.objects.filter(uid=request.data["uid"]).exists():
+            return Response({'message': 'A user with this uid already exists'}, status=status.HTTP_400_BAD_REQUEST)
+
         user = User.objects.create(
             name=request.data["name"],
             uid=request.data["uid"],
@@ -44,6 +57,17 @@ class UserView(ViewSet):
         user = User.objects.get(pk=pk)
         user.delete()
         return Response(None, status=status.HTTP_204_NO_CONTENT)
+
+    @action(methods=['get'], detail=True)
+    @cache_response(Artist, Artwork, ArtworkTag, Tag, User)
+    def stats(self, request, pk):
+        """Handle GET requests for a user's profile stats
+        Returns: Response -- counts of the artworks they posted, tags by use and the latest artwork"""
+        try:
+            user = User.objects.get(pk=pk)
+        except User.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+        return Response(owner_stats(user, 'user'))
         
 
 
@@ -51,5 +75,5 @@ class UserSerializer(serializers.ModelSerializer):
     """JSON serializer for users"""
     class Meta:
         model = User
-        fields = ('id', 'name', 'uid')
+        fields = ('id', 'name')
         depth = 1